@@ -14,6 +14,7 @@ class Settings(BaseSettings):
     app_name: str = "Fintech Thesis API"
     environment: str = "development"
     debug: bool = True
+    web_concurrency: int = 1
 
     db_host: str = "127.0.0.1"
     db_port: int = 5432
@@ -45,6 +46,34 @@ class Settings(BaseSettings):
     cors_allowed_origins: str = "http://localhost:5173,http://localhost:3000"
     coincap_base_url: str = "https://api.coincap.io/v2"
     coincap_api_key: str | None = None
+    coincap_timeout_seconds: float = 15.0
+    http_pool_max_connections: int = 20
+    http_pool_max_keepalive_connections: int = 10
+    http_pool_keepalive_expiry_seconds: float = 30.0
+    http2_enabled: bool = True
+    market_ingestion_enabled: bool = True
+    market_ingestion_interval_seconds: float = 60.0
+    market_partition_months_ahead: int = 3
+    market_history_retention_months: int = 12
+    market_stream_max_clients: int = 1000
+    market_stream_heartbeat_seconds: float = 15.0
+    market_shared_cache_enabled: bool = True
+    market_shared_cache_lease_seconds: float = 30.0
+    market_shared_cache_max_wait_seconds: float = 2.0
+    account_write_sequencer_enabled: bool = True
+    account_write_queue_max: int = 32
+    quote_signing_secret: str | None = None
+    quote_ttl_seconds: int = 15
+    quote_required: bool = True
+    order_queue_workers: int = 0
+    order_queue_batch_size: int = 20
+    order_queue_poll_interval_seconds: float = 1.0
+    fx_provider: str = "frankfurter"
+    fx_base_url: str = "https://api.frankfurter.app"
+    fx_rates_file: str | None = None
+    fx_timeout_seconds: float = 10.0
+    fx_refresh_interval_seconds: float = 3600.0
+    fx_fallback_usd_eur_rate: float = 0.92
     keycloak_base_url: str = "http://localhost:8080"
     keycloak_realm: str = "thesis"
     keycloak_admin_client_id: str | None = None
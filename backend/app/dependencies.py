@@ -2,17 +2,22 @@
 
 from __future__ import annotations
 
+from contextlib import asynccontextmanager
 from dataclasses import dataclass
 from functools import lru_cache
-from typing import Any, Iterable
+from typing import Any, AsyncIterator, Iterable
+from uuid import UUID
 
 from fastapi import Depends, HTTPException, Request, status
 from fastapi.security import HTTPAuthorizationCredentials, HTTPBearer
 
 from .config import Settings, get_settings
 from .oidc import DecodedAccessToken, KeycloakTokenVerifier, OIDCConfigurationError, TokenVerificationError
+from .services.account_sequencer import AccountQueueFullError, AccountWriteSequencer
 
 DEFAULT_USER_ID = "aaaaaaaa-1111-2222-3333-444444444444"
+# Scope (o ruolo realm) richiesto dagli endpoint operativi con dettagli interni, es. `/health/upstream`.
+ADMIN_SCOPE = "admin"
 _bearer_scheme = HTTPBearer(auto_error=False)
 _DEFAULT_TOKEN_ALGORITHMS: tuple[str, ...] = ("RS256",)
 
@@ -170,3 +175,44 @@ def require_scope(required_scope: str):
         return user
 
     return _require_scope
+
+
+@asynccontextmanager
+async def account_write_slot(
+    request: Request,
+    user: AuthenticatedUser,
+    account_id: UUID | str,
+) -> AsyncIterator[None]:
+    """
+    Attende il turno delle scritture sul conto prima di prendere una connessione dal pool.
+
+    Va usato da dipendenze dichiarate prima di `get_connection_with_rls`: le richieste concorrenti sullo stesso
+    conto restano in coda in memoria invece di occupare ciascuna una connessione bloccata su `FOR UPDATE`.
+    Il turno è preso prima di verificare la proprietà del conto, quindi la coda è per utente e conto: un
+    `account_id` altrui riempie solo la coda di chi lo invia, non quella del titolare.
+
+    Argomenti:
+        request: Richiesta corrente, da cui si ricava il sequenziatore dell'applicazione.
+        user: Utente autenticato che invia la richiesta.
+        account_id: Conto su cui la richiesta scrive.
+
+    Solleva:
+        HTTPException: 429 se la coda del conto è piena.
+    """
+    sequencer: AccountWriteSequencer | None = getattr(request.app.state, "account_sequencer", None)
+    if sequencer is None:
+        yield
+        return
+    key = f"{user.user_id}:{account_id}"
+    try:
+        await sequencer.acquire(key)
+    except AccountQueueFullError as exc:
+        raise HTTPException(
+            status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+            detail="Troppe operazioni in corso sul conto: riprovare tra poco.",
+            headers={"Retry-After": "1"},
+        ) from exc
+    try:
+        yield
+    finally:
+        sequencer.release(key)
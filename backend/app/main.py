@@ -1,13 +1,23 @@
 """Punto di ingresso dell'applicazione FastAPI."""
 
 from contextlib import asynccontextmanager
-from typing import AsyncIterator
+from typing import Any, AsyncIterator
 
-from fastapi import FastAPI
+from fastapi import Depends, FastAPI, Request
 from fastapi.middleware.cors import CORSMiddleware
 
 from .config import Settings, get_settings
 from .db import lifespan_pool
+from .dependencies import ADMIN_SCOPE, require_scope
+from .services import coincap, order_idempotency, portfolio
+from .services.account_sequencer import lifespan_account_sequencer
+from .services.crypto_registry import lifespan_crypto_registry
+from .services.fx import lifespan_fx_rates
+from .services.http_clients import lifespan_http_clients
+from .services.order_queue import lifespan_order_queue
+from .services.price_ingestion import lifespan_price_ingestor
+from .services.quotes import lifespan_quote_signer
+from .services.shared_cache import lifespan_shared_cache
 from .routes import (
     accounts_router,
     auth_router,
@@ -29,13 +39,30 @@ async def lifespan(app: FastAPI) -> AsyncIterator[None]:
         app: Istanza FastAPI su cui montare lo stato condiviso.
 
     Restituisce:
-        AsyncIterator[None]: Contesto asincrono che mantiene vivo il pool database.
+        AsyncIterator[None]: Contesto asincrono che mantiene vivi pool database, client HTTP, registro crypto, tassi di cambio, cache condivisa e worker dei prezzi.
     """
     settings = get_settings()
     app.state.settings = settings
-    async with lifespan_pool(settings) as pool:
+    async with lifespan_pool(settings) as pool, lifespan_http_clients(settings) as http_clients:
         app.state.db_pool = pool
-        yield
+        app.state.http_clients = http_clients
+        async with (
+            lifespan_crypto_registry(settings, pool) as crypto_registry,
+            lifespan_account_sequencer(settings) as account_sequencer,
+            lifespan_quote_signer(settings) as quote_signer,
+            lifespan_order_queue(settings, pool) as order_queue,
+            lifespan_fx_rates(settings) as fx_rates,
+            lifespan_shared_cache(settings, pool) as shared_cache,
+            lifespan_price_ingestor(settings, pool, shared_cache) as price_ingestor,
+        ):
+            app.state.crypto_registry = crypto_registry
+            app.state.account_sequencer = account_sequencer
+            app.state.quote_signer = quote_signer
+            app.state.order_queue = order_queue
+            app.state.fx_rates = fx_rates
+            app.state.shared_cache = shared_cache
+            app.state.price_ingestor = price_ingestor
+            yield
 
 
 def create_app() -> FastAPI:
@@ -75,6 +102,34 @@ def create_app() -> FastAPI:
             "environment": settings.environment,
         }
 
+    @app.get("/health/upstream", tags=["health"], dependencies=[Depends(require_scope(ADMIN_SCOPE))])
+    async def upstream_health(request: Request) -> dict[str, Any]:
+        """
+        Espone le statistiche dei pool di connessione verso i servizi esterni.
+
+        Riservato allo scope amministrativo: include dettagli interni (proprietario del lease, tassi FX, code).
+
+        Restituisce:
+            dict[str, Any]: Statistiche dei pool HTTP, delle protezioni CoinCap (coalescenza, cache, circuit breaker) e dello streaming.
+        """
+        return {
+            "http_clients": request.app.state.http_clients.stats(),
+            "coincap_singleflight": coincap.singleflight_stats(),
+            "coincap_cache": coincap.cache_stats(),
+            "coincap_breaker": coincap.breaker_stats(),
+            "market_shared_cache": coincap.shared_cache_stats(),
+            "crypto_registry": request.app.state.crypto_registry.stats(),
+            "fx_rates": request.app.state.fx_rates.stats(),
+            "portfolio_ledger_cache": portfolio.ledger_cache_stats(),
+            "recent_orders_cache": order_idempotency.recent_orders_stats(),
+            "account_sequencer": (
+                request.app.state.account_sequencer.stats() if request.app.state.account_sequencer else None
+            ),
+            "quotes": request.app.state.quote_signer.stats(),
+            "order_queue": request.app.state.order_queue.stats() if request.app.state.order_queue else None,
+            "market_stream": request.app.state.price_ingestor.broadcaster.stats(),
+        }
+
     app.include_router(auth_router)
     app.include_router(accounts_router)
     app.include_router(crypto_positions_router)
@@ -2,12 +2,13 @@
 
 from __future__ import annotations
 
+from typing import AsyncIterator
 from uuid import UUID
 
-from fastapi import APIRouter, Depends, HTTPException, status
+from fastapi import APIRouter, Depends, HTTPException, Request, status
 from psycopg import AsyncConnection
 
-from ..dependencies import AuthenticatedUser, require_scope
+from ..dependencies import AuthenticatedUser, account_write_slot, get_authenticated_user, require_scope
 from ..db import get_connection_with_rls
 from ..schemas import AccountListResponse, AccountOut, AccountTopUpOut, AccountTopUpRequest
 
@@ -46,6 +47,16 @@ async def list_accounts(
     return AccountListResponse(data=accounts)
 
 
+async def _topup_write_slot(
+    request: Request,
+    account_id: UUID,
+    user: AuthenticatedUser = Depends(get_authenticated_user),
+) -> AsyncIterator[None]:
+    """Turno di scrittura sul conto della ricarica, preso prima della connessione."""
+    async with account_write_slot(request, user, account_id):
+        yield
+
+
 @router.post(
     "/{account_id}/topup",
     response_model=AccountOut,
@@ -55,6 +66,7 @@ async def topup_account(
     account_id: UUID,
     payload: AccountTopUpRequest,
     user: AuthenticatedUser = Depends(require_scope("transactions:write")),
+    _slot: None = Depends(_topup_write_slot),
     conn: AsyncConnection = Depends(get_connection_with_rls),
 ) -> AccountOut:
     """
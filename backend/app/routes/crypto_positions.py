@@ -2,15 +2,18 @@
 
 from __future__ import annotations
 
+from datetime import timedelta
 from decimal import Decimal, InvalidOperation
 from typing import List
 
-from fastapi import APIRouter, Depends, status
+import numpy as np
+from fastapi import APIRouter, Depends, HTTPException, Query, status
 from psycopg import AsyncConnection
 
 from ..dependencies import AuthenticatedUser, require_scope
 from ..db import get_connection_with_rls
 from ..schemas import CryptoPositionListResponse, CryptoPositionOut
+from ..services import portfolio
 
 router = APIRouter(prefix="/crypto-positions", tags=["Crypto Positions"])
 
@@ -107,3 +110,38 @@ async def list_crypto_positions(
         )
 
     return CryptoPositionListResponse(data=positions, total_eur_value=total_value)
+
+
+@router.get(
+    "/history",
+    status_code=status.HTTP_200_OK,
+)
+async def get_portfolio_history(
+    days: int = Query(default=30, ge=1, le=30),
+    interval: str = Query(default="1h", pattern="^(1m|15m|1h|1d)$"),
+    conn: AsyncConnection = Depends(get_connection_with_rls),
+    user: AuthenticatedUser = Depends(require_scope("crypto:read")),
+) -> dict:
+    """
+    Restituisce l'andamento del valore complessivo delle posizioni crypto dell'utente.
+
+    Argomenti:
+        days: Ampiezza della finestra in giorni.
+        interval: Passo della griglia temporale (`1m`, `15m`, `1h`, `1d`).
+        conn: Connessione asincrona con RLS preconfigurata.
+        user: Contesto autenticato di cui ricostruire il portafoglio.
+
+    Restituisce:
+        dict: Serie colonnare `{interval, timestamps, values}` con timestamp in millisecondi e valori in EUR.
+    """
+    try:
+        timestamps, values = await portfolio.load_portfolio_history(
+            conn, user.user_id, timedelta(days=days), interval
+        )
+    except ValueError as exc:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(exc)) from exc
+    return {
+        "interval": interval,
+        "timestamps": timestamps.tolist(),
+        "values": np.round(values, 2).tolist(),
+    }
@@ -2,60 +2,86 @@
 
 from __future__ import annotations
 
+import asyncio
+import logging
 from datetime import timedelta
+from typing import AsyncIterator, Awaitable
 from decimal import Decimal
-from uuid import uuid4
+from uuid import UUID, uuid4
 
-from fastapi import APIRouter, Depends, HTTPException, Query, status
+import httpx
+from fastapi import APIRouter, Depends, Header, HTTPException, Query, Request, Response, status
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse, StreamingResponse
 from psycopg import AsyncConnection
+from psycopg_pool import AsyncConnectionPool
+from psycopg.types.json import Jsonb, set_json_loads
 
-from ..dependencies import AuthenticatedUser, require_scope
-from ..db import get_connection, get_connection_with_rls
+from ..config import get_settings
+from ..dependencies import AuthenticatedUser, account_write_slot, get_authenticated_user, require_scope
+from ..db import get_connection_with_rls
 from ..schemas import (
     AccountOut,
+    CryptoOrderBatchRequest,
+    CryptoOrderBatchResponse,
     CryptoOrderRequest,
     CryptoOrderResponse,
+    CryptoOrderStatusOut,
     CryptoPositionOut,
+    CryptoQuoteOut,
     TransactionOut,
 )
-from ..services import coincap
+from ..services import coincap, crypto_registry, downsampling, fx, order_idempotency, order_queue, rollups
+from ..services.broadcast import PriceBroadcaster, Subscription
+from ..services.circuit_breaker import CircuitOpenError
+from ..services.etags import etag_matches, strong_etag
+from ..services.price_history import (
+    HISTORY_BINARY,
+    HISTORY_COLUMNAR,
+    HISTORY_JSON,
+    PriceSeries,
+    negotiate_history_format,
+)
+from ..services.price_ingestion import PriceIngestor, load_latest_snapshot
+from ..services.quotes import Quote, QuoteError, QuoteSigner
 
 
 router = APIRouter(prefix="/market", tags=["Market"])
-
-
-async def _fetch_account(conn: AsyncConnection, account_id: str, user_id: str) -> dict[str, object] | None:
-    async with conn.cursor() as cur:
-        await cur.execute(
-            """
-            SELECT id, user_id, currency, balance, name, created_at
-            FROM accounts
-            WHERE id = %s AND user_id = %s
-            FOR UPDATE
-            """,
-            (account_id, user_id),
-        )
-        row = await cur.fetchone()
-    return dict(row) if row else None
-
-
-async def _fetch_position(
-    conn: AsyncConnection,
-    user_id: str,
-    symbol: str,
-) -> dict[str, object] | None:
-    async with conn.cursor() as cur:
-        await cur.execute(
-            """
-            SELECT *
-            FROM user_crypto_positions
-            WHERE user_id = %s AND asset_symbol = %s
-            FOR UPDATE
-            """,
-            (user_id, symbol),
-        )
-        row = await cur.fetchone()
-    return dict(row) if row else None
+logger = logging.getLogger(__name__)
+
+# Errori che indicano CoinCap non raggiungibile (o circuito aperto) e attivano il fallback locale.
+_UPSTREAM_ERRORS = (CircuitOpenError, httpx.HTTPError)
+
+# Esiti di `execute_crypto_order` (e della variante idempotente) che rifiutano l'ordine senza modifiche.
+_ORDER_REJECTIONS: dict[str, tuple[int, str]] = {
+    "account_not_found": (status.HTTP_404_NOT_FOUND, "Conto non trovato."),
+    "unsupported_currency": (status.HTTP_400_BAD_REQUEST, "Operazioni disponibili solo per conti EUR."),
+    "insufficient_balance": (status.HTTP_400_BAD_REQUEST, "Saldo insufficiente per completare l'acquisto."),
+    "insufficient_position": (
+        status.HTTP_400_BAD_REQUEST,
+        "Posizione insufficiente per vendere la quantità richiesta.",
+    ),
+    "idempotency_conflict": (status.HTTP_409_CONFLICT, "Chiave di idempotenza già usata per un ordine diverso."),
+    "conflicting_legs": (
+        status.HTTP_400_BAD_REQUEST,
+        "Un batch non può acquistare e vendere lo stesso asset.",
+    ),
+}
+
+
+_POSITION_QUERY = """
+    SELECT *
+    FROM user_crypto_positions
+    WHERE user_id = %s AND asset_symbol = %s
+"""
+
+_TRANSACTIONS_QUERY = """
+    SELECT id, user_id, account_id, amount, currency, category, idem_key, direction, created_at
+    FROM transactions
+    WHERE user_id = %s AND category = %s
+    ORDER BY created_at DESC
+    LIMIT %s
+"""
 
 
 async def _fetch_transactions(
@@ -65,16 +91,7 @@ async def _fetch_transactions(
     limit: int = 10,
 ) -> list[dict[str, object]]:
     async with conn.cursor() as cur:
-        await cur.execute(
-            """
-            SELECT id, user_id, account_id, amount, currency, category, idem_key, direction, created_at
-            FROM transactions
-            WHERE user_id = %s AND category = %s
-            ORDER BY created_at DESC
-            LIMIT %s
-            """,
-            (user_id, category, limit),
-        )
+        await cur.execute(_TRANSACTIONS_QUERY, (user_id, category, limit))
         rows = await cur.fetchall()
     return [dict(row) for row in rows]
 
@@ -104,6 +121,13 @@ def _to_account_out(record: dict[str, object]) -> AccountOut:
     )
 
 
+def _to_order_response(account: dict[str, object], position: dict[str, object] | None) -> CryptoOrderResponse:
+    return CryptoOrderResponse(
+        account=_to_account_out(account),
+        position=_to_position_out(position) if position else None,
+    )
+
+
 def _to_position_out(record: dict[str, object]) -> CryptoPositionOut:
     return CryptoPositionOut(
         id=record["id"],
@@ -122,295 +146,692 @@ def _to_position_out(record: dict[str, object]) -> CryptoPositionOut:
     )
 
 
-async def _load_crypto_symbol_map(conn: AsyncConnection, symbols: set[str]) -> dict[str, str]:
-    if not symbols:
-        return {}
-    async with conn.cursor() as cur:
-        await cur.execute(
-            "SELECT id, UPPER(symbol) AS symbol FROM crypto WHERE UPPER(symbol) = ANY(%s);",
-            (list(symbols),),
-        )
-        rows = await cur.fetchall()
-    return {row["symbol"]: row["id"] for row in rows}
-
-
-async def _fetch_crypto_metadata(conn: AsyncConnection, crypto_id: str) -> dict[str, object] | None:
-    async with conn.cursor() as cur:
-        await cur.execute(
-            """
-            SELECT id, symbol, name, explorer_url
-            FROM crypto
-            WHERE id = %s
-            """,
-            (crypto_id,),
-        )
-        row = await cur.fetchone()
-    return dict(row) if row else None
-
-
-async def _load_variation_history(
+async def _load_raw_variation_history(
     conn: AsyncConnection,
     crypto_id: str,
     window: timedelta,
-) -> list[dict[str, object]]:
-    if window <= timedelta(0):
-        window = timedelta(days=1)
+) -> PriceSeries:
     async with conn.cursor() as cur:
         await cur.execute(
             """
             SELECT
-                (EXTRACT(EPOCH FROM created_at) * 1000)::BIGINT AS ts_ms,
-                price
+                array_agg((EXTRACT(EPOCH FROM created_at) * 1000)::BIGINT ORDER BY created_at) AS timestamps,
+                array_agg(price::DOUBLE PRECISION ORDER BY created_at) AS prices
             FROM crypto_variation
             WHERE crypto_id = %s
               AND created_at >= NOW() - %s
-            ORDER BY created_at ASC
             """,
             (crypto_id, window),
         )
-        rows = await cur.fetchall()
-    return [
-        {
-            "timestamp": int(row["ts_ms"]),
-            "price": float(row["price"]),
-        }
-        for row in rows
-    ]
-
+        row = await cur.fetchone()
+    return PriceSeries.from_columns(row["timestamps"], row["prices"])
 
-async def _refresh_price_snapshots(conn: AsyncConnection, symbols: list[str]) -> dict[str, Decimal]:
-    upper_symbols = {symbol.upper() for symbol in symbols if symbol}
-    if not upper_symbols:
-        return {}
 
-    symbol_map = await _load_crypto_symbol_map(conn, upper_symbols)
-    recorded: dict[str, Decimal] = {}
-    inserted = False
-    async with conn.cursor() as cur:
-        for symbol in upper_symbols:
-            crypto_id = symbol_map.get(symbol)
-            if not crypto_id:
-                continue
-            price = await coincap.fetch_price_by_symbol(symbol)
-            recorded[symbol] = price
-            await cur.execute(
-                "INSERT INTO crypto_variation (crypto_id, price) VALUES (%s, %s);",
-                (crypto_id, price),
+async def _complete_history(
+    conn: AsyncConnection,
+    asset_id: str,
+    days: int,
+    history: PriceSeries,
+    max_points: int | None,
+) -> PriceSeries:
+    if not len(history):
+        # Rollup non ancora popolate (es. dati grezzi appena importati): si legge la tabella sorgente.
+        history = await _load_raw_variation_history(conn, asset_id, timedelta(days=days))
+    if not len(history):
+        try:
+            # Le rollup sono già in EUR, lo storico CoinCap è in USD.
+            history = fx.get_rates().convert_series(
+                PriceSeries.from_points(await coincap.fetch_history(asset_id, days=days))
             )
-            inserted = True
-    if inserted:
-        await conn.commit()
-    return recorded
+        except _UPSTREAM_ERRORS as exc:
+            logger.warning("CoinCap history unavailable for %s: %s", asset_id, exc)
+    if max_points is not None:
+        history = history.downsample(max_points)
+    return history
+
+
+async def _load_history_series(
+    conn: AsyncConnection,
+    asset_id: str,
+    days: int,
+    max_points: int | None,
+) -> PriceSeries:
+    window = timedelta(days=days)
+    history = await rollups.load_rollup_history(conn, asset_id, window, rollups.select_resolution(window))
+    return await _complete_history(conn, asset_id, days, history, max_points)
+
+
+async def _load_asset_holdings_rows(
+    conn: AsyncConnection,
+    symbol: str,
+    user_id: str,
+) -> tuple[dict[str, object] | None, list[dict[str, object]]]:
+    # Pipeline mode: le due letture partono insieme e il primo fetch le sincronizza in un solo round trip.
+    # La posizione è letta senza FOR UPDATE: la lettura non deve attendere gli ordini in corso.
+    async with conn.pipeline():
+        async with conn.cursor() as position_cur, conn.cursor() as transactions_cur:
+            await position_cur.execute(_POSITION_QUERY, (user_id, symbol))
+            await transactions_cur.execute(_TRANSACTIONS_QUERY, (user_id, symbol, 10))
+            position_row = await position_cur.fetchone()
+            transactions_rows = await transactions_cur.fetchall()
+    return dict(position_row) if position_row else None, [dict(row) for row in transactions_rows]
+
+
+def _asset_etag(request: Request, asset_id: str, days: int, max_points: int | None, media_type: str) -> str | None:
+    """
+    ETag del dettaglio di mercato di un asset, calcolato solo da versioni in memoria.
+
+    Il tick del broadcaster versiona anche lo storico (le rollup sono scritte nello stesso tick), lo snapshot
+    CoinCap è versionato dal suo hash di contenuto. Senza snapshot in cache (processo appena avviato) non c'è
+    una versione affidabile e si restituisce None.
+    """
+    snapshot_etag = coincap.snapshot_etag()
+    if snapshot_etag is None:
+        return None
+    ingestor: PriceIngestor = request.app.state.price_ingestor
+    tick = ingestor.broadcaster.latest
+    return strong_etag(
+        tick.etag if tick else None,
+        snapshot_etag,
+        fx.get_rates().version,
+        crypto_registry.get_registry().version,
+        asset_id,
+        days,
+        max_points,
+        media_type,
+    )
+
+
+async def _load_market_snapshot(
+    request: Request,
+    conn: AsyncConnection,
+    upstream: Awaitable[list[dict]],
+) -> list[dict]:
+    try:
+        return fx.get_rates().convert_snapshot(await upstream)
+    except _UPSTREAM_ERRORS as exc:
+        # CoinCap degradato: si risponde subito con l'ultimo snapshot noto invece di attendere l'upstream.
+        logger.warning("CoinCap snapshot unavailable, serving last known prices: %s", exc)
+    ingestor: PriceIngestor = request.app.state.price_ingestor
+    return ingestor.latest() or await load_latest_snapshot(conn)
+
+
+def _negotiate_or_406(accept: str | None, supported: tuple[str, ...]) -> str:
+    media_type = negotiate_history_format(accept, supported)
+    if media_type is None:
+        raise HTTPException(
+            status_code=status.HTTP_406_NOT_ACCEPTABLE,
+            detail=f"Formati disponibili: {', '.join(supported)}.",
+        )
+    return media_type
+
+
+def _not_modified(etag: str) -> Response:
+    return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers={"ETag": etag, "Cache-Control": "no-cache"})
 
 
 @router.get(
     "/prices",
     status_code=status.HTTP_200_OK,
+    response_model=None,
 )
 async def list_market_prices(
-    conn: AsyncConnection = Depends(get_connection),
-) -> dict:
-    """Restituisce i prezzi correnti delle crypto supportate."""
-    data = await coincap.fetch_market_snapshot()
-    price_snapshots = await _refresh_price_snapshots(conn, [item["symbol"] for item in data])
-    for entry in data:
-        symbol = entry["symbol"].upper()
-        if symbol in price_snapshots:
-            entry["price"] = float(price_snapshots[symbol])
-    return {"data": data}
+    request: Request,
+    if_none_match: str | None = Header(default=None),
+) -> dict | Response:
+    """
+    Restituisce i prezzi correnti delle crypto supportate dallo snapshot pubblicato dal worker di ingestion.
+
+    Il corpo è quello già serializzato dal broadcaster e l'ETag ne deriva: con `If-None-Match` corrispondente
+    si risponde 304 senza serializzare nulla.
+    """
+    ingestor: PriceIngestor = request.app.state.price_ingestor
+    tick = ingestor.broadcaster.latest
+    if tick is None:
+        return {"data": ingestor.latest()}
+    if etag_matches(if_none_match, tick.etag):
+        return _not_modified(tick.etag)
+    return Response(
+        content=tick.payload,
+        media_type="application/json",
+        headers={"ETag": tick.etag, "Cache-Control": "no-cache"},
+    )
+
+
+async def _price_events(
+    request: Request,
+    broadcaster: PriceBroadcaster,
+    subscription: Subscription,
+    heartbeat_seconds: float,
+) -> AsyncIterator[bytes]:
+    try:
+        while not await request.is_disconnected():
+            tick = await subscription.next(timeout=heartbeat_seconds)
+            if tick is None:
+                # Commento SSE: mantiene viva la connessione attraverso proxy e load balancer.
+                yield b": keep-alive\n\n"
+                continue
+            yield b"event: prices\nid: %d\ndata: %s\n\n" % (tick.sequence, tick.payload)
+    finally:
+        broadcaster.unsubscribe(subscription)
+
+
+@router.get(
+    "/stream",
+    status_code=status.HTTP_200_OK,
+    response_class=StreamingResponse,
+)
+async def stream_market_prices(request: Request) -> StreamingResponse:
+    """
+    Stream Server-Sent Events degli snapshot di prezzo pubblicati dal worker di ingestion.
+
+    Ogni client riceve subito l'ultimo snapshot e poi un evento `prices` per tick; se il client è lento i tick
+    intermedi vengono accorpati e viene consegnato solo il più recente.
+    """
+    ingestor: PriceIngestor = request.app.state.price_ingestor
+    try:
+        subscription = ingestor.broadcaster.subscribe()
+    except OverflowError as exc:
+        raise HTTPException(status_code=status.HTTP_503_SERVICE_UNAVAILABLE, detail=str(exc)) from exc
+    return StreamingResponse(
+        _price_events(request, ingestor.broadcaster, subscription, get_settings().market_stream_heartbeat_seconds),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
 
 
 @router.get(
     "/assets/{asset_identifier}",
     status_code=status.HTTP_200_OK,
+    response_model=None,
 )
 async def get_market_asset(
+    request: Request,
     asset_identifier: str,
     days: int = Query(default=7, ge=1, le=30),
+    max_points: int | None = Query(default=None, ge=downsampling.MIN_POINTS, le=5000),
+    accept: str | None = Header(default=None),
+    if_none_match: str | None = Header(default=None),
+    user: AuthenticatedUser = Depends(require_scope("accounts:read")),
+) -> dict | Response:
+    """
+    Dettaglio di mercato di una crypto: prezzo attuale e storico (eventualmente ridotto con LTTB).
+
+    Con `Accept: application/vnd.fintech.history.columnar+json` lo storico è restituito come array paralleli
+    `{timestamps, prices}` invece che come lista di punti. La risorsa non contiene dati dell'utente (vedi
+    `/market/assets/{id}/holdings`), quindi l'ETag deriva solo da versioni in memoria: un 304 non prende
+    connessioni dal pool né interroga l'upstream.
+    """
+    media_type = _negotiate_or_406(accept, (HISTORY_JSON, HISTORY_COLUMNAR))
+    reference = crypto_registry.get_registry().resolve(asset_identifier)
+    if reference is None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Asset non supportato.")
+    asset_id = reference.id
+
+    etag = _asset_etag(request, asset_id, days, max_points, media_type)
+    if etag is not None and etag_matches(if_none_match, etag):
+        return _not_modified(etag)
+
+    window = timedelta(days=days)
+    pool: AsyncConnectionPool = request.app.state.db_pool
+    async with pool.connection() as conn:
+        # Lo snapshot CoinCap viaggia in parallelo alla lettura dello storico.
+        snapshot_task = asyncio.create_task(coincap.fetch_market_snapshot())
+        try:
+            history = await rollups.load_rollup_history(conn, asset_id, window, rollups.select_resolution(window))
+        except BaseException:
+            snapshot_task.cancel()
+            raise
+        market_snapshot = await _load_market_snapshot(request, conn, snapshot_task)
+        asset = next((item for item in market_snapshot if item["id"] == asset_id), None)
+        if asset is None:
+            raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Asset non disponibile.")
+        history = await _complete_history(conn, asset_id, days, history, max_points)
+
+    # Copia: lo snapshot è condiviso con la cache CoinCap e con il worker di ingestion.
+    asset = {**asset, "explorer_url": reference.explorer_url}
+    # L'ETag è ricalcolato dopo il caricamento, così corrisponde allo snapshot effettivamente servito.
+    etag = _asset_etag(request, asset_id, days, max_points, media_type)
+    headers = {"Cache-Control": "no-cache", "Vary": "Accept"}
+    if etag is not None:
+        headers["ETag"] = etag
+
+    if media_type == HISTORY_COLUMNAR:
+        # Lo storico colonnare è già serializzabile: si evita il passaggio di jsonable_encoder su ogni punto.
+        return JSONResponse(
+            {"asset": jsonable_encoder(asset), "history": history.to_columns()},
+            media_type=HISTORY_COLUMNAR,
+            headers=headers,
+        )
+    return JSONResponse({"asset": jsonable_encoder(asset), "history": history.to_points()}, headers=headers)
+
+
+@router.get(
+    "/assets/{asset_identifier}/holdings",
+    status_code=status.HTTP_200_OK,
+)
+async def get_market_asset_holdings(
+    asset_identifier: str,
     conn: AsyncConnection = Depends(get_connection_with_rls),
     user: AuthenticatedUser = Depends(require_scope("accounts:read")),
 ) -> dict:
-    """Dettaglio di una crypto: prezzo attuale, storico, posizioni e transazioni utente."""
-    asset_id = coincap.normalize_asset_identifier(asset_identifier.lower())
-    if not asset_id:
+    """
+    Posizione e ultimi movimenti dell'utente su una crypto, separati dal dettaglio di mercato cacheabile.
+
+    Le due letture viaggiano in pipeline in un solo round trip e la posizione è letta senza lock.
+    """
+    reference = crypto_registry.get_registry().resolve(asset_identifier)
+    if reference is None:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Asset non supportato.")
+    position_row, transactions_rows = await _load_asset_holdings_rows(conn, reference.symbol, user.user_id)
+    return {
+        "position": _to_position_out(position_row).model_dump() if position_row else None,
+        "transactions": [_to_transaction_out(row).model_dump() for row in transactions_rows],
+    }
+
+
+@router.get(
+    "/assets/{asset_identifier}/history",
+    status_code=status.HTTP_200_OK,
+    responses={
+        200: {
+            "content": {
+                HISTORY_COLUMNAR: {},
+                HISTORY_BINARY: {"schema": {"type": "string", "format": "binary"}},
+            }
+        }
+    },
+)
+async def get_market_asset_history(
+    asset_identifier: str,
+    days: int = Query(default=7, ge=1, le=30),
+    max_points: int | None = Query(default=None, ge=downsampling.MIN_POINTS, le=5000),
+    accept: str | None = Header(default=None),
+    conn: AsyncConnection = Depends(get_connection_with_rls),
+    user: AuthenticatedUser = Depends(require_scope("accounts:read")),
+) -> Response:
+    """
+    Solo lo storico prezzi di una crypto, nel formato negoziato tramite `Accept`.
 
-    market_snapshot = await coincap.fetch_market_snapshot()
-    asset = next((item for item in market_snapshot if item["id"] == asset_id), None)
-    if asset is None:
-        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Asset non disponibile.")
+    - `application/json`: lista di punti `{timestamp, price}`;
+    - `application/vnd.fintech.history.columnar+json`: array paralleli `{timestamps, prices}`;
+    - `application/vnd.fintech.history.binary`: `uint64` numero di punti, poi `int64[n]` timestamp in ms
+      e `float64[n]` prezzi, tutto little-endian.
+    """
+    media_type = _negotiate_or_406(accept, (HISTORY_JSON, HISTORY_COLUMNAR, HISTORY_BINARY))
+    reference = crypto_registry.get_registry().resolve(asset_identifier)
+    if reference is None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Asset non supportato.")
 
-    metadata = await _fetch_crypto_metadata(conn, asset_id)
-    asset["explorer_url"] = metadata.get("explorer_url") if metadata else None
+    history = await _load_history_series(conn, reference.id, days, max_points)
+    if media_type == HISTORY_BINARY:
+        return Response(content=history.to_binary(), media_type=HISTORY_BINARY)
+    if media_type == HISTORY_COLUMNAR:
+        return JSONResponse(history.to_columns(), media_type=HISTORY_COLUMNAR)
+    return JSONResponse(history.to_points())
 
-    history_window = timedelta(days=days)
-    history = await _load_variation_history(conn, asset_id, history_window)
-    if not history:
-        history = await coincap.fetch_history(asset_id, days=days)
-    symbol = asset["symbol"]
-    position_row = await _fetch_position(conn, user.user_id, symbol)
-    transactions_rows = await _fetch_transactions(conn, user.user_id, symbol)
 
-    position_payload = _to_position_out(position_row).model_dump() if position_row else None
-    transactions_payload = [_to_transaction_out(row).model_dump() for row in transactions_rows]
+def _resolve_order_price(
+    request: Request, order: CryptoOrderRequest, user: AuthenticatedUser
+) -> tuple[Decimal, Quote | None]:
+    """
+    Determina il prezzo di un ordine: quello firmato nella quotazione dell'utente, oppure quello del client se ammesso.
 
-    return {
-        "asset": asset,
-        "history": history,
-        "position": position_payload,
-        "transactions": transactions_payload,
-    }
+    La verifica è solo un HMAC locale; la scadenza è controllata dal chiamante dopo l'eventuale replay idempotente.
+    """
+    if order.quote_token is None:
+        if request.app.state.settings.quote_required:
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST, detail="Ordine senza quotazione: richiederne una a /market/quotes."
+            )
+        if order.price_eur is None:
+            raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Indicare il prezzo o una quotazione.")
+        return Decimal(order.price_eur), None
+
+    signer: QuoteSigner = request.app.state.quote_signer
+    try:
+        quote = signer.verify(order.quote_token, user.user_id, order.asset_symbol)
+    except QuoteError as exc:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(exc)) from exc
+    if order.price_eur is not None and Decimal(order.price_eur) != quote.price_eur:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Il prezzo non coincide con la quotazione.")
+    return quote.price_eur, quote
+
+
+def _reject_expired(quote: Quote | None) -> None:
+    if quote is not None and quote.is_expired():
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Quotazione scaduta: richiederne una nuova.")
+
+
+@router.get(
+    "/quotes/{asset_symbol}",
+    response_model=CryptoQuoteOut,
+    status_code=status.HTTP_200_OK,
+)
+async def get_market_quote(
+    asset_symbol: str,
+    request: Request,
+    user: AuthenticatedUser = Depends(require_scope("transactions:write")),
+) -> CryptoQuoteOut:
+    """
+    Emette una quotazione firmata a breve scadenza dal prezzo corrente nello snapshot in memoria.
+
+    Nessun I/O: prezzo dallo snapshot pubblicato dal worker di ingestion, firma HMAC locale. L'ordine che allega
+    il token viene eseguito al prezzo quotato, senza fidarsi del prezzo inviato dal client.
+    """
+    symbol = asset_symbol.upper()
+    ingestor: PriceIngestor = request.app.state.price_ingestor
+    entry = next((item for item in ingestor.latest() if item["symbol"].upper() == symbol), None)
+    if entry is None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Asset non quotato.")
+    if entry.get("price") is None:
+        raise HTTPException(status_code=status.HTTP_503_SERVICE_UNAVAILABLE, detail="Prezzo non disponibile.")
+
+    signer: QuoteSigner = request.app.state.quote_signer
+    quote = signer.issue(user.user_id, symbol, Decimal(str(entry["price"])))
+    return CryptoQuoteOut(
+        asset_symbol=quote.asset_symbol,
+        asset_name=entry["name"],
+        price_eur=quote.price_eur,
+        expires_at=quote.expires_at,
+        quote_token=quote.token,
+    )
+
+
+def _async_queue(request: Request, prefer: str | None) -> order_queue.OrderQueue | None:
+    """Coda da usare se il client chiede `Prefer: respond-async` e la modalità asincrona è attiva."""
+    queue: order_queue.OrderQueue | None = request.app.state.order_queue
+    if queue is None or prefer is None:
+        return None
+    preferences = {item.strip().lower() for item in prefer.split(",")}
+    return queue if "respond-async" in preferences else None
+
+
+def _to_order_status(record: dict[str, object]) -> CryptoOrderStatusOut:
+    detail = None
+    if record["status"] == "rejected":
+        detail = _ORDER_REJECTIONS[record["outcome"]][1]
+    elif record["status"] == "failed":
+        detail = "Errore durante l'esecuzione dell'ordine."
+    return CryptoOrderStatusOut(
+        id=record["id"],
+        status=record["status"],
+        asset_symbol=record["asset_symbol"],
+        side=record["side"],
+        quantity=record["quantity"],
+        price_eur=record["price_eur"],
+        detail=detail,
+        result=(
+            _to_order_response(record["account_row"], record["position_row"])
+            if record["status"] == "filled"
+            else None
+        ),
+        created_at=record["created_at"],
+        processed_at=record["processed_at"],
+    )
+
+
+async def _order_write_slot(
+    request: Request,
+    payload: CryptoOrderRequest,
+    prefer: str | None = Header(default=None),
+    user: AuthenticatedUser = Depends(get_authenticated_user),
+) -> AsyncIterator[None]:
+    """Turno di scrittura sul conto dell'ordine, preso prima della connessione; non serve per l'accodamento."""
+    if _async_queue(request, prefer) is not None:
+        yield
+        return
+    async with account_write_slot(request, user, payload.account_id):
+        yield
+
+
+async def _order_batch_write_slot(
+    request: Request,
+    payload: CryptoOrderBatchRequest,
+    user: AuthenticatedUser = Depends(get_authenticated_user),
+) -> AsyncIterator[None]:
+    """Turno di scrittura sul conto del batch; conti diversi nello stesso batch sono rifiutati dall'endpoint."""
+    async with account_write_slot(request, user, payload.orders[0].account_id):
+        yield
 
 
 @router.post(
     "/orders",
     response_model=CryptoOrderResponse,
     status_code=status.HTTP_200_OK,
+    responses={status.HTTP_202_ACCEPTED: {"model": CryptoOrderStatusOut}},
 )
 async def process_crypto_order(
     payload: CryptoOrderRequest,
+    request: Request,
+    response: Response,
+    prefer: str | None = Header(default=None),
+    _slot: None = Depends(_order_write_slot),
     conn: AsyncConnection = Depends(get_connection_with_rls),
     user: AuthenticatedUser = Depends(require_scope("transactions:write")),
 ) -> CryptoOrderResponse:
     """
     Gestisce un acquisto/vendita di crypto e aggiorna il saldo del conto.
-    """
 
+    L'intero ordine (lock del conto, controlli, saldo, posizione e movimento) è eseguito dalla funzione
+    `execute_crypto_order` in un solo round trip, che restituisce anche conto e posizione aggiornati.
+    Con `idem_key` un retry riceve l'esito dell'ordine originale (header `Idempotent-Replayed: true`),
+    letto dalla cache degli esiti recenti o per chiave primaria senza passare dal percorso con lock.
+    Con `quote_token` il prezzo è quello della quotazione firmata, verificata localmente senza I/O.
+    Con `Prefer: respond-async` (e i worker della coda attivi) l'ordine viene solo accodato e si risponde 202
+    con `Location` verso lo stato, consultabile su `GET /market/orders/{id}`.
+    """
     quantity = Decimal(payload.quantity)
-    price = Decimal(payload.price_eur)
-    total_value = (quantity * price).quantize(Decimal("0.01"))
-
-    account = await _fetch_account(conn, str(payload.account_id), user.user_id)
-    if not account:
-        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Conto non trovato.")
-
-    if account["currency"] != "EUR":
-        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Operazioni disponibili solo per conti EUR.")
-
+    price, quote = _resolve_order_price(request, payload, user)
     symbol = payload.asset_symbol.upper()
-    async with conn.cursor() as cur:
-        if payload.side == "buy":
-            if Decimal(account["balance"]) < total_value:
-                raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Saldo insufficiente per completare l'acquisto.")
-            await cur.execute(
-                """
-                UPDATE accounts
-                SET balance = balance - %s
-                WHERE id = %s
-                """,
-                (total_value, account["id"]),
-            )
+    key = payload.idem_key
 
-            existing = await _fetch_position(conn, user.user_id, symbol)
-            if existing:
-                await cur.execute(
-                    """
-                    UPDATE user_crypto_positions
-                    SET amount = amount + %s,
-                        last_valuation_eur = %s,
-                        book_cost_eur = COALESCE(book_cost_eur, 0) + %s,
-                        asset_name = %s,
-                        updated_at = NOW()
-                    WHERE id = %s
-                    """,
-                    (
-                        quantity,
-                        (Decimal(existing["amount"]) + quantity) * price,
-                        total_value,
-                        payload.asset_name,
-                        existing["id"],
-                    ),
-                )
-                position = await _fetch_position(conn, user.user_id, symbol)
-            else:
-                await cur.execute(
-                    """
-                    INSERT INTO user_crypto_positions (
-                        user_id,
-                        account_id,
-                        asset_symbol,
-                        asset_name,
-                        amount,
-                        book_cost_eur,
-                        last_valuation_eur,
-                        price_source
-                    ) VALUES (%s, %s, %s, %s, %s, %s, %s, %s)
-                    RETURNING *
-                    """,
-                    (
-                        user.user_id,
-                        payload.account_id,
-                        symbol,
-                        payload.asset_name,
-                        quantity,
-                        total_value,
-                        quantity * price,
-                        "frontend-simulated",
-                    ),
-                )
-                position = dict(await cur.fetchone())
-        else:  # sell
-            existing = await _fetch_position(conn, user.user_id, symbol)
-            if not existing or Decimal(existing["amount"]) < quantity:
+    if key is not None:
+        stored = await order_idempotency.find_stored_order(conn, user.user_id, key)
+        if stored is not None:
+            if not stored.matches(payload.account_id, payload.side, symbol, quantity, price):
                 raise HTTPException(
-                    status_code=status.HTTP_400_BAD_REQUEST, detail="Posizione insufficiente per vendere la quantità richiesta."
+                    status_code=status.HTTP_409_CONFLICT, detail=_ORDER_REJECTIONS["idempotency_conflict"][1]
                 )
+            response.headers["Idempotent-Replayed"] = "true"
+            return _to_order_response(stored.account_row, stored.position_row)
+    _reject_expired(quote)
 
-            await cur.execute(
-                """
-                UPDATE accounts
-                SET balance = balance + %s
-                WHERE id = %s
-                """,
-                (total_value, account["id"]),
-            )
+    if _async_queue(request, prefer) is not None:
+        return await _enqueue_crypto_order(conn, user, payload, symbol, quantity, price)
 
-            new_amount = Decimal(existing["amount"]) - quantity
-            if new_amount <= 0:
-                await cur.execute(
-                    "DELETE FROM user_crypto_positions WHERE id = %s",
-                    (existing["id"],),
-                )
-                position = None
-            else:
-                await cur.execute(
-                    """
-                    UPDATE user_crypto_positions
-                    SET amount = %s,
-                        last_valuation_eur = %s,
-                        book_cost_eur = GREATEST(COALESCE(book_cost_eur,0) - %s, 0),
-                        updated_at = NOW()
-                    WHERE id = %s
-                    """,
-                    (new_amount, new_amount * price, total_value, existing["id"]),
-                )
-                position = await _fetch_position(conn, user.user_id, symbol)
-
-        idem_key = f"market:{uuid4()}"
+    # Senza chiave del client l'ordine riceve una chiave interna e non viene memorizzato per i retry.
+    function = "execute_crypto_order" if key is None else "execute_idempotent_crypto_order"
+    async with conn.cursor() as cur:
+        set_json_loads(order_idempotency.decimal_json_loads, cur)
         await cur.execute(
-            """
-            INSERT INTO transactions (id, user_id, account_id, amount, currency, category, idem_key, direction)
-            VALUES (%s, %s, %s, %s, %s, %s, %s, %s)
+            f"""
+            SELECT outcome, account_row, position_row
+            FROM {function}(%s, %s, %s, %s, %s, %s, %s, %s)
             """,
             (
-                str(uuid4()),
                 user.user_id,
                 payload.account_id,
-                total_value,
-                "EUR",
                 symbol,
-                idem_key,
-                "buy" if payload.side == "buy" else "sell",
+                payload.asset_name,
+                payload.side,
+                quantity,
+                price,
+                f"market:{uuid4()}" if key is None else key,
             ),
         )
+        result = await cur.fetchone()
 
+    outcome = result["outcome"]
+    rejection = _ORDER_REJECTIONS.get(outcome)
+    if rejection is not None:
+        await conn.rollback()
+        raise HTTPException(status_code=rejection[0], detail=rejection[1])
     await conn.commit()
 
-    updated_account = await _fetch_account(conn, str(payload.account_id), user.user_id)
-    if updated_account is None:
-        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Conto non trovato dopo l'aggiornamento.")
+    if key is not None:
+        order_idempotency.remember(
+            user.user_id,
+            key,
+            order_idempotency.StoredOrder(
+                account_id=payload.account_id,
+                side=payload.side,
+                asset_symbol=symbol,
+                quantity=quantity,
+                price_eur=price,
+                account_row=result["account_row"],
+                position_row=result["position_row"],
+            ),
+        )
+        if outcome == "replayed":
+            response.headers["Idempotent-Replayed"] = "true"
+    return _to_order_response(result["account_row"], result["position_row"])
 
-    return CryptoOrderResponse(
-        account=_to_account_out(updated_account),
-        position=_to_position_out(position) if position else None,
+
+async def _enqueue_crypto_order(
+    conn: AsyncConnection,
+    user: AuthenticatedUser,
+    payload: CryptoOrderRequest,
+    symbol: str,
+    quantity: Decimal,
+    price: Decimal,
+) -> JSONResponse:
+    record, created = await order_queue.enqueue_order(
+        conn,
+        user_id=user.user_id,
+        account_id=payload.account_id,
+        asset_symbol=symbol,
+        asset_name=payload.asset_name,
+        side=payload.side,
+        quantity=quantity,
+        price_eur=price,
+        client_key=payload.idem_key,
+    )
+    await conn.commit()
+    if not created and (
+        record["account_id"],
+        record["side"],
+        record["asset_symbol"],
+        record["quantity"],
+        record["price_eur"],
+    ) != (payload.account_id, payload.side, symbol, quantity, price):
+        raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail=_ORDER_REJECTIONS["idempotency_conflict"][1])
+    order_status = _to_order_status(record)
+    headers = {"Location": f"{router.prefix}/orders/{record['id']}", "Preference-Applied": "respond-async"}
+    if not created:
+        headers["Idempotent-Replayed"] = "true"
+    return JSONResponse(jsonable_encoder(order_status), status_code=status.HTTP_202_ACCEPTED, headers=headers)
+
+
+@router.get(
+    "/orders/{order_id}",
+    response_model=CryptoOrderStatusOut,
+    status_code=status.HTTP_200_OK,
+)
+async def get_crypto_order_status(
+    order_id: UUID,
+    request: Request,
+    wait: float = Query(0, ge=0, le=30, description="Secondi di attesa massima dell'esito se l'ordine è in coda"),
+    user: AuthenticatedUser = Depends(require_scope("transactions:read")),
+) -> CryptoOrderStatusOut:
+    """
+    Restituisce lo stato di un ordine accodato in modalità asincrona.
+
+    Con `wait` la richiesta resta in attesa della notifica di completamento (LISTEN/NOTIFY) fino ai secondi
+    indicati, senza polling del client e senza tenere una connessione del pool durante l'attesa.
+    """
+    pool = request.app.state.db_pool
+    queue: order_queue.OrderQueue | None = request.app.state.order_queue
+    if queue is None or wait == 0:
+        record = await order_queue.read_order(pool, user.user_id, order_id)
+    else:
+        async with queue.watch(order_id) as completed:
+            record = await order_queue.read_order(pool, user.user_id, order_id)
+            if record is not None and record["status"] == "pending":
+                try:
+                    await asyncio.wait_for(completed, timeout=wait)
+                except asyncio.TimeoutError:
+                    pass
+                else:
+                    record = await order_queue.read_order(pool, user.user_id, order_id)
+    if record is None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Ordine non trovato.")
+    return _to_order_status(record)
+
+
+@router.post(
+    "/orders/batch",
+    response_model=CryptoOrderBatchResponse,
+    status_code=status.HTTP_200_OK,
+)
+async def process_crypto_order_batch(
+    payload: CryptoOrderBatchRequest,
+    request: Request,
+    _slot: None = Depends(_order_batch_write_slot),
+    conn: AsyncConnection = Depends(get_connection_with_rls),
+    user: AuthenticatedUser = Depends(require_scope("transactions:write")),
+) -> CryptoOrderBatchResponse:
+    """
+    Esegue più acquisti/vendite sullo stesso conto in un'unica transazione (es. ribilanciamento del portafoglio).
+
+    La funzione `execute_crypto_order_batch` prende una volta il lock del conto, verifica l'esposizione netta
+    in EUR (le vendite finanziano gli acquisti) e applica posizioni, saldo e movimenti con statement set-based.
+    O tutti gli ordini vengono eseguiti, o nessuno. Acquisti e vendite dello stesso asset nello stesso batch
+    sono rifiutati: compensandosi eluderebbero la verifica della posizione detenuta.
+    """
+    account_ids = {order.account_id for order in payload.orders}
+    if len(account_ids) != 1:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST, detail="Gli ordini di un batch devono usare lo stesso conto."
+        )
+    if any(order.idem_key is not None for order in payload.orders):
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Le chiavi di idempotenza non sono supportate sui singoli ordini di un batch.",
+        )
+    sides: dict[str, set[str]] = {}
+    for order in payload.orders:
+        sides.setdefault(order.asset_symbol.upper(), set()).add(order.side)
+    if any(len(asset_sides) > 1 for asset_sides in sides.values()):
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST, detail=_ORDER_REJECTIONS["conflicting_legs"][1]
+        )
+
+    prices = []
+    for order in payload.orders:
+        price, quote = _resolve_order_price(request, order, user)
+        _reject_expired(quote)
+        prices.append(price)
+
+    # Quantità e prezzi viaggiano come stringhe per arrivare in NUMERIC senza passare da float.
+    legs = [
+        {
+            "asset_symbol": order.asset_symbol.upper(),
+            "asset_name": order.asset_name,
+            "side": order.side,
+            "quantity": str(order.quantity),
+            "price_eur": str(price),
+        }
+        for order, price in zip(payload.orders, prices)
+    ]
+    async with conn.cursor() as cur:
+        set_json_loads(order_idempotency.decimal_json_loads, cur)
+        await cur.execute(
+            """
+            SELECT outcome, account_row, position_rows
+            FROM execute_crypto_order_batch(%s, %s, %s)
+            """,
+            (user.user_id, account_ids.pop(), Jsonb(legs)),
+        )
+        result = await cur.fetchone()
+
+    rejection = _ORDER_REJECTIONS.get(result["outcome"])
+    if rejection is not None:
+        await conn.rollback()
+        raise HTTPException(status_code=rejection[0], detail=rejection[1])
+    await conn.commit()
+
+    return CryptoOrderBatchResponse(
+        account=_to_account_out(result["account_row"]),
+        positions=[_to_position_out(row) for row in result["position_rows"]],
     )
@@ -4,6 +4,7 @@ from __future__ import annotations
 
 import re
 from decimal import Decimal, InvalidOperation
+from typing import AsyncIterator
 from uuid import uuid4
 
 import logging
@@ -12,7 +13,7 @@ from fastapi import APIRouter, Depends, HTTPException, Request, Response, status
 from psycopg import AsyncConnection
 from psycopg.errors import ForeignKeyViolation, UniqueViolation
 
-from ..dependencies import AuthenticatedUser, require_scope
+from ..dependencies import AuthenticatedUser, account_write_slot, get_authenticated_user, require_scope
 from ..db import get_connection_with_rls
 from ..mfa import require_recent_mfa
 from ..schemas import (
@@ -204,6 +205,16 @@ async def delete_withdrawal_method(
     return Response(status_code=status.HTTP_204_NO_CONTENT)
 
 
+async def _withdrawal_write_slot(
+    request: Request,
+    payload: WithdrawalRequest,
+    user: AuthenticatedUser = Depends(get_authenticated_user),
+) -> AsyncIterator[None]:
+    """Turno di scrittura sul conto del prelievo, preso prima della connessione."""
+    async with account_write_slot(request, user, payload.account_id):
+        yield
+
+
 @router.post(
     "/withdrawals",
     response_model=WithdrawalOut,
@@ -214,6 +225,7 @@ async def create_withdrawal(
     request: Request,
     user: AuthenticatedUser = Depends(require_scope("payouts:write")),
     _: AuthenticatedUser = Depends(require_recent_mfa()),
+    _slot: None = Depends(_withdrawal_write_slot),
     conn: AsyncConnection = Depends(get_connection_with_rls),
 ) -> WithdrawalOut:
     try:
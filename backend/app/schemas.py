@@ -168,9 +168,35 @@ class CryptoOrderRequest(BaseModel):
     account_id: UUID = Field(..., description="Conto da usare per la transazione")
     asset_symbol: str = Field(..., max_length=12, description="Ticker asset (es. BTC)")
     asset_name: str = Field(..., max_length=80, description="Nome descrittivo dell'asset")
-    price_eur: Decimal = Field(..., gt=Decimal("0"), description="Prezzo unitario in EUR")
+    price_eur: Optional[Decimal] = Field(
+        default=None,
+        gt=Decimal("0"),
+        description="Prezzo unitario in EUR; con `quote_token` deve coincidere con quello quotato",
+    )
+    quote_token: Optional[str] = Field(
+        default=None,
+        min_length=1,
+        max_length=200,
+        description="Token di una quotazione emessa da /market/quotes: il prezzo è quello firmato dal server",
+    )
     quantity: Decimal = Field(..., gt=Decimal("0"), description="Quantità da acquistare/vendere")
     side: str = Field(..., pattern="^(buy|sell)$", description="Direzione dell'ordine")
+    idem_key: Optional[str] = Field(
+        default=None,
+        min_length=1,
+        max_length=100,
+        description="Chiave di idempotenza: un retry con la stessa chiave restituisce l'esito dell'ordine originale",
+    )
+
+
+class CryptoQuoteOut(BaseModel):
+    """Quotazione firmata a breve scadenza da allegare a un ordine."""
+
+    asset_symbol: str = Field(..., description="Ticker asset (es. BTC)")
+    asset_name: str = Field(..., description="Nome descrittivo dell'asset")
+    price_eur: Decimal = Field(..., description="Prezzo unitario garantito in EUR")
+    expires_at: datetime = Field(..., description="Istante oltre il quale la quotazione non è più accettata")
+    quote_token: str = Field(..., description="Token firmato da inviare in `quote_token` con l'ordine")
 
 
 class CryptoOrderResponse(BaseModel):
@@ -180,6 +206,36 @@ class CryptoOrderResponse(BaseModel):
     position: Optional[CryptoPositionOut] = None
 
 
+class CryptoOrderStatusOut(BaseModel):
+    """Stato di un ordine accettato in modalità asincrona."""
+
+    id: UUID = Field(..., description="Identificativo dell'ordine in coda")
+    status: str = Field(..., description="Stato: pending, filled, rejected o failed")
+    asset_symbol: str = Field(..., description="Ticker asset (es. BTC)")
+    side: str = Field(..., description="Direzione dell'ordine")
+    quantity: Decimal = Field(..., description="Quantità richiesta")
+    price_eur: Decimal = Field(..., description="Prezzo unitario in EUR usato per l'esecuzione")
+    detail: Optional[str] = Field(None, description="Motivo del rifiuto o dell'errore")
+    result: Optional[CryptoOrderResponse] = Field(None, description="Conto e posizione dopo l'esecuzione")
+    created_at: datetime = Field(..., description="Istante di accettazione dell'ordine")
+    processed_at: Optional[datetime] = Field(None, description="Istante di esecuzione o rifiuto")
+
+
+class CryptoOrderBatchRequest(BaseModel):
+    """Richiesta per più ordini crypto sullo stesso conto, eseguiti in un'unica transazione."""
+
+    orders: List[CryptoOrderRequest] = Field(
+        ..., min_length=1, max_length=20, description="Ordini da eseguire, nell'ordine indicato"
+    )
+
+
+class CryptoOrderBatchResponse(BaseModel):
+    """Risposta dopo un ordine multiplo: conto e posizioni degli asset coinvolti dopo l'esecuzione."""
+
+    account: AccountOut
+    positions: List[CryptoPositionOut]
+
+
 class OtpSendRequest(BaseModel):
     """Richiesta per l'invio di una OTP."""
 
@@ -0,0 +1,125 @@
+"""Sequenziatore in-process delle scritture per conto: le richieste concorrenti attendono in memoria, non sul DB."""
+
+from __future__ import annotations
+
+import asyncio
+from collections import deque
+from contextlib import asynccontextmanager
+from dataclasses import dataclass, field
+from typing import AsyncIterator, Deque, Dict
+
+from ..config import Settings
+
+
+class AccountQueueFullError(RuntimeError):
+    """Errore sollevato quando la coda delle scritture di un conto ha raggiunto la lunghezza massima."""
+
+
+@dataclass
+class _AccountLane:
+    """Coda FIFO delle scritture di un conto: al più una in esecuzione, le altre in attesa del proprio turno."""
+
+    busy: bool = False
+    waiters: Deque[asyncio.Future[None]] = field(default_factory=deque)
+
+
+class AccountWriteSequencer:
+    """
+    Serializza per `account_id` le scritture di questo processo con una coda FIFO per conto.
+
+    Il turno passa direttamente al primo in attesa (nessun sorpasso), quindi le richieste di un conto sono servite
+    nell'ordine di arrivo; conti diversi procedono in parallelo. Le code vuote vengono rimosse subito.
+    Con più processi i lock di riga restano la garanzia di correttezza: il sequenziatore riduce solo la contesa.
+    """
+
+    def __init__(self, *, max_pending: int) -> None:
+        self._max_pending = max_pending
+        self._lanes: Dict[str, _AccountLane] = {}
+        self.acquired = 0
+        self.queued = 0
+        self.rejected = 0
+
+    @asynccontextmanager
+    async def slot(self, account_id: str) -> AsyncIterator[None]:
+        """
+        Attende il turno del conto e lo mantiene per la durata del contesto.
+
+        Argomenti:
+            account_id: Conto su cui la richiesta scrive.
+
+        Solleva:
+            AccountQueueFullError: Se il conto ha già `max_pending` richieste in attesa.
+        """
+        await self.acquire(account_id)
+        try:
+            yield
+        finally:
+            self.release(account_id)
+
+    async def acquire(self, account_id: str) -> None:
+        """
+        Attende il turno del conto; va sempre seguito da `release`.
+
+        Solleva:
+            AccountQueueFullError: Se il conto ha già `max_pending` richieste in attesa.
+        """
+        lane = self._lanes.setdefault(account_id, _AccountLane())
+        if not lane.busy:
+            lane.busy = True
+            self.acquired += 1
+            return
+        if len(lane.waiters) >= self._max_pending:
+            self.rejected += 1
+            raise AccountQueueFullError(f"Troppe operazioni in coda sul conto {account_id}.")
+        self.queued += 1
+        turn: asyncio.Future[None] = asyncio.get_running_loop().create_future()
+        lane.waiters.append(turn)
+        try:
+            await turn
+        except asyncio.CancelledError:
+            if turn.done() and not turn.cancelled():
+                # Il turno era già stato ceduto a questa richiesta: lo si passa al successivo.
+                self.release(account_id)
+            else:
+                lane.waiters.remove(turn)
+            raise
+        self.acquired += 1
+
+    def release(self, account_id: str) -> None:
+        """Cede il turno del conto alla prima richiesta in attesa, oppure libera la coda."""
+        lane = self._lanes[account_id]
+        while lane.waiters:
+            turn = lane.waiters.popleft()
+            if not turn.done():
+                turn.set_result(None)
+                return
+        lane.busy = False
+        del self._lanes[account_id]
+
+    def stats(self) -> dict[str, int]:
+        """Conti con scritture in corso, richieste in attesa e contatori per il monitoraggio."""
+        return {
+            "active_accounts": len(self._lanes),
+            "pending": sum(len(lane.waiters) for lane in self._lanes.values()),
+            "max_pending_per_account": self._max_pending,
+            "acquired": self.acquired,
+            "queued": self.queued,
+            "rejected": self.rejected,
+        }
+
+
+@asynccontextmanager
+async def lifespan_account_sequencer(settings: Settings) -> AsyncIterator[AccountWriteSequencer | None]:
+    """
+    Crea il sequenziatore delle scritture per conto se abilitato nelle impostazioni.
+
+    Argomenti:
+        settings: Impostazioni con abilitazione e lunghezza massima delle code.
+
+    Restituisce:
+        AccountWriteSequencer | None: Sequenziatore attivo finché il contesto rimane aperto.
+    """
+    if not settings.account_write_sequencer_enabled:
+        yield None
+        return
+    yield AccountWriteSequencer(max_pending=settings.account_write_queue_max)
@@ -0,0 +1,118 @@
+"""Fan-out in memoria degli snapshot di prezzo verso i client in streaming."""
+
+from __future__ import annotations
+
+import asyncio
+import json
+from dataclasses import dataclass
+from typing import Dict, List
+
+from .etags import strong_etag
+
+
+@dataclass(frozen=True)
+class PriceTick:
+    """Snapshot pubblicato, già serializzato una sola volta per tutti i sottoscrittori e per `/market/prices`."""
+
+    sequence: int
+    payload: bytes
+    etag: str
+
+
+class Subscription:
+    """
+    Slot "ultimo valore" di un singolo client.
+
+    Ogni tick sovrascrive quello non ancora consegnato: un client lento riceve sempre lo snapshot più
+    recente e i tick persi vengono conteggiati come coalescenze invece di accumularsi in coda.
+    """
+
+    def __init__(self) -> None:
+        self._pending: PriceTick | None = None
+        self._ready = asyncio.Event()
+        self.delivered = 0
+        self.coalesced = 0
+
+    def offer(self, tick: PriceTick) -> None:
+        """Deposita il tick nello slot, rimpiazzando quello eventualmente non ancora letto."""
+        if self._pending is not None:
+            self.coalesced += 1
+        self._pending = tick
+        self._ready.set()
+
+    async def next(self, timeout: float | None = None) -> PriceTick | None:
+        """
+        Attende il prossimo tick disponibile.
+
+        Argomenti:
+            timeout: Secondi massimi di attesa (None per attendere indefinitamente).
+
+        Restituisce:
+            PriceTick | None: Tick più recente, oppure None se il timeout è scaduto.
+        """
+        try:
+            await asyncio.wait_for(self._ready.wait(), timeout)
+        except asyncio.TimeoutError:
+            return None
+        self._ready.clear()
+        tick, self._pending = self._pending, None
+        if tick is not None:
+            self.delivered += 1
+        return tick
+
+
+class PriceBroadcaster:
+    """Distribuisce ogni snapshot del worker di ingestion a tutti i client connessi in streaming."""
+
+    def __init__(self, max_subscribers: int = 1000) -> None:
+        self._max_subscribers = max_subscribers
+        self._subscribers: set[Subscription] = set()
+        self._latest: PriceTick | None = None
+        self._sequence = 0
+        self._coalesced_closed = 0
+
+    @property
+    def latest(self) -> PriceTick | None:
+        """Ultimo tick pubblicato, inviato subito ai nuovi sottoscrittori."""
+        return self._latest
+
+    def publish(self, snapshot: List[dict]) -> PriceTick:
+        """Serializza lo snapshot e lo deposita nello slot di ogni sottoscrittore senza attendere i client."""
+        self._sequence += 1
+        payload = json.dumps({"data": snapshot}, separators=(",", ":")).encode()
+        # ETag dal contenuto: coincide tra worker diversi che pubblicano lo stesso snapshot.
+        tick = PriceTick(sequence=self._sequence, payload=payload, etag=strong_etag(payload))
+        self._latest = tick
+        for subscription in self._subscribers:
+            subscription.offer(tick)
+        return tick
+
+    def subscribe(self) -> Subscription:
+        """
+        Registra un nuovo client; lo slot parte già con l'ultimo tick pubblicato, se presente.
+
+        Solleva:
+            OverflowError: Se è già stato raggiunto il numero massimo di client.
+        """
+        if len(self._subscribers) >= self._max_subscribers:
+            raise OverflowError("Numero massimo di client in streaming raggiunto.")
+        subscription = Subscription()
+        if self._latest is not None:
+            subscription.offer(self._latest)
+        self._subscribers.add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription: Subscription) -> None:
+        """Rimuove il client, conservandone le coalescenze nelle metriche aggregate."""
+        if subscription in self._subscribers:
+            self._subscribers.discard(subscription)
+            self._coalesced_closed += subscription.coalesced
+
+    def stats(self) -> Dict[str, int]:
+        """Metriche di fan-out per il monitoraggio."""
+        return {
+            "subscribers": len(self._subscribers),
+            "max_subscribers": self._max_subscribers,
+            "published": self._sequence,
+            "coalesced": self._coalesced_closed + sum(s.coalesced for s in self._subscribers),
+        }
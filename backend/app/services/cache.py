@@ -0,0 +1,150 @@
+"""Cache LRU in memoria con semantica stale-while-revalidate e stale-if-error."""
+
+from __future__ import annotations
+
+import asyncio
+import logging
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Awaitable, Callable, Generic, Hashable, Set, TypeVar
+
+from .singleflight import SingleFlight
+
+logger = logging.getLogger(__name__)
+
+V = TypeVar("V")
+
+
+@dataclass
+class _CacheEntry(Generic[V]):
+    value: V
+    stored_at: float
+
+
+class StaleWhileRevalidateCache(Generic[V]):
+    """
+    Cache limitata a `max_entries` elementi con politica di eviction LRU.
+
+    - entro `ttl_seconds` il valore è fresco e viene restituito direttamente;
+    - entro ulteriori `stale_seconds` il valore viene restituito subito e aggiornato in background;
+    - oltre, il chiamante attende il caricamento, ma se questo fallisce riceve l'ultimo valore noto.
+
+    I caricamenti passano da un `SingleFlight`, quindi per ogni chiave ne è in volo al massimo uno.
+    """
+
+    def __init__(
+        self,
+        *,
+        max_entries: int,
+        ttl_seconds: float,
+        stale_seconds: float,
+        flights: SingleFlight | None = None,
+        clock: Callable[[], float] = time.monotonic,
+    ) -> None:
+        if max_entries < 1:
+            raise ValueError("max_entries deve essere almeno 1.")
+        self._entries: OrderedDict[Hashable, _CacheEntry[V]] = OrderedDict()
+        self._max_entries = max_entries
+        self._ttl = ttl_seconds
+        self._stale = stale_seconds
+        self._flights = flights or SingleFlight()
+        self._clock = clock
+        self._background: Set[asyncio.Task] = set()
+        self.hits = 0
+        self.stale_hits = 0
+        self.misses = 0
+        self.stale_on_error = 0
+        self.evictions = 0
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def peek(self, key: Hashable) -> V | None:
+        """Restituisce il valore memorizzato, anche se scaduto, senza aggiornare l'ordine LRU."""
+        entry = self._entries.get(key)
+        return entry.value if entry else None
+
+    def get_fresh(self, key: Hashable) -> V | None:
+        """Restituisce il valore se ancora fresco, senza caricarlo; aggiorna LRU e contatori di hit/miss."""
+        entry = self._entries.get(key)
+        if entry is None or self._clock() - entry.stored_at >= self._ttl:
+            self.misses += 1
+            return None
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return entry.value
+
+    def put(self, key: Hashable, value: V) -> None:
+        """Memorizza un valore come fresco, espellendo l'elemento meno usato se si supera il limite."""
+        self._entries[key] = _CacheEntry(value=value, stored_at=self._clock())
+        self._entries.move_to_end(key)
+        while len(self._entries) > self._max_entries:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    def clear(self) -> None:
+        """Svuota la cache."""
+        self._entries.clear()
+
+    async def get_or_load(self, key: Hashable, loader: Callable[[], Awaitable[V]]) -> V:
+        """
+        Restituisce il valore associato a `key`, caricandolo o rinfrescandolo quando necessario.
+
+        Argomenti:
+            key: Chiave della risorsa.
+            loader: Coroutine factory che recupera il valore aggiornato dalla sorgente.
+
+        Restituisce:
+            V: Valore fresco, oppure stale durante la rivalidazione o in caso di errore della sorgente.
+        """
+        entry = self._entries.get(key)
+        if entry is not None:
+            self._entries.move_to_end(key)
+            age = self._clock() - entry.stored_at
+            if age < self._ttl:
+                self.hits += 1
+                return entry.value
+            if age < self._ttl + self._stale:
+                self.stale_hits += 1
+                self._revalidate(key, loader)
+                return entry.value
+
+        self.misses += 1
+        try:
+            return await self._flights.do(key, lambda: self._load(key, loader))
+        except Exception:
+            if entry is None:
+                raise
+            self.stale_on_error += 1
+            logger.warning("cache refresh failed for %r, serving stale value", key, exc_info=True)
+            return entry.value
+
+    def stats(self) -> dict[str, int]:
+        """Restituisce dimensione corrente e contatori di utilizzo della cache."""
+        return {
+            "size": len(self._entries),
+            "max_entries": self._max_entries,
+            "hits": self.hits,
+            "stale_hits": self.stale_hits,
+            "misses": self.misses,
+            "stale_on_error": self.stale_on_error,
+            "evictions": self.evictions,
+        }
+
+    async def _load(self, key: Hashable, loader: Callable[[], Awaitable[V]]) -> V:
+        value = await loader()
+        self.put(key, value)
+        return value
+
+    def _revalidate(self, key: Hashable, loader: Callable[[], Awaitable[V]]) -> None:
+        if self._flights.in_flight(key):
+            return
+        task = asyncio.create_task(self._flights.do(key, lambda: self._load(key, loader)))
+        self._background.add(task)
+        task.add_done_callback(self._on_revalidated)
+
+    def _on_revalidated(self, task: asyncio.Task) -> None:
+        self._background.discard(task)
+        if not task.cancelled() and task.exception() is not None:
+            logger.warning("background cache refresh failed", exc_info=task.exception())
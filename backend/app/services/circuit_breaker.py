@@ -0,0 +1,134 @@
+"""Circuit breaker a finestra di tasso di errore per le chiamate verso servizi esterni."""
+
+from __future__ import annotations
+
+import time
+from collections import deque
+from typing import Awaitable, Callable, Deque, Dict, TypeVar
+
+T = TypeVar("T")
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+
+class CircuitOpenError(RuntimeError):
+    """Sollevata quando il circuito è aperto e la chiamata viene rifiutata senza contattare l'upstream."""
+
+    def __init__(self, name: str, retry_after: float) -> None:
+        super().__init__(f"Circuito '{name}' aperto: nuovo tentativo tra {retry_after:.1f}s.")
+        self.name = name
+        self.retry_after = retry_after
+
+
+class CircuitBreaker:
+    """
+    Protegge un servizio esterno interrompendo le chiamate quando il tasso di errore supera una soglia.
+
+    - `closed`: le chiamate passano; l'esito delle ultime `window_size` entra nella finestra.
+    - `open`: le chiamate falliscono subito con `CircuitOpenError` per `open_seconds`.
+    - `half_open`: passa una sola chiamata di prova; se riesce il circuito si richiude, altrimenti si riapre.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        *,
+        failure_rate_threshold: float = 0.5,
+        window_size: int = 20,
+        minimum_calls: int = 5,
+        open_seconds: float = 30.0,
+        is_failure: Callable[[BaseException], bool] = lambda exc: True,
+        clock: Callable[[], float] = time.monotonic,
+    ) -> None:
+        self.name = name
+        self._failure_rate_threshold = failure_rate_threshold
+        self._minimum_calls = minimum_calls
+        self._open_seconds = open_seconds
+        self._is_failure = is_failure
+        self._clock = clock
+        self._outcomes: Deque[bool] = deque(maxlen=window_size)
+        self._state = CLOSED
+        self._opened_at = 0.0
+        self._probe_in_flight = False
+        self._rejected = 0
+        self._opened = 0
+
+    @property
+    def state(self) -> str:
+        """Stato corrente, con il passaggio automatico a `half_open` allo scadere dell'apertura."""
+        if self._state == OPEN and self._clock() - self._opened_at >= self._open_seconds:
+            self._state = HALF_OPEN
+            self._probe_in_flight = False
+        return self._state
+
+    async def call(self, operation: Callable[[], Awaitable[T]]) -> T:
+        """
+        Esegue l'operazione se il circuito lo consente, registrandone l'esito.
+
+        Argomenti:
+            operation: Coroutine factory che effettua la chiamata verso l'upstream.
+
+        Restituisce:
+            T: Risultato dell'operazione.
+
+        Solleva:
+            CircuitOpenError: Se il circuito è aperto (o è già in corso la chiamata di prova).
+        """
+        state = self.state
+        if state == OPEN or (state == HALF_OPEN and self._probe_in_flight):
+            self._rejected += 1
+            retry_after = max(self._open_seconds - (self._clock() - self._opened_at), 0.0)
+            raise CircuitOpenError(self.name, retry_after)
+        if state == HALF_OPEN:
+            self._probe_in_flight = True
+        try:
+            result = await operation()
+        except Exception as exc:
+            # Un errore "applicativo" (es. 404) prova comunque che l'upstream risponde.
+            self._record(success=not self._is_failure(exc))
+            raise
+        except BaseException:
+            # Cancellazione: nessun esito da registrare, ma si libera lo slot della chiamata di prova.
+            if state == HALF_OPEN:
+                self._probe_in_flight = False
+            raise
+        self._record(success=True)
+        return result
+
+    def _record(self, *, success: bool) -> None:
+        if self._state == OPEN:
+            # Esito di una chiamata partita prima dell'apertura: non deve prolungare l'apertura.
+            return
+        if self._state == HALF_OPEN:
+            if success:
+                self._state = CLOSED
+                self._outcomes.clear()
+            else:
+                self._trip()
+            return
+        self._outcomes.append(success)
+        if len(self._outcomes) < self._minimum_calls:
+            return
+        failures = self._outcomes.count(False)
+        if failures / len(self._outcomes) >= self._failure_rate_threshold:
+            self._trip()
+
+    def _trip(self) -> None:
+        self._state = OPEN
+        self._opened_at = self._clock()
+        self._probe_in_flight = False
+        self._outcomes.clear()
+        self._opened += 1
+
+    def stats(self) -> Dict[str, object]:
+        """Metriche del circuito per il monitoraggio."""
+        window = len(self._outcomes)
+        return {
+            "state": self.state,
+            "window_calls": window,
+            "window_failures": self._outcomes.count(False),
+            "opened": self._opened,
+            "rejected": self._rejected,
+        }
@@ -2,41 +2,107 @@
 
 from __future__ import annotations
 
+import json
 import time
 from decimal import Decimal, InvalidOperation
-from typing import Dict, List, Tuple
+from typing import TYPE_CHECKING, Any, Awaitable, Callable, Dict, Iterable, List, Sequence
 
 import httpx
 
 from ..config import get_settings
+from . import crypto_registry, http_clients
+from .cache import StaleWhileRevalidateCache
+from .circuit_breaker import CircuitBreaker
+from .etags import strong_etag
+from .singleflight import SingleFlight
+
+if TYPE_CHECKING:
+    from .shared_cache import SharedMarketCache
 
 ICON_BASE = "https://assets.coincap.io/assets/icons/{symbol}@2x.png"
 CACHE_TTL_SECONDS = 3 * 60 * 60  # 3 hours
+STALE_TTL_SECONDS = 24 * 60 * 60  # oltre il TTL si serve il dato stale rinfrescandolo in background
+HISTORY_CACHE_MAX_ENTRIES = 256
 DEFAULT_BASE_URL = "https://rest.coincap.io/v3"
+BREAKER_FAILURE_RATE = 0.5  # quota di errori nella finestra che apre il circuito
+BREAKER_WINDOW_SIZE = 20
+BREAKER_MINIMUM_CALLS = 5
+BREAKER_OPEN_SECONDS = 30.0
+
+_flights = SingleFlight()
+_snapshot_cache: StaleWhileRevalidateCache[List[dict]] = StaleWhileRevalidateCache(
+    max_entries=1,
+    ttl_seconds=CACHE_TTL_SECONDS,
+    stale_seconds=STALE_TTL_SECONDS,
+    flights=_flights,
+)
+_history_cache: StaleWhileRevalidateCache[List[dict]] = StaleWhileRevalidateCache(
+    max_entries=HISTORY_CACHE_MAX_ENTRIES,
+    ttl_seconds=CACHE_TTL_SECONDS,
+    stale_seconds=STALE_TTL_SECONDS,
+    flights=_flights,
+)
+# Livello condiviso tra i worker (tabella `market_cache`), attivato dal lifespan dell'applicazione.
+_shared: "SharedMarketCache | None" = None
+_snapshot_etag: str | None = None
+
+
+def _is_upstream_failure(exc: BaseException) -> bool:
+    """Solo errori di rete, timeout, 429 e 5xx indicano un upstream degradato; gli altri 4xx no."""
+    if isinstance(exc, httpx.HTTPStatusError):
+        status_code = exc.response.status_code
+        return status_code == 429 or status_code >= 500
+    return True
+
+
+_breaker = CircuitBreaker(
+    "coincap",
+    failure_rate_threshold=BREAKER_FAILURE_RATE,
+    window_size=BREAKER_WINDOW_SIZE,
+    minimum_calls=BREAKER_MINIMUM_CALLS,
+    open_seconds=BREAKER_OPEN_SECONDS,
+    is_failure=_is_upstream_failure,
+)
+
+
+def singleflight_stats() -> dict[str, int]:
+    """Restituisce le metriche di coalescenza delle richieste verso CoinCap."""
+    return _flights.stats()
+
+
+def cache_stats() -> dict[str, dict[str, int]]:
+    """Restituisce le metriche delle cache di snapshot e storico."""
+    return {
+        "snapshot": _snapshot_cache.stats(),
+        "history": _history_cache.stats(),
+    }
+
 
-SUPPORTED_ASSETS = [
-    {"id": "bitcoin", "symbol": "BTC", "name": "Bitcoin"},
-    {"id": "ethereum", "symbol": "ETH", "name": "Ethereum"},
-    {"id": "xrp", "symbol": "XRP", "name": "XRP"},
-    {"id": "solana", "symbol": "SOL", "name": "Solana"},
-    {"id": "dogecoin", "symbol": "DOGE", "name": "Dogecoin"},
-]
+def snapshot_etag() -> str | None:
+    """ETag del contenuto dell'ultimo snapshot caricato in cache (None prima del primo caricamento)."""
+    return _snapshot_etag
 
-ID_TO_ASSET = {asset["id"]: asset for asset in SUPPORTED_ASSETS}
-SYMBOL_TO_ID = {asset["symbol"].upper(): asset["id"] for asset in SUPPORTED_ASSETS}
 
-_market_cache: List[dict] | None = None
-_market_cache_ts = 0.0
-_history_cache: Dict[Tuple[str, int], Tuple[float, List[dict]]] = {}
+def configure_shared_cache(shared: "SharedMarketCache | None") -> None:
+    """Attiva (o disattiva con None) la cache condivisa consultata prima di contattare CoinCap."""
+    global _shared
+    _shared = shared
+
+
+def shared_cache_stats() -> dict[str, object] | None:
+    """Restituisce le metriche della cache condivisa, se attiva."""
+    return _shared.stats() if _shared is not None else None
+
+
+def breaker_stats() -> dict[str, object]:
+    """Restituisce lo stato del circuit breaker verso CoinCap."""
+    return _breaker.stats()
 
 
 def normalize_asset_identifier(identifier: str) -> str | None:
     """Accetta id o ticker e restituisce l'id CoinCap normalizzato."""
-    identifier = identifier.strip()
-    if identifier in ID_TO_ASSET:
-        return identifier
-    upper = identifier.upper()
-    return SYMBOL_TO_ID.get(upper)
+    asset = crypto_registry.get_registry().resolve(identifier)
+    return asset.id if asset else None
 
 
 def _settings():
@@ -64,58 +130,125 @@ def _to_decimal(value: str | float | int | None) -> Decimal:
         return Decimal("0")
 
 
-def _build_icon(symbol: str | None) -> str | None:
+def _to_price(value: str | float | int | None) -> Decimal | None:
+    """Prezzo upstream utilizzabile (positivo), oppure None se assente, nullo o non numerico."""
+    if value is None:
+        return None
+    try:
+        price = Decimal(str(value))
+    except (InvalidOperation, ValueError, TypeError):
+        return None
+    return price if price.is_finite() and price > 0 else None
+
+
+def build_icon(symbol: str | None) -> str | None:
     if not symbol:
         return None
     return ICON_BASE.format(symbol=symbol.lower())
 
 
+async def _get(client: httpx.AsyncClient, path: str, params: dict | None) -> dict | list:
+    resp = await client.get(f"{_base_url()}{path}", params=params, headers=_auth_headers())
+    resp.raise_for_status()
+    return resp.json()
+
+
 async def _request(path: str, params: dict | None = None) -> dict | list:
-    async with httpx.AsyncClient(timeout=15) as client:
-        resp = await client.get(f"{_base_url()}{path}", params=params, headers=_auth_headers())
-        resp.raise_for_status()
-        return resp.json()
+    """Chiamata verso CoinCap protetta dal circuit breaker: a circuito aperto fallisce subito con `CircuitOpenError`."""
+    return await _breaker.call(lambda: _send(path, params))
+
+
+async def _send(path: str, params: dict | None) -> dict | list:
+    client = http_clients.get_client(http_clients.COINCAP_CLIENT)
+    if client is not None:
+        return await _get(client, path, params)
+    # Fuori dal lifespan (script, seed) non esiste un client condiviso: si usa un client effimero.
+    async with httpx.AsyncClient(timeout=_settings().coincap_timeout_seconds) as ephemeral:
+        return await _get(ephemeral, path, params)
+
+
+async def _load_shared(key: str, loader: Callable[[], Awaitable[Any]]) -> Any:
+    # Un solo worker per chiave interroga CoinCap; gli altri leggono il risultato da `market_cache`.
+    if _shared is None:
+        return await loader()
+    return await _shared.get_or_refresh(key, CACHE_TTL_SECONDS, loader)
 
 
 async def fetch_market_snapshot() -> List[dict]:
-    """Restituisce i prezzi correnti (priceUsd) per tutti gli asset supportati."""
-    global _market_cache, _market_cache_ts
-    now = time.time()
-    if _market_cache and now - _market_cache_ts < CACHE_TTL_SECONDS:
-        return _market_cache
+    """Restituisce i prezzi correnti (priceUsd) per tutti gli asset del registro crypto."""
+    assets = crypto_registry.get_registry().assets()
+    if not assets:
+        return []
+    # La chiave include gli id richiesti: una modifica al catalogo invalida lo snapshot in cache.
+    ids = ",".join(asset.id for asset in assets)
+    return await _snapshot_cache.get_or_load(("snapshot", ids), lambda: _load_versioned_snapshot(ids, assets))
+
+
+async def _load_versioned_snapshot(ids: str, assets: Sequence[crypto_registry.CryptoAsset]) -> List[dict]:
+    global _snapshot_etag
+    snapshot = await _load_shared(f"coincap:snapshot:{ids}", lambda: _load_market_snapshot(assets))
+    # Chiavi ordinate: lo snapshot letto da JSONB ha un ordine diverso da quello caricato da CoinCap.
+    _snapshot_etag = strong_etag(json.dumps(snapshot, sort_keys=True).encode())
+    return snapshot
 
-    ids = ",".join(asset["id"] for asset in SUPPORTED_ASSETS)
+
+async def _load_market_snapshot(assets: Sequence[crypto_registry.CryptoAsset]) -> List[dict]:
+    ids = ",".join(asset.id for asset in assets)
     payload = await _request("/assets", params={"ids": ids})
+    return _normalize_snapshot(assets, payload)[0]
+
+
+async def fetch_live_market() -> tuple[List[dict], Dict[str, Decimal]]:
+    """
+    Restituisce snapshot e prezzi correnti (priceUsd) da un'unica chiamata `/assets`, senza cache.
+
+    Usata dal worker di ingestion: prezzo, variazione e capitalizzazione pubblicati provengono dalla stessa
+    risposta. Gli asset senza prezzo utilizzabile non compaiono nella mappa dei prezzi.
+    """
+    assets = crypto_registry.get_registry().assets()
+    if not assets:
+        return [], {}
+    payload = await _request("/assets", params={"ids": ",".join(asset.id for asset in assets)})
+    return _normalize_snapshot(assets, payload)
+
+
+def _normalize_snapshot(
+    assets: Sequence[crypto_registry.CryptoAsset],
+    payload: dict,
+) -> tuple[List[dict], Dict[str, Decimal]]:
     entries = {item["id"]: item for item in payload.get("data", [])}
 
     normalized: List[dict] = []
-    for asset in SUPPORTED_ASSETS:
-        entry = entries.get(asset["id"], {})
+    prices: Dict[str, Decimal] = {}
+    for asset in assets:
+        entry = entries.get(asset.id, {})
+        price = _to_price(entry.get("priceUsd"))
+        if price is not None:
+            prices[asset.id] = price
         normalized.append(
             {
-                "id": asset["id"],
-                "symbol": asset["symbol"].upper(),
-                "name": entry.get("name", asset["name"]),
-                "price": float(entry.get("priceUsd") or 0),
+                "id": asset.id,
+                "symbol": asset.symbol,
+                "name": entry.get("name", asset.name),
+                "price": float(price) if price is not None else None,
                 "change24h": float(entry.get("changePercent24Hr") or 0),
-                "image": _build_icon(asset["symbol"]),
+                "image": build_icon(asset.symbol),
                 "market_cap": float(entry.get("marketCapUsd") or 0) if entry.get("marketCapUsd") else None,
             }
         )
 
-    _market_cache = normalized
-    _market_cache_ts = now
-    return normalized
+    return normalized, prices
 
 
 async def fetch_history(asset_id: str, days: int = 7) -> List[dict]:
     """Restituisce l'andamento giornaliero degli ultimi N giorni per l'asset specificato."""
-    key = (asset_id, days)
-    now = time.time()
-    cached = _history_cache.get(key)
-    if cached and now - cached[0] < CACHE_TTL_SECONDS:
-        return cached[1]
+    return await _history_cache.get_or_load(
+        ("history", asset_id, days),
+        lambda: _load_shared(f"coincap:history:{asset_id}:{days}", lambda: _load_history(asset_id, days)),
+    )
 
+
+async def _load_history(asset_id: str, days: int) -> List[dict]:
     end_ms = int(time.time() * 1000)
     start_ms = end_ms - days * 24 * 60 * 60 * 1000
     payload = await _request(
@@ -130,10 +263,24 @@ async def fetch_history(asset_id: str, days: int = 7) -> List[dict]:
         {"timestamp": int(point.get("time") or 0), "price": float(point.get("priceUsd") or 0)}
         for point in payload.get("data", [])
     ]
-    _history_cache[key] = (now, history)
     return history
 
 
+async def fetch_prices(asset_ids: Iterable[str]) -> Dict[str, Decimal]:
+    """
+    Recupera in un'unica chiamata i prezzi correnti (priceUsd) degli asset richiesti, indicizzati per id.
+
+    Gli asset senza prezzo (o con prezzo nullo o non positivo) sono omessi: un prezzo a 0 verrebbe registrato
+    nello storico e azzererebbe la valutazione delle posizioni.
+    """
+    ids = sorted({asset_id for asset_id in asset_ids if asset_id})
+    if not ids:
+        return {}
+    payload = await _request("/assets", params={"ids": ",".join(ids)})
+    prices = {item.get("id"): _to_price(item.get("priceUsd")) for item in payload.get("data", [])}
+    return {asset_id: price for asset_id, price in prices.items() if asset_id in ids and price is not None}
+
+
 async def fetch_price_by_symbol(symbol: str) -> Decimal:
     """Recupera il prezzo corrente (priceUsd) usando l'endpoint dedicato."""
     payload = await _request(f"/price/bysymbol/{symbol.upper()}")
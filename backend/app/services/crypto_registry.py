@@ -0,0 +1,191 @@
+"""Registro in memoria dei dati di riferimento delle crypto, allineato alla tabella `crypto`."""
+
+from __future__ import annotations
+
+import asyncio
+import logging
+from contextlib import asynccontextmanager
+from dataclasses import dataclass
+from typing import AsyncIterator, Dict, Iterable, Tuple
+
+from psycopg import AsyncConnection
+from psycopg_pool import AsyncConnectionPool
+
+from ..config import Settings
+
+logger = logging.getLogger(__name__)
+
+# Canale su cui il trigger di `crypto` notifica le modifiche al catalogo.
+CHANGE_CHANNEL = "crypto_changed"
+_LISTEN_RETRY_SECONDS = 5.0
+
+
+@dataclass(frozen=True)
+class CryptoAsset:
+    """Dati di riferimento di una crypto supportata."""
+
+    id: str
+    symbol: str
+    name: str
+    rank: int
+    explorer_url: str | None
+
+
+class CryptoRegistry:
+    """Catalogo immutabile sostituito in blocco a ogni ricarica, con lookup O(1) per id e ticker."""
+
+    def __init__(self, assets: Iterable[CryptoAsset] = ()) -> None:
+        self._by_id: Dict[str, CryptoAsset] = {}
+        self._by_symbol: Dict[str, CryptoAsset] = {}
+        self._ordered: Tuple[CryptoAsset, ...] = ()
+        self.version = 0
+        self.replace(assets)
+
+    def replace(self, assets: Iterable[CryptoAsset]) -> None:
+        """Sostituisce atomicamente il contenuto del registro; la versione cambia solo se il catalogo cambia."""
+        ordered = tuple(sorted(assets, key=lambda asset: (asset.rank, asset.id)))
+        if ordered == self._ordered and self.version:
+            return
+        self._by_id = {asset.id: asset for asset in ordered}
+        self._by_symbol = {asset.symbol.upper(): asset for asset in ordered}
+        self._ordered = ordered
+        self.version += 1
+
+    def get(self, asset_id: str) -> CryptoAsset | None:
+        """Restituisce la crypto con l'id indicato."""
+        return self._by_id.get(asset_id)
+
+    def by_symbol(self, symbol: str) -> CryptoAsset | None:
+        """Restituisce la crypto con il ticker indicato (case-insensitive)."""
+        return self._by_symbol.get(symbol.upper())
+
+    def resolve(self, identifier: str) -> CryptoAsset | None:
+        """Accetta id o ticker e restituisce la crypto corrispondente."""
+        identifier = identifier.strip()
+        return self._by_id.get(identifier.lower()) or self._by_symbol.get(identifier.upper())
+
+    def assets(self) -> Tuple[CryptoAsset, ...]:
+        """Tutte le crypto supportate, ordinate per rank."""
+        return self._ordered
+
+    def __len__(self) -> int:
+        return len(self._ordered)
+
+    async def load(self, conn: AsyncConnection) -> int:
+        """
+        Ricarica il registro dalla tabella `crypto`.
+
+        Argomenti:
+            conn: Connessione su cui eseguire la lettura.
+
+        Restituisce:
+            int: Numero di crypto caricate.
+        """
+        async with conn.cursor() as cur:
+            await cur.execute("SELECT id, symbol, name, rank, explorer_url FROM crypto;")
+            rows = await cur.fetchall()
+        self.replace(
+            CryptoAsset(
+                id=row["id"],
+                symbol=row["symbol"].upper(),
+                name=row["name"],
+                rank=row["rank"],
+                explorer_url=row["explorer_url"],
+            )
+            for row in rows
+        )
+        return len(self)
+
+    async def reload(self, pool: AsyncConnectionPool) -> int:
+        """Ricarica il registro usando una connessione del pool."""
+        async with pool.connection() as conn:
+            return await self.load(conn)
+
+    def stats(self) -> Dict[str, int]:
+        """Metriche del registro per il monitoraggio."""
+        return {"assets": len(self), "version": self.version}
+
+
+_registry = CryptoRegistry()
+
+
+def get_registry() -> CryptoRegistry:
+    """Restituisce il registro condiviso dal processo."""
+    return _registry
+
+
+class _ChangeListener:
+    """Task che ricarica il registro a ogni NOTIFY su `crypto_changed`, con riconnessione automatica."""
+
+    def __init__(self, settings: Settings, pool: AsyncConnectionPool, registry: CryptoRegistry) -> None:
+        self._settings = settings
+        self._pool = pool
+        self._registry = registry
+        self._conn: AsyncConnection | None = None
+        self._stopping = False
+        self._task: asyncio.Task[None] | None = None
+
+    def start(self) -> None:
+        self._task = asyncio.create_task(self._run(), name="crypto-registry-listener")
+
+    async def stop(self) -> None:
+        self._stopping = True
+        if self._conn is not None:
+            # psycopg 3.1 può perdere la cancellazione mentre attende dentro `notifies()`:
+            # chiudere la connessione interrompe l'attesa in modo deterministico.
+            await self._conn.close()
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+
+    async def _run(self) -> None:
+        # Connessione dedicata fuori dal pool: LISTEN richiede una sessione che resti aperta.
+        while not self._stopping:
+            try:
+                async with await AsyncConnection.connect(self._settings.database_conninfo(), autocommit=True) as conn:
+                    self._conn = conn
+                    if self._stopping:
+                        # `stop()` è arrivato durante la connessione e non ha trovato nulla da chiudere.
+                        return
+                    await conn.execute(f"LISTEN {CHANGE_CHANNEL};")
+                    # Ricarica dopo il LISTEN per non perdere modifiche avvenute durante la (ri)connessione.
+                    await self._registry.reload(self._pool)
+                    async for _ in conn.notifies():
+                        await self._registry.reload(self._pool)
+            except asyncio.CancelledError:
+                raise
+            except Exception:  # noqa: BLE001 - il listener si riconnette dopo errori transitori
+                if self._stopping:
+                    return
+                logger.exception("crypto registry listener failed, retrying")
+            finally:
+                self._conn = None
+            await asyncio.sleep(_LISTEN_RETRY_SECONDS)
+
+
+@asynccontextmanager
+async def lifespan_crypto_registry(
+    settings: Settings,
+    pool: AsyncConnectionPool,
+) -> AsyncIterator[CryptoRegistry]:
+    """
+    Popola il registro all'avvio e lo mantiene aggiornato tramite LISTEN/NOTIFY.
+
+    Argomenti:
+        settings: Impostazioni applicative con i parametri di connessione al database.
+        pool: Pool di connessioni usato per ricaricare il catalogo.
+
+    Restituisce:
+        CryptoRegistry: Registro popolato finché il contesto rimane aperto.
+    """
+    registry = get_registry()
+    await registry.reload(pool)
+    listener = _ChangeListener(settings, pool, registry)
+    listener.start()
+    try:
+        yield registry
+    finally:
+        await listener.stop()
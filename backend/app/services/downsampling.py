@@ -0,0 +1,61 @@
+"""Riduzione server-side delle serie storiche con l'algoritmo Largest-Triangle-Three-Buckets."""
+
+from __future__ import annotations
+
+import numpy as np
+
+# LTTB conserva sempre il primo e l'ultimo punto: servono almeno tre punti in uscita.
+MIN_POINTS = 3
+
+
+def lttb(timestamps: np.ndarray, values: np.ndarray, max_points: int) -> np.ndarray:
+    """
+    Calcola gli indici dei punti selezionati da LTTB.
+
+    Le medie dei bucket e i triangoli candidati sono calcolati su array numpy; l'unico ciclo Python
+    scorre i bucket di uscita, perché ogni scelta dipende dal punto selezionato nel bucket precedente.
+
+    Argomenti:
+        timestamps: Ascisse della serie, ordinate in modo crescente.
+        values: Ordinate della serie, della stessa lunghezza di `timestamps`.
+        max_points: Numero massimo di punti da restituire (almeno `MIN_POINTS`).
+
+    Restituisce:
+        np.ndarray: Indici crescenti dei punti da conservare.
+    """
+    size = len(timestamps)
+    if max_points < MIN_POINTS:
+        raise ValueError(f"max_points deve essere almeno {MIN_POINTS}.")
+    if size <= max_points:
+        return np.arange(size)
+
+    x = np.asarray(timestamps, dtype=np.float64)
+    y = np.asarray(values, dtype=np.float64)
+
+    # Confini dei bucket interni: il primo e l'ultimo punto formano bucket a sé.
+    every = (size - 2) / (max_points - 2)
+    edges = (np.arange(max_points - 1) * every).astype(np.int64) + 1
+    edges[-1] = size - 1
+
+    # Medie di ogni bucket interno tramite somme cumulative, più l'ultimo punto come bucket finale.
+    x_sums = np.concatenate(([0.0], np.cumsum(x)))
+    y_sums = np.concatenate(([0.0], np.cumsum(y)))
+    counts = edges[1:] - edges[:-1]
+    avg_x = np.append((x_sums[edges[1:]] - x_sums[edges[:-1]]) / counts, x[-1])
+    avg_y = np.append((y_sums[edges[1:]] - y_sums[edges[:-1]]) / counts, y[-1])
+
+    selected = np.empty(max_points, dtype=np.int64)
+    selected[0] = 0
+    selected[-1] = size - 1
+    anchor = 0
+    for bucket in range(max_points - 2):
+        start, end = edges[bucket], edges[bucket + 1]
+        next_x, next_y = avg_x[bucket + 1], avg_y[bucket + 1]
+        areas = np.abs(
+            (x[anchor] - next_x) * (y[start:end] - y[anchor])
+            - (x[anchor] - x[start:end]) * (next_y - y[anchor])
+        )
+        anchor = start + int(np.argmax(areas))
+        selected[bucket + 1] = anchor
+    return selected
+
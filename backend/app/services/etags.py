@@ -0,0 +1,41 @@
+"""ETag forti e valutazione di `If-None-Match` per le GET condizionali."""
+
+from __future__ import annotations
+
+import hashlib
+
+
+def strong_etag(*parts: object) -> str:
+    """
+    Calcola un ETag forte a partire dai byte della rappresentazione o dalle versioni da cui dipende.
+
+    Argomenti:
+        parts: Byte del payload, oppure valori (versioni, watermark, parametri) che lo determinano.
+
+    Restituisce:
+        str: ETag quotato, pronto per l'header di risposta.
+    """
+    digest = hashlib.blake2b(digest_size=16)
+    for part in parts:
+        digest.update(part if isinstance(part, bytes) else repr(part).encode())
+        digest.update(b"\x1f")
+    return f'"{digest.hexdigest()}"'
+
+
+def etag_matches(header: str | None, etag: str) -> bool:
+    """
+    Indica se `If-None-Match` corrisponde all'ETag corrente (confronto debole, come da RFC 9110).
+
+    Argomenti:
+        header: Valore dell'header inviato dal client.
+        etag: ETag corrente della risorsa.
+
+    Restituisce:
+        bool: True se il client ha già la rappresentazione corrente e si può rispondere 304.
+    """
+    if not header:
+        return False
+    if header.strip() == "*":
+        return True
+    candidates = (candidate.strip() for candidate in header.split(","))
+    return etag in (candidate[2:] if candidate.startswith("W/") else candidate for candidate in candidates)
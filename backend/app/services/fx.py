@@ -0,0 +1,283 @@
+"""Tassi di cambio in memoria, aggiornati periodicamente da un provider intercambiabile."""
+
+from __future__ import annotations
+
+import asyncio
+import json
+import logging
+from contextlib import asynccontextmanager
+from dataclasses import dataclass
+from datetime import datetime, timezone
+from decimal import Decimal
+from pathlib import Path
+from typing import AsyncIterator, Dict, List, Mapping, Protocol, Sequence
+
+import httpx
+
+from ..config import Settings
+from .price_history import PriceSeries
+
+logger = logging.getLogger(__name__)
+
+# CoinCap quota tutto in dollari; ordini, posizioni e storico sono esposti in euro.
+QUOTE_CURRENCY = "USD"
+SETTLEMENT_CURRENCY = "EUR"
+# Precisione di `crypto_variation.price` (NUMERIC(24, 8)).
+PRICE_QUANTUM = Decimal("0.00000001")
+
+_rates: "RateTable | None" = None
+
+
+class FxRateError(RuntimeError):
+    """Errore sollevato quando un provider non restituisce tassi utilizzabili."""
+
+
+class RateProvider(Protocol):
+    """Sorgente dei tassi di cambio: restituisce quante unità di ogni valuta vale un'unità della base."""
+
+    name: str
+
+    async def fetch_rates(self, base: str, symbols: Sequence[str]) -> Dict[str, Decimal]: ...
+
+
+def _parse_rates(payload: object, base: str, symbols: Sequence[str]) -> Dict[str, Decimal]:
+    if not isinstance(payload, dict) or not isinstance(payload.get("rates"), dict):
+        raise FxRateError("Risposta FX priva della sezione `rates`.")
+    if str(payload.get("base", base)).upper() != base:
+        raise FxRateError(f"Tassi FX espressi in {payload.get('base')} invece che in {base}.")
+    rates = {str(symbol).upper(): Decimal(str(value)) for symbol, value in payload["rates"].items()}
+    missing = [symbol for symbol in symbols if rates.get(symbol, Decimal(0)) <= 0]
+    if missing:
+        raise FxRateError(f"Tasso FX mancante o non valido per {', '.join(missing)}.")
+    return {symbol: rates[symbol] for symbol in symbols}
+
+
+class FileRateProvider:
+    """Legge i tassi da un file JSON locale `{"base": "USD", "rates": {"EUR": 0.92}}` (test e sviluppo)."""
+
+    name = "file"
+
+    def __init__(self, path: str | Path) -> None:
+        self._path = Path(path)
+
+    async def fetch_rates(self, base: str, symbols: Sequence[str]) -> Dict[str, Decimal]:
+        try:
+            payload = json.loads(await asyncio.to_thread(self._path.read_text, encoding="utf-8"))
+        except (OSError, ValueError) as exc:
+            raise FxRateError(f"File dei tassi FX non leggibile: {self._path}.") from exc
+        return _parse_rates(payload, base, symbols)
+
+
+class FrankfurterRateProvider:
+    """Interroga un'API compatibile con Frankfurter (tassi di riferimento BCE) via `GET /latest`."""
+
+    name = "frankfurter"
+
+    def __init__(self, base_url: str, *, timeout: float) -> None:
+        self._base_url = base_url.rstrip("/")
+        self._timeout = timeout
+
+    async def fetch_rates(self, base: str, symbols: Sequence[str]) -> Dict[str, Decimal]:
+        # Un aggiornamento ogni ora non giustifica un client a lunga vita nel registro condiviso.
+        async with httpx.AsyncClient(timeout=self._timeout) as client:
+            try:
+                response = await client.get(
+                    f"{self._base_url}/latest",
+                    params={"from": base, "to": ",".join(symbols)},
+                )
+                response.raise_for_status()
+                payload = response.json()
+            except (httpx.HTTPError, ValueError) as exc:
+                raise FxRateError(f"Provider FX non disponibile: {exc}.") from exc
+        return _parse_rates(payload, base, symbols)
+
+
+@dataclass(frozen=True)
+class _RateSnapshot:
+    """Tabella immutabile dei tassi con la relativa provenienza."""
+
+    rates: Mapping[str, Decimal]
+    source: str
+    as_of: datetime | None
+    version: int
+
+
+class RateTable:
+    """
+    Tabella dei tassi rispetto alla valuta di quotazione, sostituita atomicamente a ogni aggiornamento.
+
+    Le conversioni leggono solo la tabella in memoria: nessuna richiesta attende il provider.
+    """
+
+    def __init__(self, base: str, fallback: Mapping[str, Decimal]) -> None:
+        self.base = base
+        self._snapshot = _RateSnapshot(rates=dict(fallback), source="fallback", as_of=None, version=0)
+        self.refreshes = 0
+        self.failures = 0
+
+    @property
+    def version(self) -> int:
+        """Versione della tabella, incrementata a ogni sostituzione dei tassi."""
+        return self._snapshot.version
+
+    def replace(self, rates: Mapping[str, Decimal], source: str) -> None:
+        """Sostituisce la tabella con i tassi appena ottenuti dal provider."""
+        self._snapshot = _RateSnapshot(
+            rates=dict(rates),
+            source=source,
+            as_of=datetime.now(timezone.utc),
+            version=self._snapshot.version + 1,
+        )
+
+    def rate(self, currency: str = SETTLEMENT_CURRENCY) -> Decimal:
+        """
+        Unità di `currency` per un'unità della valuta base.
+
+        Solleva:
+            FxRateError: Se la tabella non contiene la valuta richiesta.
+        """
+        if currency == self.base:
+            return Decimal(1)
+        try:
+            return self._snapshot.rates[currency]
+        except KeyError:
+            raise FxRateError(f"Nessun tasso {self.base}/{currency} disponibile.") from None
+
+    def convert_prices(self, prices: Mapping[str, Decimal], currency: str = SETTLEMENT_CURRENCY) -> Dict[str, Decimal]:
+        """Converte una mappa di prezzi (es. quelli da registrare) alla precisione di `crypto_variation`."""
+        rate = self.rate(currency)
+        return {key: (price * rate).quantize(PRICE_QUANTUM) for key, price in prices.items()}
+
+    def convert_snapshot(self, snapshot: Sequence[dict], currency: str = SETTLEMENT_CURRENCY) -> List[dict]:
+        """Converte prezzi e capitalizzazioni di uno snapshot di mercato, restituendo nuove voci."""
+        rate = float(self.rate(currency))
+        return [
+            {
+                **entry,
+                "price": entry["price"] * rate if entry.get("price") is not None else None,
+                "market_cap": entry["market_cap"] * rate if entry.get("market_cap") is not None else None,
+            }
+            for entry in snapshot
+        ]
+
+    def convert_series(self, series: PriceSeries, currency: str = SETTLEMENT_CURRENCY) -> PriceSeries:
+        """Converte uno storico con un'unica moltiplicazione vettoriale."""
+        return PriceSeries(timestamps=series.timestamps, prices=series.prices * float(self.rate(currency)))
+
+    def stats(self) -> dict[str, object]:
+        """Metriche e provenienza dei tassi correnti per il monitoraggio."""
+        snapshot = self._snapshot
+        return {
+            "base": self.base,
+            "source": snapshot.source,
+            "as_of": snapshot.as_of.isoformat() if snapshot.as_of else None,
+            "version": snapshot.version,
+            "rates": {currency: str(rate) for currency, rate in snapshot.rates.items()},
+            "refreshes": self.refreshes,
+            "failures": self.failures,
+        }
+
+
+class FxRefresher:
+    """Aggiorna periodicamente la tabella dei tassi; in caso di errore resta in uso l'ultima tabella valida."""
+
+    def __init__(self, table: RateTable, provider: RateProvider, *, interval_seconds: float) -> None:
+        self._table = table
+        self._provider = provider
+        self._interval = interval_seconds
+        self._task: asyncio.Task[None] | None = None
+
+    async def refresh(self) -> bool:
+        """
+        Esegue un aggiornamento dei tassi.
+
+        Restituisce:
+            bool: True se la tabella è stata sostituita.
+        """
+        try:
+            rates = await self._provider.fetch_rates(self._table.base, (SETTLEMENT_CURRENCY,))
+        except FxRateError as exc:
+            self._table.failures += 1
+            logger.warning("FX rate refresh from %s failed: %s", self._provider.name, exc)
+            return False
+        self._table.replace(rates, self._provider.name)
+        self._table.refreshes += 1
+        return True
+
+    async def _run_forever(self) -> None:
+        while True:
+            await self.refresh()
+            await asyncio.sleep(self._interval)
+
+    def start(self) -> None:
+        """Avvia il loop di aggiornamento se non è già attivo; il primo aggiornamento parte subito."""
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run_forever(), name="fx-refresh")
+
+    async def stop(self) -> None:
+        """Interrompe il loop di aggiornamento attendendo la cancellazione del task."""
+        if self._task is None:
+            return
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+
+
+def build_provider(settings: Settings) -> RateProvider:
+    """
+    Istanzia il provider FX configurato.
+
+    Solleva:
+        ValueError: Se il provider non è supportato o manca il file dei tassi.
+    """
+    if settings.fx_provider == FileRateProvider.name:
+        if not settings.fx_rates_file:
+            raise ValueError("FX_RATES_FILE è obbligatorio con FX_PROVIDER=file.")
+        return FileRateProvider(settings.fx_rates_file)
+    if settings.fx_provider == FrankfurterRateProvider.name:
+        return FrankfurterRateProvider(settings.fx_base_url, timeout=settings.fx_timeout_seconds)
+    raise ValueError(f"Provider FX non supportato: {settings.fx_provider}.")
+
+
+def get_rates() -> RateTable:
+    """
+    Restituisce la tabella dei tassi attiva.
+
+    Solleva:
+        RuntimeError: Se invocato fuori dal `lifespan` dell'applicazione.
+    """
+    if _rates is None:
+        raise RuntimeError("Tabella dei tassi FX non inizializzata: avviare l'applicazione tramite lifespan.")
+    return _rates
+
+
+@asynccontextmanager
+async def lifespan_fx_rates(settings: Settings) -> AsyncIterator[RateTable]:
+    """
+    Mantiene aggiornati i tassi di cambio per tutta la vita dell'applicazione.
+
+    L'avvio non attende il provider: il primo aggiornamento gira in background e fino alla sua riuscita si usa il
+    tasso di riserva configurato, così un provider lento o irraggiungibile non blocca né l'avvio né le route.
+
+    Argomenti:
+        settings: Impostazioni con provider, cadenza di aggiornamento e tasso di riserva.
+
+    Restituisce:
+        RateTable: Tabella attiva finché il contesto rimane aperto.
+    """
+    global _rates
+    table = RateTable(
+        QUOTE_CURRENCY,
+        fallback={SETTLEMENT_CURRENCY: Decimal(str(settings.fx_fallback_usd_eur_rate))},
+    )
+    refresher = FxRefresher(table, build_provider(settings), interval_seconds=settings.fx_refresh_interval_seconds)
+    _rates = table
+    refresher.start()
+    try:
+        yield table
+    finally:
+        await refresher.stop()
+        _rates = None
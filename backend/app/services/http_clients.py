@@ -0,0 +1,154 @@
+"""Registro dei client HTTP condivisi verso i servizi esterni, gestito dal `lifespan` di FastAPI."""
+
+from __future__ import annotations
+
+import importlib.util
+from contextlib import asynccontextmanager
+from dataclasses import dataclass
+from typing import Any, AsyncIterator, Dict
+
+import httpx
+
+from ..config import Settings
+
+COINCAP_CLIENT = "coincap"
+
+_registry: HttpClientRegistry | None = None
+
+
+def http2_available() -> bool:
+    """Indica se il pacchetto `h2` è installato e quindi httpx può negoziare HTTP/2."""
+    return importlib.util.find_spec("h2") is not None
+
+
+@dataclass
+class _RegisteredClient:
+    """Client httpx registrato con i contatori di utilizzo."""
+
+    client: httpx.AsyncClient
+    http2: bool
+    requests_sent: int = 0
+    responses_received: int = 0
+
+
+class HttpClientRegistry:
+    """Mantiene un `httpx.AsyncClient` a lunga vita per host, con pool di connessioni keep-alive."""
+
+    def __init__(
+        self,
+        *,
+        max_connections: int,
+        max_keepalive_connections: int,
+        keepalive_expiry: float,
+        http2: bool = True,
+    ) -> None:
+        self._limits = httpx.Limits(
+            max_connections=max_connections,
+            max_keepalive_connections=max_keepalive_connections,
+            keepalive_expiry=keepalive_expiry,
+        )
+        self._http2 = http2 and http2_available()
+        self._clients: Dict[str, _RegisteredClient] = {}
+
+    def register(self, name: str, *, timeout: float, headers: dict[str, str] | None = None) -> httpx.AsyncClient:
+        """
+        Crea e registra un client dedicato a un host con il proprio timeout.
+
+        Argomenti:
+            name: Nome logico del client (es. `coincap`).
+            timeout: Timeout complessivo in secondi applicato alle richieste verso l'host.
+            headers: Intestazioni di default inviate con ogni richiesta.
+
+        Restituisce:
+            httpx.AsyncClient: Client condiviso pronto all'uso.
+        """
+        if name in self._clients:
+            raise ValueError(f"Client HTTP '{name}' già registrato.")
+        transport = httpx.AsyncHTTPTransport(http2=self._http2, limits=self._limits)
+        entry: _RegisteredClient
+
+        async def _on_request(_: httpx.Request) -> None:
+            entry.requests_sent += 1
+
+        async def _on_response(_: httpx.Response) -> None:
+            entry.responses_received += 1
+
+        client = httpx.AsyncClient(
+            transport=transport,
+            timeout=timeout,
+            headers=headers,
+            event_hooks={"request": [_on_request], "response": [_on_response]},
+        )
+        entry = _RegisteredClient(client=client, http2=self._http2)
+        self._clients[name] = entry
+        return client
+
+    def get(self, name: str) -> httpx.AsyncClient | None:
+        """Restituisce il client registrato con il nome indicato, se presente."""
+        entry = self._clients.get(name)
+        return entry.client if entry else None
+
+    def stats(self) -> dict[str, dict[str, Any]]:
+        """
+        Fotografa limiti e utilizzo di ogni client registrato.
+
+        I contatori vengono dagli event hook pubblici di httpx, non dallo stato interno del pool di httpcore.
+
+        Restituisce:
+            dict[str, dict[str, Any]]: Per ciascun client limiti del pool, richieste inviate, risposte e richieste in volo.
+        """
+        snapshot: dict[str, dict[str, Any]] = {}
+        for name, entry in self._clients.items():
+            snapshot[name] = {
+                "http2": entry.http2,
+                "max_connections": self._limits.max_connections,
+                "max_keepalive_connections": self._limits.max_keepalive_connections,
+                "requests_sent": entry.requests_sent,
+                "responses_received": entry.responses_received,
+                "in_flight": entry.requests_sent - entry.responses_received,
+            }
+        return snapshot
+
+    async def aclose(self) -> None:
+        """Chiude tutti i client registrati rilasciando le connessioni del pool."""
+        clients = list(self._clients.values())
+        self._clients.clear()
+        for entry in clients:
+            await entry.client.aclose()
+
+
+def get_registry() -> HttpClientRegistry | None:
+    """Restituisce il registro attivo nel processo corrente (None fuori dal `lifespan`)."""
+    return _registry
+
+
+def get_client(name: str) -> httpx.AsyncClient | None:
+    """Restituisce il client condiviso registrato con il nome indicato, se il registro è attivo."""
+    return _registry.get(name) if _registry is not None else None
+
+
+@asynccontextmanager
+async def lifespan_http_clients(settings: Settings) -> AsyncIterator[HttpClientRegistry]:
+    """
+    Crea il registro dei client HTTP, lo rende disponibile ai servizi e lo chiude allo shutdown.
+
+    Argomenti:
+        settings: Impostazioni applicative con limiti del pool e timeout per host.
+
+    Restituisce:
+        HttpClientRegistry: Registro attivo finché il contesto rimane aperto.
+    """
+    global _registry
+    registry = HttpClientRegistry(
+        max_connections=settings.http_pool_max_connections,
+        max_keepalive_connections=settings.http_pool_max_keepalive_connections,
+        keepalive_expiry=settings.http_pool_keepalive_expiry_seconds,
+        http2=settings.http2_enabled,
+    )
+    registry.register(COINCAP_CLIENT, timeout=settings.coincap_timeout_seconds)
+    _registry = registry
+    try:
+        yield registry
+    finally:
+        _registry = None
+        await registry.aclose()
@@ -0,0 +1,97 @@
+"""Esiti memorizzati degli ordini di mercato con chiave di idempotenza, per rispondere ai retry senza rieseguirli."""
+
+from __future__ import annotations
+
+import json
+from dataclasses import dataclass
+from decimal import Decimal
+from functools import partial
+from typing import Any
+from uuid import UUID
+
+from psycopg import AsyncConnection
+from psycopg.types.json import set_json_loads
+
+from .cache import StaleWhileRevalidateCache
+
+RECENT_ORDERS_MAX_ENTRIES = 4096
+RECENT_ORDERS_TTL_SECONDS = 24 * 60 * 60
+
+# I numeri del JSONB restano Decimal, come quelli letti dalle colonne NUMERIC.
+decimal_json_loads = partial(json.loads, parse_float=Decimal)
+
+# Gli esiti sono immutabili: la cache tiene i più recenti, i retry più vecchi passano dalla lookup indicizzata.
+_recent_orders: StaleWhileRevalidateCache["StoredOrder"] = StaleWhileRevalidateCache(
+    max_entries=RECENT_ORDERS_MAX_ENTRIES,
+    ttl_seconds=RECENT_ORDERS_TTL_SECONDS,
+    stale_seconds=0,
+)
+
+
+@dataclass(frozen=True)
+class StoredOrder:
+    """Parametri e risposta dell'ordine originale associato a una chiave di idempotenza."""
+
+    account_id: UUID
+    side: str
+    asset_symbol: str
+    quantity: Decimal
+    price_eur: Decimal
+    account_row: dict[str, Any]
+    position_row: dict[str, Any] | None
+
+    def matches(self, account_id: UUID, side: str, asset_symbol: str, quantity: Decimal, price_eur: Decimal) -> bool:
+        """Indica se il retry ripete lo stesso ordine sullo stesso conto (e non riusa la chiave per un ordine diverso)."""
+        return (self.account_id, self.side, self.asset_symbol, self.quantity, self.price_eur) == (
+            account_id,
+            side,
+            asset_symbol,
+            quantity,
+            price_eur,
+        )
+
+
+def remember(user_id: str, key: str, order: StoredOrder) -> None:
+    """Registra in memoria l'esito di un ordine appena eseguito o letto dal database."""
+    _recent_orders.put((user_id, key), order)
+
+
+async def find_stored_order(conn: AsyncConnection, user_id: str, key: str) -> StoredOrder | None:
+    """
+    Cerca l'esito di un ordine già eseguito con la chiave indicata, prima in memoria e poi per chiave primaria.
+
+    La lettura non prende lock: se l'ordine originale è ancora in corso il controllo definitivo avviene in
+    `execute_idempotent_crypto_order`, dopo il lock del conto.
+
+    Argomenti:
+        conn: Connessione con RLS configurata per l'utente.
+        user_id: Identificativo dell'utente.
+        key: Chiave di idempotenza fornita dal client.
+
+    Restituisce:
+        StoredOrder | None: Esito memorizzato, oppure None se la chiave non è mai stata usata.
+    """
+    cached = _recent_orders.peek((user_id, key))
+    if cached is not None:
+        return cached
+    async with conn.cursor() as cur:
+        set_json_loads(decimal_json_loads, cur)
+        await cur.execute(
+            """
+            SELECT account_id, side, asset_symbol, quantity, price_eur, account_row, position_row
+            FROM crypto_order_results
+            WHERE user_id = %s AND idem_key = %s
+            """,
+            (user_id, key),
+        )
+        row = await cur.fetchone()
+    if row is None:
+        return None
+    order = StoredOrder(**row)
+    remember(user_id, key, order)
+    return order
+
+
+def recent_orders_stats() -> dict[str, int]:
+    """Metriche della cache degli esiti recenti per il monitoraggio."""
+    return _recent_orders.stats()
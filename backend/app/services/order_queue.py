@@ -0,0 +1,359 @@
+"""Coda asincrona degli ordini di mercato: intake con 202 ed esecuzione da worker con claim `SKIP LOCKED`."""
+
+from __future__ import annotations
+
+import asyncio
+import logging
+from collections import defaultdict
+from contextlib import asynccontextmanager
+from decimal import Decimal
+from typing import Any, AsyncIterator, Dict, List, Set
+from uuid import UUID
+
+from psycopg import AsyncConnection
+from psycopg.errors import TransactionRollback
+from psycopg.types.json import set_json_loads
+from psycopg_pool import AsyncConnectionPool
+
+from ..config import Settings
+from ..db import set_current_user_id
+from .order_idempotency import decimal_json_loads
+
+logger = logging.getLogger(__name__)
+
+QUEUED_CHANNEL = "crypto_order_queued"
+COMPLETED_CHANNEL = "crypto_order_completed"
+_LISTEN_RETRY_SECONDS = 5.0
+
+_ORDER_COLUMNS = """
+    id, user_id, account_id, asset_symbol, asset_name, side, quantity, price_eur, client_key,
+    status, outcome, account_row, position_row, created_at, processed_at
+"""
+
+# Ordini più vecchi per primi; le righe già reclamate da un altro worker vengono saltate, non attese.
+_CLAIM_QUERY = """
+    SELECT id, user_id, account_id, asset_symbol, asset_name, side, quantity, price_eur, client_key
+    FROM crypto_order_queue
+    WHERE status = 'pending'
+    ORDER BY created_at, id
+    LIMIT %s
+    FOR UPDATE SKIP LOCKED
+"""
+
+# Esecuzione e registrazione dell'esito in un solo statement: l'ordine risulta eseguito solo se lo è davvero.
+_EXECUTE_QUERY = """
+    WITH executed AS (
+        SELECT * FROM {function}(%s, %s, %s, %s, %s, %s, %s, %s)
+    )
+    UPDATE crypto_order_queue AS q
+    SET status = CASE WHEN e.outcome IN ('ok', 'replayed') THEN 'filled' ELSE 'rejected' END,
+        outcome = e.outcome,
+        account_row = e.account_row,
+        position_row = e.position_row,
+        processed_at = NOW()
+    FROM executed AS e
+    WHERE q.id = %s
+    RETURNING q.status
+"""
+
+
+async def enqueue_order(
+    conn: AsyncConnection,
+    *,
+    user_id: str,
+    account_id: UUID,
+    asset_symbol: str,
+    asset_name: str,
+    side: str,
+    quantity: Decimal,
+    price_eur: Decimal,
+    client_key: str | None,
+) -> tuple[dict[str, Any], bool]:
+    """
+    Accoda un ordine da eseguire in modo asincrono; il chiamante esegue il commit.
+
+    Argomenti:
+        conn: Connessione con RLS configurata per l'utente.
+        user_id: Identificativo dell'utente.
+        account_id: Conto da usare per l'ordine.
+        asset_symbol: Ticker dell'asset, già normalizzato.
+        asset_name: Nome descrittivo dell'asset.
+        side: Direzione dell'ordine (`buy` o `sell`).
+        quantity: Quantità da acquistare o vendere.
+        price_eur: Prezzo unitario in EUR già risolto (quotazione o prezzo del client).
+        client_key: Chiave di idempotenza del client, se presente.
+
+    Restituisce:
+        tuple[dict[str, Any], bool]: Riga dell'ordine e True se appena accodato, False se la chiave era già in coda.
+    """
+    async with conn.cursor() as cur:
+        set_json_loads(decimal_json_loads, cur)
+        await cur.execute(
+            f"""
+            INSERT INTO crypto_order_queue (
+                user_id, account_id, asset_symbol, asset_name, side, quantity, price_eur, client_key
+            ) VALUES (%s, %s, %s, %s, %s, %s, %s, %s)
+            ON CONFLICT (user_id, client_key) WHERE client_key IS NOT NULL DO NOTHING
+            RETURNING {_ORDER_COLUMNS}
+            """,
+            (user_id, account_id, asset_symbol, asset_name, side, quantity, price_eur, client_key),
+        )
+        row = await cur.fetchone()
+        if row is not None:
+            return row, True
+        await cur.execute(
+            f"SELECT {_ORDER_COLUMNS} FROM crypto_order_queue WHERE user_id = %s AND client_key = %s",
+            (user_id, client_key),
+        )
+        return await cur.fetchone(), False
+
+
+async def read_order(pool: AsyncConnectionPool, user_id: str, order_id: UUID) -> dict[str, Any] | None:
+    """
+    Legge un ordine accodato dell'utente con una connessione presa e restituita subito.
+
+    Così una richiesta di stato in attesa dell'esito non occupa una connessione del pool.
+    """
+    async with pool.connection() as conn:
+        await set_current_user_id(conn, user_id)
+        async with conn.cursor() as cur:
+            set_json_loads(decimal_json_loads, cur)
+            await cur.execute(
+                f"SELECT {_ORDER_COLUMNS} FROM crypto_order_queue WHERE id = %s AND user_id = %s",
+                (order_id, user_id),
+            )
+            row = await cur.fetchone()
+        await conn.commit()
+    return row
+
+
+class OrderQueue:
+    """
+    Worker che eseguono gli ordini accodati e notifiche di completamento per le richieste di stato.
+
+    Ogni worker reclama fino a `batch_size` ordini con `FOR UPDATE SKIP LOCKED`, blocca i conti coinvolti in
+    ordine di id (nessun deadlock tra worker) e li esegue in una transazione, con un savepoint per ordine.
+    Un LISTEN dedicato sveglia i worker a ogni nuovo ordine e risolve le attese sugli ordini completati;
+    il polling a intervallo fisso copre notifiche perse durante le riconnessioni.
+    """
+
+    def __init__(
+        self,
+        pool: AsyncConnectionPool,
+        *,
+        conninfo: str,
+        workers: int,
+        batch_size: int,
+        poll_interval_seconds: float,
+    ) -> None:
+        self._pool = pool
+        self._conninfo = conninfo
+        self._workers = workers
+        self._batch_size = batch_size
+        self._poll_interval = poll_interval_seconds
+        self._wakeup = asyncio.Event()
+        self._waiters: Dict[str, Set[asyncio.Future[None]]] = defaultdict(set)
+        self._listen_conn: AsyncConnection | None = None
+        self._stopping = False
+        self._tasks: List[asyncio.Task[None]] = []
+        self.batches = 0
+        self.filled = 0
+        self.rejected = 0
+        self.failed = 0
+
+    async def process_batch(self) -> int:
+        """
+        Reclama ed esegue un gruppo di ordini in attesa.
+
+        Restituisce:
+            int: Numero di ordini reclamati (0 se la coda è vuota).
+        """
+        async with self._pool.connection() as conn:
+            async with conn.cursor() as cur:
+                await cur.execute(_CLAIM_QUERY, (self._batch_size,))
+                orders = await cur.fetchall()
+                if not orders:
+                    await conn.commit()
+                    return 0
+                await cur.execute(
+                    "SELECT id FROM accounts WHERE id = ANY(%s) ORDER BY id FOR UPDATE",
+                    (sorted({order["account_id"] for order in orders}),),
+                )
+                for order in orders:
+                    await self._execute(conn, cur, order)
+            await conn.commit()
+        self.batches += 1
+        return len(orders)
+
+    async def _execute(self, conn: AsyncConnection, cur: Any, order: dict[str, Any]) -> None:
+        key = order["client_key"]
+        function = "execute_crypto_order" if key is None else "execute_idempotent_crypto_order"
+        try:
+            async with conn.transaction():
+                await cur.execute(
+                    _EXECUTE_QUERY.format(function=function),
+                    (
+                        order["user_id"],
+                        order["account_id"],
+                        order["asset_symbol"],
+                        order["asset_name"],
+                        order["side"],
+                        order["quantity"],
+                        order["price_eur"],
+                        f"queue:{order['id']}" if key is None else key,
+                        order["id"],
+                    ),
+                )
+                status = (await cur.fetchone())["status"]
+        except TransactionRollback:
+            # Deadlock o conflitto di serializzazione: l'ordine resta `pending` e viene ripreso al prossimo claim.
+            logger.warning("queued order %s rolled back, will retry", order["id"])
+            return
+        except Exception:  # noqa: BLE001 - un ordine non eseguibile non deve bloccare il resto del batch
+            logger.exception("queued order %s failed", order["id"])
+            await cur.execute(
+                """
+                UPDATE crypto_order_queue
+                SET status = 'failed', outcome = 'error', processed_at = NOW()
+                WHERE id = %s
+                """,
+                (order["id"],),
+            )
+            self.failed += 1
+            return
+        if status == "filled":
+            self.filled += 1
+        else:
+            self.rejected += 1
+
+    @asynccontextmanager
+    async def watch(self, order_id: UUID) -> AsyncIterator[asyncio.Future[None]]:
+        """
+        Registra un'attesa sul completamento dell'ordine, da aprire prima di leggerne lo stato.
+
+        Restituisce:
+            asyncio.Future[None]: Future risolta alla notifica di completamento dell'ordine.
+        """
+        key = str(order_id)
+        completed: asyncio.Future[None] = asyncio.get_running_loop().create_future()
+        self._waiters[key].add(completed)
+        try:
+            yield completed
+        finally:
+            waiters = self._waiters.get(key)
+            if waiters is not None:
+                waiters.discard(completed)
+                if not waiters:
+                    del self._waiters[key]
+
+    def _notify_completed(self, order_id: str) -> None:
+        for completed in self._waiters.pop(order_id, ()):
+            if not completed.done():
+                completed.set_result(None)
+
+    async def _listen(self) -> None:
+        # Connessione dedicata fuori dal pool: LISTEN richiede una sessione che resti aperta.
+        while not self._stopping:
+            try:
+                async with await AsyncConnection.connect(self._conninfo, autocommit=True) as conn:
+                    self._listen_conn = conn
+                    if self._stopping:
+                        return
+                    await conn.execute(f"LISTEN {QUEUED_CHANNEL};")
+                    await conn.execute(f"LISTEN {COMPLETED_CHANNEL};")
+                    # Ordini accodati durante la (ri)connessione: i worker ricontrollano subito la coda.
+                    self._wakeup.set()
+                    async for notify in conn.notifies():
+                        if notify.channel == QUEUED_CHANNEL:
+                            self._wakeup.set()
+                        else:
+                            self._notify_completed(notify.payload)
+            except asyncio.CancelledError:
+                raise
+            except Exception:  # noqa: BLE001 - il listener si riconnette dopo errori transitori
+                if self._stopping:
+                    return
+                logger.exception("order queue listener failed, retrying")
+            finally:
+                self._listen_conn = None
+            await asyncio.sleep(_LISTEN_RETRY_SECONDS)
+
+    async def _work(self) -> None:
+        while True:
+            self._wakeup.clear()
+            try:
+                claimed = await self.process_batch()
+            except asyncio.CancelledError:
+                raise
+            except Exception:  # noqa: BLE001 - il worker non deve interrompersi per errori transitori
+                logger.exception("order queue batch failed")
+                claimed = 0
+            if claimed == 0:
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout=self._poll_interval)
+                except asyncio.TimeoutError:
+                    pass
+
+    def start(self) -> None:
+        """Avvia il listener delle notifiche e i worker."""
+        self._stopping = False
+        self._tasks = [asyncio.create_task(self._listen(), name="order-queue-listener")]
+        self._tasks += [
+            asyncio.create_task(self._work(), name=f"order-queue-worker-{index}") for index in range(self._workers)
+        ]
+
+    async def stop(self) -> None:
+        """Interrompe listener e worker; gli ordini non completati restano in coda per il prossimo avvio."""
+        self._stopping = True
+        if self._listen_conn is not None:
+            # psycopg 3.1 può perdere la cancellazione mentre attende dentro `notifies()`.
+            await self._listen_conn.close()
+        for task in self._tasks:
+            task.cancel()
+        for task in self._tasks:
+            try:
+                await task
+            except asyncio.CancelledError:
+                pass
+        self._tasks = []
+
+    def stats(self) -> dict[str, int]:
+        """Worker attivi, esiti e richieste di stato in attesa per il monitoraggio."""
+        return {
+            "workers": self._workers,
+            "batch_size": self._batch_size,
+            "batches": self.batches,
+            "filled": self.filled,
+            "rejected": self.rejected,
+            "failed": self.failed,
+            "waiting": sum(len(waiters) for waiters in self._waiters.values()),
+        }
+
+
+@asynccontextmanager
+async def lifespan_order_queue(settings: Settings, pool: AsyncConnectionPool) -> AsyncIterator[OrderQueue | None]:
+    """
+    Avvia i worker della coda ordini se configurati (`ORDER_QUEUE_WORKERS` > 0).
+
+    Argomenti:
+        settings: Impostazioni con numero di worker, dimensione dei batch e intervallo di polling.
+        pool: Pool di connessioni usato dai worker.
+
+    Restituisce:
+        OrderQueue | None: Coda attiva finché il contesto rimane aperto, oppure None se la modalità asincrona è spenta.
+    """
+    if settings.order_queue_workers <= 0:
+        yield None
+        return
+    queue = OrderQueue(
+        pool,
+        conninfo=settings.database_conninfo(),
+        workers=settings.order_queue_workers,
+        batch_size=settings.order_queue_batch_size,
+        poll_interval_seconds=settings.order_queue_poll_interval_seconds,
+    )
+    queue.start()
+    try:
+        yield queue
+    finally:
+        await queue.stop()
@@ -0,0 +1,34 @@
+"""Manutenzione delle partizioni mensili di `crypto_variation`."""
+
+from __future__ import annotations
+
+from typing import List
+
+from psycopg import AsyncConnection
+
+
+async def maintain_partitions(
+    conn: AsyncConnection,
+    *,
+    months_ahead: int,
+    retention_months: int,
+) -> List[dict]:
+    """
+    Pre-crea le partizioni dei prossimi mesi, elimina quelle oltre l'orizzonte di retention e sfoltisce le rollup.
+
+    Argomenti:
+        conn: Connessione su cui eseguire la manutenzione (il commit è a carico del chiamante).
+        months_ahead: Numero di mesi futuri per cui garantire l'esistenza della partizione.
+        retention_months: Mesi completi da conservare oltre al mese corrente.
+
+    Restituisce:
+        List[dict]: Azioni eseguite (`ensured`/`dropped`/`pruned`) con il nome della partizione o della
+            risoluzione delle rollup sfoltita.
+    """
+    async with conn.cursor() as cur:
+        await cur.execute(
+            "SELECT action, partition_name FROM maintain_crypto_variation_partitions(%s, %s);",
+            (months_ahead, retention_months),
+        )
+        rows = await cur.fetchall()
+    return [dict(row) for row in rows]
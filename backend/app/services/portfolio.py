@@ -0,0 +1,289 @@
+"""Serie storica del valore del portafoglio crypto, ricostruita dai movimenti e calcolata su array numpy."""
+
+from __future__ import annotations
+
+from dataclasses import dataclass
+from datetime import datetime, timedelta, timezone
+from typing import Dict, Sequence, Tuple
+
+import numpy as np
+from psycopg import AsyncConnection
+
+from . import rollups
+from .cache import StaleWhileRevalidateCache
+
+# Numero massimo di punti della griglia temporale (es. 30 giorni a 15 minuti = 2880).
+MAX_GRID_POINTS = 5000
+LEDGER_CACHE_MAX_ENTRIES = 1024
+LEDGER_CACHE_TTL_SECONDS = 60 * 60
+
+_RESOLUTION_WIDTHS: Dict[str, timedelta] = dict(rollups.RESOLUTIONS)
+
+# Il ledger di un utente cambia solo con un nuovo movimento: la chiave include l'id dell'ultima transazione,
+# quindi le voci superate non vengono più lette e sono espulse dall'LRU.
+_ledger_cache: StaleWhileRevalidateCache["PortfolioLedger"] = StaleWhileRevalidateCache(
+    max_entries=LEDGER_CACHE_MAX_ENTRIES,
+    ttl_seconds=LEDGER_CACHE_TTL_SECONDS,
+    stale_seconds=0,
+)
+
+
+@dataclass(frozen=True)
+class AssetLedger:
+    """Movimenti di un asset: istanti dei trade (ms), quantità cumulate e quantità detenuta oggi."""
+
+    crypto_id: str
+    trade_timestamps: np.ndarray
+    cumulative: np.ndarray
+    current_amount: float
+
+    @classmethod
+    def from_columns(
+        cls,
+        crypto_id: str,
+        timestamps: Sequence[int] | None,
+        quantities: Sequence[float] | None,
+        current_amount: float,
+    ) -> "AssetLedger":
+        """Costruisce il ledger dagli array (`array_agg`) di istanti e quantità con segno."""
+        signed = np.asarray(quantities or (), dtype=np.float64)
+        return cls(
+            crypto_id=crypto_id,
+            trade_timestamps=np.asarray(timestamps or (), dtype=np.int64),
+            cumulative=np.concatenate(([0.0], np.cumsum(signed))),
+            current_amount=float(current_amount),
+        )
+
+    def holdings(self, grid: np.ndarray) -> np.ndarray:
+        """
+        Quantità detenuta a ogni istante della griglia.
+
+        La ricostruzione parte dalla posizione attuale e sottrae i movimenti successivi a ciascun istante,
+        così resta corretta anche per posizioni aperte prima dello storico dei movimenti.
+        """
+        applied = np.searchsorted(self.trade_timestamps, grid, side="right")
+        later = self.cumulative[-1] - self.cumulative[applied]
+        return np.maximum(self.current_amount - later, 0.0)
+
+
+@dataclass(frozen=True)
+class PortfolioLedger:
+    """Ledger di tutti gli asset di un utente."""
+
+    assets: Tuple[AssetLedger, ...]
+
+    def crypto_ids(self) -> list[str]:
+        return [asset.crypto_id for asset in self.assets]
+
+
+def build_grid(window: timedelta, step: timedelta, now: datetime | None = None) -> np.ndarray:
+    """
+    Griglia di istanti (ms) allineata al passo, dall'inizio della finestra fino all'ultimo bucket iniziato.
+
+    Solleva:
+        ValueError: Se la griglia supera `MAX_GRID_POINTS` punti.
+    """
+    step_ms = int(step.total_seconds() * 1000)
+    points = int(window / step) + 1
+    if points > MAX_GRID_POINTS:
+        raise ValueError(f"La griglia richiesta supera {MAX_GRID_POINTS} punti: scegliere un intervallo più ampio.")
+    end_ms = int((now or datetime.now(timezone.utc)).timestamp() * 1000) // step_ms * step_ms
+    return end_ms - step_ms * np.arange(points - 1, -1, -1, dtype=np.int64)
+
+
+def prices_on_grid(grid: np.ndarray, timestamps: Sequence[int] | None, prices: Sequence[float] | None) -> np.ndarray:
+    """
+    Prezzo di chiusura del bucket che contiene ciascun istante della griglia (ultimo bucket iniziato non dopo).
+
+    Gli istanti precedenti al primo prezzo noto usano il primo prezzo; senza prezzi il valore è zero.
+    """
+    if not timestamps:
+        return np.zeros(len(grid), dtype=np.float64)
+    known = np.asarray(timestamps, dtype=np.int64)
+    closes = np.asarray(prices, dtype=np.float64)
+    positions = np.searchsorted(known, grid, side="right") - 1
+    return closes[np.maximum(positions, 0)]
+
+
+def portfolio_values(ledger: PortfolioLedger, instants: np.ndarray, price_rows: Dict[str, np.ndarray]) -> np.ndarray:
+    """Valore totale del portafoglio: somma per asset della quantità detenuta a ogni istante × prezzo."""
+    if not ledger.assets:
+        return np.zeros(len(instants), dtype=np.float64)
+    quantities = np.vstack([asset.holdings(instants) for asset in ledger.assets])
+    prices = np.vstack([price_rows[asset.crypto_id] for asset in ledger.assets])
+    return (quantities * prices).sum(axis=0)
+
+
+async def last_transaction_id(conn: AsyncConnection, user_id: str) -> str | None:
+    """Id dell'ultima transazione dell'utente: cambia a ogni movimento e versiona i dati derivati."""
+    async with conn.cursor() as cur:
+        await cur.execute(
+            """
+            SELECT id
+            FROM transactions
+            WHERE user_id = %s
+            ORDER BY created_at DESC, id DESC
+            LIMIT 1
+            """,
+            (user_id,),
+        )
+        row = await cur.fetchone()
+    return str(row["id"]) if row else None
+
+
+async def load_ledger(conn: AsyncConnection, user_id: str) -> PortfolioLedger:
+    """
+    Legge in un'unica query i movimenti crypto dell'utente, raggruppati per asset, e le quantità attuali.
+
+    Gli ordini registrati prima della colonna `quantity` sono stimati dividendo l'importo per l'ultimo prezzo
+    registrato all'istante dell'ordine.
+
+    Argomenti:
+        conn: Connessione con RLS configurata per l'utente.
+        user_id: Identificativo dell'utente.
+
+    Restituisce:
+        PortfolioLedger: Ledger con un elemento per ogni asset detenuto o movimentato.
+    """
+    async with conn.cursor() as cur:
+        await cur.execute(
+            """
+            WITH trades AS (
+                SELECT
+                    crypto.id AS crypto_id,
+                    t.created_at,
+                    CASE WHEN t.direction = 'buy' THEN 1 ELSE -1 END
+                        * COALESCE(t.quantity, t.amount / NULLIF(estimate.price, 0)) AS signed_quantity
+                FROM transactions t
+                JOIN crypto ON UPPER(crypto.symbol) = UPPER(t.category)
+                LEFT JOIN LATERAL (
+                    SELECT price
+                    FROM crypto_variation
+                    WHERE t.quantity IS NULL
+                      AND crypto_id = crypto.id
+                      AND created_at <= t.created_at
+                    ORDER BY created_at DESC
+                    LIMIT 1
+                ) AS estimate ON TRUE
+                WHERE t.user_id = %s
+                  AND (t.quantity IS NOT NULL OR t.idem_key LIKE 'market:%%')
+            ),
+            ledger AS (
+                SELECT
+                    crypto_id,
+                    array_agg((EXTRACT(EPOCH FROM created_at) * 1000)::BIGINT ORDER BY created_at) AS timestamps,
+                    array_agg(signed_quantity::DOUBLE PRECISION ORDER BY created_at) AS quantities
+                FROM trades
+                WHERE signed_quantity IS NOT NULL
+                GROUP BY crypto_id
+            ),
+            held AS (
+                SELECT crypto.id AS crypto_id, position.amount::DOUBLE PRECISION AS amount
+                FROM user_crypto_positions position
+                JOIN crypto ON UPPER(crypto.symbol) = position.asset_symbol
+                WHERE position.user_id = %s
+            )
+            SELECT
+                COALESCE(ledger.crypto_id, held.crypto_id) AS crypto_id,
+                ledger.timestamps,
+                ledger.quantities,
+                COALESCE(held.amount, 0) AS amount
+            FROM ledger
+            FULL JOIN held ON held.crypto_id = ledger.crypto_id
+            ORDER BY 1
+            """,
+            (user_id, user_id),
+        )
+        rows = await cur.fetchall()
+    return PortfolioLedger(
+        assets=tuple(
+            AssetLedger.from_columns(row["crypto_id"], row["timestamps"], row["quantities"], row["amount"])
+            for row in rows
+        )
+    )
+
+
+async def _load_grid_prices(
+    conn: AsyncConnection,
+    crypto_ids: list[str],
+    grid: np.ndarray,
+    resolution: str,
+) -> Dict[str, np.ndarray]:
+    # Per ogni asset si parte dall'ultimo bucket non successivo all'inizio della griglia, così anche i primi
+    # punti hanno il prezzo effettivamente valido in quel momento.
+    async with conn.cursor() as cur:
+        await cur.execute(
+            """
+            SELECT ids.crypto_id, series.timestamps, series.prices
+            FROM UNNEST(%(ids)s::text[]) AS ids (crypto_id)
+            CROSS JOIN LATERAL (
+                SELECT COALESCE(MAX(bucket_start), to_timestamp(%(start)s / 1000.0)) AS since
+                FROM crypto_variation_rollup
+                WHERE crypto_id = ids.crypto_id
+                  AND resolution = %(resolution)s
+                  AND bucket_start <= to_timestamp(%(start)s / 1000.0)
+            ) AS anchor
+            CROSS JOIN LATERAL (
+                SELECT
+                    array_agg((EXTRACT(EPOCH FROM bucket_start) * 1000)::BIGINT ORDER BY bucket_start) AS timestamps,
+                    array_agg(close::DOUBLE PRECISION ORDER BY bucket_start) AS prices
+                FROM crypto_variation_rollup
+                WHERE crypto_id = ids.crypto_id
+                  AND resolution = %(resolution)s
+                  AND bucket_start >= anchor.since
+            ) AS series
+            """,
+            {"ids": crypto_ids, "resolution": resolution, "start": int(grid[0])},
+        )
+        rows = await cur.fetchall()
+    return {row["crypto_id"]: prices_on_grid(grid, row["timestamps"], row["prices"]) for row in rows}
+
+
+async def load_portfolio_history(
+    conn: AsyncConnection,
+    user_id: str,
+    window: timedelta,
+    resolution: str,
+) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Calcola il valore del portafoglio dell'utente sulla griglia temporale richiesta.
+
+    Il ledger è memorizzato per utente e ultimo movimento; a ogni richiesta restano una lettura della
+    chiave, una delle chiusure dalle rollup e poche operazioni vettoriali.
+
+    Argomenti:
+        conn: Connessione con RLS configurata per l'utente.
+        user_id: Identificativo dell'utente.
+        window: Ampiezza della finestra temporale.
+        resolution: Passo della griglia, tra le risoluzioni di `rollups.RESOLUTIONS`.
+
+    Restituisce:
+        Tuple[np.ndarray, np.ndarray]: Istanti della griglia (ms) e valore del portafoglio in ciascuno.
+
+    Solleva:
+        ValueError: Se la risoluzione non è supportata o la griglia è troppo fitta.
+    """
+    step = _RESOLUTION_WIDTHS.get(resolution)
+    if step is None:
+        raise ValueError(f"Intervallo non supportato: {resolution}.")
+    grid = build_grid(window, step)
+    watermark = await last_transaction_id(conn, user_id)
+    key = (user_id, watermark)
+    ledger = _ledger_cache.get_fresh(key)
+    if ledger is None:
+        # Caricato sulla connessione di questa richiesta e fuori da `get_or_load`: un caricamento condiviso
+        # (SingleFlight sotto `asyncio.shield`) userebbe la connessione di un'altra richiesta, anche dopo che
+        # questa l'ha restituita al pool.
+        ledger = await load_ledger(conn, user_id)
+        _ledger_cache.put(key, ledger)
+    if not ledger.assets:
+        return grid, np.zeros(len(grid), dtype=np.float64)
+    price_rows = await _load_grid_prices(conn, ledger.crypto_ids(), grid, resolution)
+    # Ogni punto vale la quantità detenuta a fine bucket per il prezzo di chiusura del bucket.
+    step_ms = int(step.total_seconds() * 1000)
+    return grid, portfolio_values(ledger, grid + step_ms, price_rows)
+
+
+def ledger_cache_stats() -> dict[str, int]:
+    """Metriche della cache dei ledger per il monitoraggio."""
+    return _ledger_cache.stats()
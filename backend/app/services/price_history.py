@@ -0,0 +1,121 @@
+"""Rappresentazione colonnare dello storico prezzi e sua codifica negoziata (JSON, colonnare, binaria)."""
+
+from __future__ import annotations
+
+import struct
+from dataclasses import dataclass
+from typing import Iterable, List, Sequence
+
+import numpy as np
+
+from . import downsampling
+
+# Formati supportati per lo storico, selezionati tramite l'header `Accept`.
+HISTORY_JSON = "application/json"
+HISTORY_COLUMNAR = "application/vnd.fintech.history.columnar+json"
+HISTORY_BINARY = "application/vnd.fintech.history.binary"
+
+# Intestazione del formato binario: numero di punti come uint64 little-endian.
+# Gli 8 byte mantengono allineati i blocchi successivi (BigInt64Array/Float64Array lato browser).
+_BINARY_HEADER = struct.Struct("<Q")
+
+
+@dataclass(frozen=True)
+class PriceSeries:
+    """Serie storica in forma colonnare: timestamp in millisecondi (int64) e prezzi (float64)."""
+
+    timestamps: np.ndarray
+    prices: np.ndarray
+
+    @classmethod
+    def from_columns(cls, timestamps: Sequence[int] | None, prices: Sequence[float] | None) -> "PriceSeries":
+        """Costruisce la serie dagli array restituiti dal database (`array_agg`)."""
+        return cls(
+            timestamps=np.asarray(timestamps or (), dtype=np.int64),
+            prices=np.asarray(prices or (), dtype=np.float64),
+        )
+
+    @classmethod
+    def from_points(cls, points: Sequence[dict]) -> "PriceSeries":
+        """Costruisce la serie da una lista di punti `{timestamp, price}` (es. storico CoinCap)."""
+        size = len(points)
+        return cls(
+            timestamps=np.fromiter((point["timestamp"] for point in points), dtype=np.int64, count=size),
+            prices=np.fromiter((point["price"] for point in points), dtype=np.float64, count=size),
+        )
+
+    def __len__(self) -> int:
+        return len(self.timestamps)
+
+    def downsample(self, max_points: int) -> "PriceSeries":
+        """Riduce la serie a non più di `max_points` punti con LTTB."""
+        if len(self) <= max_points:
+            return self
+        selected = downsampling.lttb(self.timestamps, self.prices, max_points)
+        return PriceSeries(timestamps=self.timestamps[selected], prices=self.prices[selected])
+
+    def to_points(self) -> List[dict]:
+        """Restituisce la serie nel formato storico a lista di punti `{timestamp, price}`."""
+        return [
+            {"timestamp": timestamp, "price": price}
+            for timestamp, price in zip(self.timestamps.tolist(), self.prices.tolist())
+        ]
+
+    def to_columns(self) -> dict:
+        """Restituisce la serie come array paralleli `{timestamps, prices}`."""
+        return {"timestamps": self.timestamps.tolist(), "prices": self.prices.tolist()}
+
+    def to_binary(self) -> bytes:
+        """
+        Codifica la serie in un buffer binario compatto.
+
+        Layout (little-endian): numero di punti `uint64`, poi `n` timestamp `int64`, poi `n` prezzi `float64`.
+        """
+        return b"".join(
+            (
+                _BINARY_HEADER.pack(len(self)),
+                self.timestamps.astype("<i8", copy=False).tobytes(),
+                self.prices.astype("<f8", copy=False).tobytes(),
+            )
+        )
+
+
+def negotiate_history_format(accept: str | None, supported: Iterable[str]) -> str | None:
+    """
+    Sceglie il formato di risposta dello storico in base all'header `Accept`.
+
+    Argomenti:
+        accept: Valore dell'header `Accept` (assente equivale a `*/*`).
+        supported: Formati offerti dall'endpoint, in ordine di preferenza del server.
+
+    Restituisce:
+        str | None: Formato scelto, oppure None se nessun formato accettato è disponibile.
+    """
+    offered = list(supported)
+    if not accept:
+        return offered[0]
+    ranges: List[tuple[str, float]] = []
+    for part in accept.split(","):
+        media_range, *params = [piece.strip() for piece in part.split(";")]
+        quality = 1.0
+        for param in params:
+            name, _, value = param.partition("=")
+            if name.strip().lower() == "q":
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0.0
+        ranges.append((media_range.lower(), quality))
+
+    best: str | None = None
+    best_quality = 0.0
+    for candidate in offered:
+        # Si applica la qualità del range più specifico che copre il formato candidato.
+        specificity = {candidate: 2, f"{candidate.split('/')[0]}/*": 1, "*/*": 0}
+        matches = [(specificity[media_range], quality) for media_range, quality in ranges if media_range in specificity]
+        if not matches:
+            continue
+        quality = max(matches)[1]
+        if quality > best_quality:
+            best, best_quality = candidate, quality
+    return best
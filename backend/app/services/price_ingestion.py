@@ -0,0 +1,286 @@
+"""Worker in background che acquisisce periodicamente i prezzi CoinCap e li pubblica in memoria."""
+
+from __future__ import annotations
+
+import asyncio
+import logging
+from contextlib import asynccontextmanager
+from datetime import date, datetime, timezone
+from decimal import Decimal
+from typing import TYPE_CHECKING, AsyncIterator, Dict, List
+
+from psycopg import AsyncConnection
+from psycopg_pool import AsyncConnectionPool
+
+from ..config import Settings
+from . import coincap, fx, partitions, revaluation, rollups
+from .broadcast import PriceBroadcaster
+from .circuit_breaker import CircuitOpenError
+
+if TYPE_CHECKING:
+    from .shared_cache import SharedMarketCache
+
+logger = logging.getLogger(__name__)
+
+# Chiavi di `market_cache` usate per eleggere il worker che interroga CoinCap e per condividerne lo snapshot.
+INGESTION_LEASE_KEY = "ingestion:leader"
+LATEST_SNAPSHOT_KEY = "ingestion:snapshot"
+
+
+async def record_price_snapshots(conn: AsyncConnection, prices: Dict[str, Decimal]) -> int:
+    """
+    Registra in `crypto_variation` tutti i prezzi ricevuti con un unico INSERT multi-riga.
+
+    Il commit è a carico del chiamante, così l'aggiornamento delle rollup avviene nella stessa transazione.
+
+    Argomenti:
+        conn: Connessione su cui eseguire l'inserimento.
+        prices: Prezzi correnti indicizzati per id crypto.
+
+    Restituisce:
+        int: Numero di righe effettivamente inserite (gli id sconosciuti vengono ignorati).
+    """
+    if not prices:
+        return 0
+    async with conn.cursor() as cur:
+        await cur.execute(
+            """
+            INSERT INTO crypto_variation (crypto_id, price)
+            SELECT snapshot.crypto_id, snapshot.price
+            FROM UNNEST(%s::text[], %s::numeric[]) AS snapshot (crypto_id, price)
+            JOIN crypto ON crypto.id = snapshot.crypto_id;
+            """,
+            (list(prices.keys()), list(prices.values())),
+        )
+        inserted = cur.rowcount
+    return inserted
+
+
+async def load_latest_snapshot(conn: AsyncConnection) -> List[dict]:
+    """Ricostruisce lo snapshot di mercato dall'ultimo prezzo registrato per ogni crypto."""
+    async with conn.cursor() as cur:
+        await cur.execute(
+            """
+            SELECT c.id, UPPER(c.symbol) AS symbol, c.name, latest.price
+            FROM crypto c
+            JOIN LATERAL (
+                SELECT price
+                FROM crypto_variation
+                WHERE crypto_id = c.id
+                ORDER BY created_at DESC
+                LIMIT 1
+            ) AS latest ON TRUE
+            ORDER BY c.rank ASC;
+            """
+        )
+        rows = await cur.fetchall()
+    return [
+        {
+            "id": row["id"],
+            "symbol": row["symbol"],
+            "name": row["name"],
+            "price": float(row["price"]),
+            "change24h": None,
+            "image": coincap.build_icon(row["symbol"]),
+            "market_cap": None,
+        }
+        for row in rows
+    ]
+
+
+class PriceIngestor:
+    """Interroga CoinCap a cadenza fissa, salva gli snapshot su DB e mantiene l'ultimo valore in memoria."""
+
+    def __init__(
+        self,
+        pool: AsyncConnectionPool,
+        *,
+        interval_seconds: float,
+        partition_months_ahead: int = 3,
+        retention_months: int = 12,
+        broadcaster: PriceBroadcaster | None = None,
+        shared_cache: "SharedMarketCache | None" = None,
+    ) -> None:
+        self._pool = pool
+        self._shared = shared_cache
+        self._followed_at: datetime | None = None
+        self.broadcaster = broadcaster or PriceBroadcaster()
+        self._interval = interval_seconds
+        self._partition_months_ahead = partition_months_ahead
+        self._retention_months = retention_months
+        self._maintained_on: date | None = None
+        self._snapshot: List[dict] = []
+        self._updated_at: datetime | None = None
+        self._task: asyncio.Task[None] | None = None
+
+    @property
+    def updated_at(self) -> datetime | None:
+        """Istante dell'ultima pubblicazione dello snapshot."""
+        return self._updated_at
+
+    def latest(self) -> List[dict]:
+        """Restituisce l'ultimo snapshot pubblicato senza effettuare I/O."""
+        return self._snapshot
+
+    def publish(self, snapshot: List[dict]) -> None:
+        """Sostituisce atomicamente lo snapshot esposto alle route e lo inoltra ai client in streaming."""
+        self._snapshot = snapshot
+        self._updated_at = datetime.now(timezone.utc)
+        self.broadcaster.publish(snapshot)
+
+    async def load_from_database(self) -> None:
+        """Pre-carica lo snapshot dagli ultimi prezzi salvati, così le route rispondono subito dopo l'avvio."""
+        async with self._pool.connection() as conn:
+            snapshot = await load_latest_snapshot(conn)
+        if snapshot:
+            self.publish(snapshot)
+
+    async def run_once(self) -> List[dict]:
+        """
+        Esegue un singolo ciclo di acquisizione: salva i prezzi, aggiorna le rollup e rivaluta le posizioni.
+
+        Snapshot e prezzi arrivano da un'unica chiamata CoinCap non in cache, così variazione e capitalizzazione
+        pubblicate sono coerenti con il prezzo. I prezzi (USD) sono convertiti in EUR una volta per tick con il
+        tasso in memoria: snapshot, `crypto_variation` e rollup sono già nella valuta di ordini e posizioni.
+
+        Restituisce:
+            List[dict]: Snapshot pubblicato al termine del ciclo.
+        """
+        live_market, live_prices = await coincap.fetch_live_market()
+        rates = fx.get_rates()
+        market = rates.convert_snapshot(live_market)
+        converted = rates.convert_prices(live_prices)
+        prices = {asset_id: price for asset_id, price in converted.items() if price > 0}
+        # Un asset senza prezzo valido in questo tick mantiene l'ultima voce pubblicata, se esiste.
+        previous = {entry["id"]: entry for entry in self._snapshot}
+        snapshot = [
+            {**entry, "price": float(prices[entry["id"]])} if entry["id"] in prices else previous[entry["id"]]
+            for entry in market
+            if entry["id"] in prices or entry["id"] in previous
+        ]
+        async with self._pool.connection() as conn:
+            if await record_price_snapshots(conn, prices):
+                await rollups.refresh_rollups(conn)
+            await conn.commit()
+            # Fuori dalla transazione di acquisizione: blocchi brevi che saltano le posizioni bloccate dagli ordini.
+            await revaluation.revalue_positions(conn, prices)
+        self.publish(snapshot)
+        return snapshot
+
+    async def tick(self) -> None:
+        """
+        Esegue un ciclo del worker coordinandosi con gli altri processi tramite la cache condivisa.
+
+        Il processo che detiene il lease di ingestion interroga CoinCap e salva lo snapshot in `market_cache`;
+        gli altri adottano lo snapshot salvato senza chiamate upstream.
+        """
+        if self._shared is None:
+            await self.run_once()
+        # Il lease copre due intervalli, così il leader lo rinnova prima che scada tra un ciclo e l'altro.
+        elif await self._shared.try_acquire(INGESTION_LEASE_KEY, lease_seconds=self._interval * 2):
+            snapshot = await self.run_once()
+            await self._shared.store(LATEST_SNAPSHOT_KEY, snapshot)
+        else:
+            await self.follow()
+
+    async def follow(self) -> bool:
+        """
+        Pubblica lo snapshot salvato dal leader, se più recente dell'ultimo adottato.
+
+        Restituisce:
+            bool: True se è stato pubblicato un nuovo snapshot.
+        """
+        if self._shared is None:
+            return False
+        entry = await self._shared.read(LATEST_SNAPSHOT_KEY)
+        if entry is None or entry.fetched_at == self._followed_at:
+            return False
+        self._followed_at = entry.fetched_at
+        self.publish(entry.payload)
+        return True
+
+    async def maintain_partitions(self) -> List[dict]:
+        """Esegue la manutenzione delle partizioni di `crypto_variation` (creazione e retention) e delle rollup."""
+        async with self._pool.connection() as conn:
+            actions = await partitions.maintain_partitions(
+                conn,
+                months_ahead=self._partition_months_ahead,
+                retention_months=self._retention_months,
+            )
+            await conn.commit()
+        self._maintained_on = datetime.now(timezone.utc).date()
+        dropped = [action["partition_name"] for action in actions if action["action"] == "dropped"]
+        if dropped:
+            logger.info("dropped expired crypto_variation partitions: %s", ", ".join(dropped))
+        pruned = [action["partition_name"] for action in actions if action["action"] == "pruned"]
+        if pruned:
+            logger.info("pruned expired rollup buckets: %s", ", ".join(pruned))
+        return actions
+
+    async def _run_forever(self) -> None:
+        while True:
+            if self._maintained_on != datetime.now(timezone.utc).date():
+                try:
+                    await self.maintain_partitions()
+                except Exception:  # noqa: BLE001 - la manutenzione viene ritentata al ciclo successivo
+                    logger.exception("crypto_variation partition maintenance failed")
+            try:
+                await self.tick()
+            except asyncio.CancelledError:
+                raise
+            except CircuitOpenError as exc:
+                logger.warning("price ingestion tick skipped: %s", exc)
+            except Exception:  # noqa: BLE001 - il worker non deve interrompersi per errori transitori
+                logger.exception("price ingestion tick failed")
+            await asyncio.sleep(self._interval)
+
+    def start(self) -> None:
+        """Avvia il loop di acquisizione se non è già attivo."""
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run_forever(), name="price-ingestion")
+
+    async def stop(self) -> None:
+        """Interrompe il loop di acquisizione attendendo la cancellazione del task."""
+        if self._task is None:
+            return
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+
+
+@asynccontextmanager
+async def lifespan_price_ingestor(
+    settings: Settings,
+    pool: AsyncConnectionPool,
+    shared_cache: "SharedMarketCache | None" = None,
+) -> AsyncIterator[PriceIngestor]:
+    """
+    Gestisce il ciclo di vita del worker di acquisizione prezzi durante il `lifespan` di FastAPI.
+
+    Argomenti:
+        settings: Impostazioni applicative con cadenza e abilitazione del worker.
+        pool: Pool di connessioni usato per leggere e scrivere gli snapshot.
+        shared_cache: Cache condivisa per eleggere un solo worker che interroga CoinCap (opzionale).
+
+    Restituisce:
+        PriceIngestor: Worker attivo (o solo pre-caricato, se disabilitato) finché il contesto rimane aperto.
+    """
+    ingestor = PriceIngestor(
+        pool,
+        interval_seconds=settings.market_ingestion_interval_seconds,
+        partition_months_ahead=settings.market_partition_months_ahead,
+        retention_months=settings.market_history_retention_months,
+        broadcaster=PriceBroadcaster(max_subscribers=settings.market_stream_max_clients),
+        shared_cache=shared_cache,
+    )
+    await ingestor.load_from_database()
+    await ingestor.follow()
+    if settings.market_ingestion_enabled:
+        ingestor.start()
+    try:
+        yield ingestor
+    finally:
+        await ingestor.stop()
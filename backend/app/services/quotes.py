@@ -0,0 +1,172 @@
+"""Quotazioni firmate a breve scadenza: il prezzo degli ordini è quello emesso dal server, verificato senza I/O."""
+
+from __future__ import annotations
+
+import base64
+import hashlib
+import hmac
+import logging
+import secrets
+from contextlib import asynccontextmanager
+from dataclasses import dataclass
+from datetime import datetime, timedelta, timezone
+from decimal import Decimal, InvalidOperation
+from typing import AsyncIterator
+
+from ..config import Settings
+from .fx import PRICE_QUANTUM
+
+logger = logging.getLogger(__name__)
+
+class QuoteError(ValueError):
+    """Errore sollevato quando un token di quotazione è malformato, alterato o riferito ad altri asset o utenti."""
+
+
+@dataclass(frozen=True)
+class Quote:
+    """Prezzo unitario in EUR garantito a un utente per un asset fino a `expires_at`."""
+
+    user_id: str
+    asset_symbol: str
+    price_eur: Decimal
+    expires_at: datetime
+    token: str
+
+    def is_expired(self, now: datetime | None = None) -> bool:
+        """Indica se la quotazione non è più utilizzabile per nuovi ordini."""
+        return (now or datetime.now(timezone.utc)) >= self.expires_at
+
+
+def _b64encode(data: bytes) -> str:
+    return base64.urlsafe_b64encode(data).rstrip(b"=").decode("ascii")
+
+
+def _b64decode(data: str) -> bytes:
+    return base64.urlsafe_b64decode(data + "=" * (-len(data) % 4))
+
+
+class QuoteSigner:
+    """
+    Emette e verifica quotazioni firmate con HMAC-SHA256.
+
+    Il token è `base64url(utente:SIMBOLO:prezzo:scadenza).base64url(firma)`: la verifica è un HMAC e un confronto
+    a tempo costante, senza letture dal database né dall'upstream. Il token vale solo per l'utente che l'ha
+    richiesto, così non può essere riusato da altri entro la scadenza. Tutti i processi dell'API devono condividere
+    il segreto perché un token emesso da uno sia accettato dagli altri.
+    """
+
+    def __init__(self, secret: bytes, *, ttl_seconds: float) -> None:
+        self._secret = secret
+        self._ttl = timedelta(seconds=ttl_seconds)
+        self.issued = 0
+        self.rejected = 0
+
+    def _sign(self, payload: bytes) -> bytes:
+        return hmac.new(self._secret, payload, hashlib.sha256).digest()
+
+    def issue(self, user_id: str, asset_symbol: str, price_eur: Decimal, now: datetime | None = None) -> Quote:
+        """
+        Firma una quotazione per l'utente e l'asset al prezzo indicato, valida per la durata configurata.
+
+        Argomenti:
+            user_id: Identificativo dell'utente a cui la quotazione è riservata.
+            asset_symbol: Ticker dell'asset (es. BTC).
+            price_eur: Prezzo unitario in EUR; viene arrotondato alla precisione dei prezzi memorizzati.
+            now: Istante di emissione, per i test.
+
+        Restituisce:
+            Quote: Quotazione con il token da allegare all'ordine.
+        """
+        symbol = asset_symbol.upper()
+        price = price_eur.quantize(PRICE_QUANTUM)
+        expires_at = (now or datetime.now(timezone.utc)) + self._ttl
+        payload = f"{user_id}:{symbol}:{price}:{int(expires_at.timestamp())}".encode("utf-8")
+        token = f"{_b64encode(payload)}.{_b64encode(self._sign(payload))}"
+        self.issued += 1
+        return Quote(
+            user_id=str(user_id),
+            asset_symbol=symbol,
+            price_eur=price,
+            expires_at=datetime.fromtimestamp(int(expires_at.timestamp()), timezone.utc),
+            token=token,
+        )
+
+    def verify(self, token: str, user_id: str, asset_symbol: str) -> Quote:
+        """
+        Verifica firma, utente e asset di un token; la scadenza è lasciata al chiamante (`Quote.is_expired`).
+
+        Così un retry idempotente di un ordine già eseguito riceve l'esito originale anche a quotazione scaduta.
+
+        Argomenti:
+            token: Token restituito da `issue`.
+            user_id: Identificativo dell'utente che invia l'ordine.
+            asset_symbol: Ticker dell'asset dell'ordine.
+
+        Restituisce:
+            Quote: Quotazione decodificata.
+
+        Solleva:
+            QuoteError: Se il token è malformato, la firma non corrisponde o utente e asset sono diversi.
+        """
+        try:
+            encoded_payload, encoded_signature = token.split(".")
+            payload = _b64decode(encoded_payload)
+            signature = _b64decode(encoded_signature)
+        except ValueError as exc:
+            self.rejected += 1
+            raise QuoteError("Quotazione non valida.") from exc
+        if not hmac.compare_digest(signature, self._sign(payload)):
+            self.rejected += 1
+            raise QuoteError("Quotazione non valida.")
+        try:
+            # L'identificativo utente viene dal provider OIDC e può contenere ":", gli altri campi no.
+            owner, symbol, price, expires_at = payload.decode("utf-8").rsplit(":", 3)
+            quote = Quote(
+                user_id=owner,
+                asset_symbol=symbol,
+                price_eur=Decimal(price),
+                expires_at=datetime.fromtimestamp(int(expires_at), timezone.utc),
+                token=token,
+            )
+        except (ValueError, InvalidOperation) as exc:
+            self.rejected += 1
+            raise QuoteError("Quotazione non valida.") from exc
+        if quote.user_id != str(user_id):
+            self.rejected += 1
+            raise QuoteError("La quotazione è stata emessa per un altro utente.")
+        if quote.asset_symbol != asset_symbol.upper():
+            self.rejected += 1
+            raise QuoteError("La quotazione si riferisce a un altro asset.")
+        return quote
+
+    def stats(self) -> dict[str, object]:
+        """Contatori di emissione e rifiuto per il monitoraggio."""
+        return {"ttl_seconds": self._ttl.total_seconds(), "issued": self.issued, "rejected": self.rejected}
+
+
+@asynccontextmanager
+async def lifespan_quote_signer(settings: Settings) -> AsyncIterator[QuoteSigner]:
+    """
+    Crea il firmatario delle quotazioni con il segreto configurato.
+
+    Senza `QUOTE_SIGNING_SECRET` viene generato un segreto casuale: va bene con un solo processo, mentre con più
+    worker le quotazioni emesse da uno verrebbero rifiutate dagli altri, quindi in quel caso l'avvio fallisce.
+
+    Argomenti:
+        settings: Impostazioni con segreto, durata delle quotazioni e numero di worker.
+
+    Restituisce:
+        QuoteSigner: Firmatario condiviso dalle route del market.
+
+    Solleva:
+        ValueError: Se il segreto manca e sono configurati più worker (`WEB_CONCURRENCY` > 1).
+    """
+    secret = settings.quote_signing_secret
+    if not secret:
+        if settings.web_concurrency > 1:
+            raise ValueError("QUOTE_SIGNING_SECRET è obbligatorio con più worker (WEB_CONCURRENCY > 1).")
+        logger.warning("QUOTE_SIGNING_SECRET not set, signing quotes with a per-process random secret")
+        secret = secrets.token_hex(32)
+    if not settings.quote_required:
+        logger.warning("QUOTE_REQUIRED=false: orders without a signed quote are priced by the client")
+    yield QuoteSigner(secret.encode("utf-8"), ttl_seconds=settings.quote_ttl_seconds)
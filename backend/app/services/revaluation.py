@@ -0,0 +1,73 @@
+"""Rivalutazione a blocchi delle posizioni crypto sugli ultimi prezzi acquisiti."""
+
+from __future__ import annotations
+
+from decimal import Decimal
+from typing import Dict
+
+from psycopg import AsyncConnection
+
+# Valore di `price_source` per le valutazioni calcolate dal worker di ingestion.
+PRICE_SOURCE = "coincap-ingestion"
+
+# Posizioni aggiornate per transazione: i lock di riga restano brevi anche con molti utenti sullo stesso asset.
+CHUNK_SIZE = 500
+
+_REVALUE_CHUNK = """
+WITH tick AS (
+    SELECT UPPER(crypto.symbol) AS symbol, tick.price
+    FROM UNNEST(%s::text[], %s::numeric[]) AS tick (crypto_id, price)
+    JOIN crypto ON crypto.id = tick.crypto_id
+),
+batch AS (
+    SELECT position.id, ROUND(position.amount * tick.price, 2) AS valuation
+    FROM user_crypto_positions AS position
+    JOIN tick ON tick.symbol = position.asset_symbol
+    WHERE position.id > %s
+      AND position.last_valuation_eur IS DISTINCT FROM ROUND(position.amount * tick.price, 2)
+    ORDER BY position.id
+    LIMIT %s
+    FOR UPDATE OF position SKIP LOCKED
+)
+UPDATE user_crypto_positions AS position
+SET last_valuation_eur = batch.valuation,
+    price_source = %s,
+    synced_at = NOW()
+FROM batch
+WHERE position.id = batch.id
+RETURNING position.id;
+"""
+
+
+async def revalue_positions(conn: AsyncConnection, prices: Dict[str, Decimal]) -> int:
+    """
+    Ricalcola `last_valuation_eur` delle posizioni sulle crypto indicate, a blocchi di `CHUNK_SIZE` righe.
+
+    Ogni blocco è una transazione breve con commit proprio e salta con `SKIP LOCKED` le posizioni bloccate da
+    ordini in corso: la rivalutazione non attende né blocca `execute_crypto_order` e il batch. Sono aggiornate
+    solo le posizioni con valutazione diversa da quella corrente, quindi una riga saltata viene recuperata al
+    tick successivo e un prezzo invariato non scrive nulla. Il join con `crypto` traduce gli id CoinCap nei
+    ticker usati da `user_crypto_positions`.
+
+    Argomenti:
+        conn: Connessione senza transazione aperta su cui eseguire gli aggiornamenti.
+        prices: Prezzi correnti indicizzati per id crypto.
+
+    Restituisce:
+        int: Numero di posizioni rivalutate.
+    """
+    if not prices:
+        return 0
+    crypto_ids, values = list(prices.keys()), list(prices.values())
+    # Paginazione per chiave: ogni blocco riparte dopo l'ultimo id aggiornato, senza rileggere le righe saltate.
+    cursor = "00000000-0000-0000-0000-000000000000"
+    updated = 0
+    while True:
+        async with conn.cursor() as cur:
+            await cur.execute(_REVALUE_CHUNK, (crypto_ids, values, cursor, CHUNK_SIZE, PRICE_SOURCE))
+            ids = [row["id"] for row in await cur.fetchall()]
+        await conn.commit()
+        updated += len(ids)
+        if len(ids) < CHUNK_SIZE:
+            return updated
+        cursor = max(ids)
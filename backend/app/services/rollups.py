@@ -0,0 +1,122 @@
+"""Rollup OHLC multi-risoluzione di `crypto_variation` e selezione della granularità per lo storico."""
+
+from __future__ import annotations
+
+from datetime import timedelta
+from typing import Tuple
+
+from psycopg import AsyncConnection, AsyncCursor
+
+from .price_history import PriceSeries
+
+# Risoluzioni mantenute in `crypto_variation_rollup`, dalla più fine alla più grossolana.
+RESOLUTIONS: Tuple[Tuple[str, timedelta], ...] = (
+    ("1m", timedelta(minutes=1)),
+    ("15m", timedelta(minutes=15)),
+    ("1h", timedelta(hours=1)),
+    ("1d", timedelta(days=1)),
+)
+# Numero minimo di punti che una risoluzione deve fornire sulla finestra richiesta.
+HISTORY_TARGET_POINTS = 60
+
+
+def select_resolution(window: timedelta) -> str:
+    """
+    Sceglie la risoluzione più grossolana che fornisce almeno `HISTORY_TARGET_POINTS` punti.
+
+    Argomenti:
+        window: Ampiezza della finestra temporale richiesta.
+
+    Restituisce:
+        str: Codice della risoluzione (es. `1h`); la più fine se nessuna soddisfa il requisito.
+    """
+    for name, width in reversed(RESOLUTIONS):
+        if window / width >= HISTORY_TARGET_POINTS:
+            return name
+    return RESOLUTIONS[0][0]
+
+
+async def refresh_rollups(conn: AsyncConnection) -> int:
+    """
+    Ricalcola i bucket toccati dalle righe registrate dopo l'ultimo aggiornamento (watermark) e sposta il watermark.
+
+    Dai dati grezzi si rileggono solo i minuti recenti, con un margine che recupera le transazioni confermate in
+    ritardo; le risoluzioni più grossolane derivano da quella precedente. Il ricalcolo è idempotente e il costo
+    di un tick non cresce nel corso della giornata.
+
+    Restituisce:
+        int: Numero di bucket inseriti o aggiornati.
+    """
+    async with conn.cursor() as cur:
+        await cur.execute("SELECT refresh_crypto_variation_rollups() AS affected;")
+        row = await cur.fetchone()
+    return int(row["affected"])
+
+
+async def rebuild_rollups(conn: AsyncConnection) -> int:
+    """Ricostruisce tutte le rollup a partire dai dati grezzi presenti in `crypto_variation`."""
+    async with conn.cursor() as cur:
+        await cur.execute("SELECT rebuild_crypto_variation_rollups() AS affected;")
+        row = await cur.fetchone()
+    return int(row["affected"])
+
+
+async def execute_rollup_history(
+    cur: AsyncCursor,
+    crypto_id: str,
+    window: timedelta,
+    resolution: str,
+) -> None:
+    """
+    Invia la query dello storico di una risoluzione senza leggerne il risultato.
+
+    In pipeline mode la query viaggia insieme alle altre dello stesso batch; il risultato si legge poi con
+    `fetch_rollup_history` sullo stesso cursore.
+
+    Argomenti:
+        cur: Cursore su cui eseguire la query.
+        crypto_id: Identificativo della crypto.
+        window: Ampiezza della finestra temporale.
+        resolution: Codice della risoluzione da leggere.
+    """
+    await cur.execute(
+        """
+        SELECT
+            array_agg((EXTRACT(EPOCH FROM bucket_start) * 1000)::BIGINT ORDER BY bucket_start) AS timestamps,
+            array_agg(close::DOUBLE PRECISION ORDER BY bucket_start) AS prices
+        FROM crypto_variation_rollup
+        WHERE crypto_id = %s
+          AND resolution = %s
+          AND bucket_start >= NOW() - %s
+        """,
+        (crypto_id, resolution, window),
+    )
+
+
+async def fetch_rollup_history(cur: AsyncCursor) -> PriceSeries:
+    """Legge dal cursore il risultato di `execute_rollup_history`."""
+    row = await cur.fetchone()
+    return PriceSeries.from_columns(row["timestamps"], row["prices"])
+
+
+async def load_rollup_history(
+    conn: AsyncConnection,
+    crypto_id: str,
+    window: timedelta,
+    resolution: str,
+) -> PriceSeries:
+    """
+    Restituisce lo storico di chiusura dei bucket di una risoluzione sulla finestra richiesta.
+
+    Argomenti:
+        conn: Connessione su cui eseguire la query.
+        crypto_id: Identificativo della crypto.
+        window: Ampiezza della finestra temporale.
+        resolution: Codice della risoluzione da leggere.
+
+    Restituisce:
+        PriceSeries: Serie colonnare ordinata per inizio bucket crescente, aggregata direttamente in SQL.
+    """
+    async with conn.cursor() as cur:
+        await execute_rollup_history(cur, crypto_id, window, resolution)
+        return await fetch_rollup_history(cur)
@@ -0,0 +1,234 @@
+"""Cache di mercato condivisa tra processi, persistita su Postgres e coordinata tramite lease."""
+
+from __future__ import annotations
+
+import asyncio
+import os
+import socket
+from contextlib import asynccontextmanager
+from dataclasses import dataclass
+from datetime import datetime
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict
+from uuid import uuid4
+
+from psycopg.types.json import Jsonb
+from psycopg_pool import AsyncConnectionPool
+
+from ..config import Settings
+from . import coincap
+from .circuit_breaker import CircuitOpenError
+
+
+@dataclass(frozen=True)
+class SharedEntry:
+    """Valore letto dalla cache condivisa con istante di salvataggio ed età in secondi."""
+
+    payload: Any
+    fetched_at: datetime
+    age_seconds: float
+
+
+class SharedMarketCache:
+    """
+    Cache condivisa fra i worker uvicorn sulla tabella `market_cache`.
+
+    Per ogni chiave un solo processo alla volta detiene il lease e contatta l'upstream; gli altri
+    attendono che il valore venga salvato e lo leggono dal database, ma al più per `max_wait_seconds`.
+    """
+
+    def __init__(
+        self,
+        pool: AsyncConnectionPool,
+        *,
+        lease_seconds: float = 30.0,
+        poll_interval_seconds: float = 0.2,
+        max_wait_seconds: float = 2.0,
+        owner: str | None = None,
+    ) -> None:
+        self._pool = pool
+        self._lease_seconds = lease_seconds
+        self._poll_interval = poll_interval_seconds
+        self._max_wait = max_wait_seconds
+        self.owner = owner or f"{socket.gethostname()}:{os.getpid()}:{uuid4().hex[:8]}"
+        self._shared_hits = 0
+        self._refreshes = 0
+        self._lease_waits = 0
+        self._wait_timeouts = 0
+
+    async def read(self, key: str) -> SharedEntry | None:
+        """Legge il valore salvato per la chiave, se presente."""
+        async with self._pool.connection() as conn:
+            async with conn.cursor() as cur:
+                await cur.execute(
+                    """
+                    SELECT
+                        payload,
+                        fetched_at,
+                        EXTRACT(EPOCH FROM NOW() - fetched_at)::DOUBLE PRECISION AS age_seconds
+                    FROM market_cache
+                    WHERE cache_key = %s AND fetched_at IS NOT NULL
+                    """,
+                    (key,),
+                )
+                row = await cur.fetchone()
+        if row is None:
+            return None
+        return SharedEntry(
+            payload=row["payload"],
+            fetched_at=row["fetched_at"],
+            age_seconds=max(float(row["age_seconds"]), 0.0),
+        )
+
+    async def try_acquire(self, key: str, lease_seconds: float | None = None) -> bool:
+        """
+        Tenta di acquisire (o rinnovare) il lease sulla chiave.
+
+        Argomenti:
+            key: Chiave della cache.
+            lease_seconds: Durata del lease; di default quella configurata.
+
+        Restituisce:
+            bool: True se il lease appartiene ora a questo processo.
+        """
+        duration = lease_seconds if lease_seconds is not None else self._lease_seconds
+        async with self._pool.connection() as conn:
+            async with conn.cursor() as cur:
+                await cur.execute(
+                    """
+                    INSERT INTO market_cache (cache_key, lease_owner, lease_expires_at)
+                    VALUES (%s, %s, NOW() + make_interval(secs => %s))
+                    ON CONFLICT (cache_key) DO UPDATE
+                    SET lease_owner = EXCLUDED.lease_owner,
+                        lease_expires_at = EXCLUDED.lease_expires_at
+                    WHERE market_cache.lease_owner IS NULL
+                       OR market_cache.lease_owner = EXCLUDED.lease_owner
+                       OR market_cache.lease_expires_at < NOW()
+                    RETURNING cache_key
+                    """,
+                    (key, self.owner, duration),
+                )
+                acquired = await cur.fetchone() is not None
+            await conn.commit()
+        return acquired
+
+    async def store(self, key: str, payload: Any, *, release: bool = True) -> None:
+        """Salva il valore per la chiave e, di default, rilascia il lease detenuto da questo processo."""
+        async with self._pool.connection() as conn:
+            async with conn.cursor() as cur:
+                await cur.execute(
+                    """
+                    INSERT INTO market_cache (cache_key, payload, fetched_at)
+                    VALUES (%s, %s, NOW())
+                    ON CONFLICT (cache_key) DO UPDATE
+                    SET payload = EXCLUDED.payload,
+                        fetched_at = EXCLUDED.fetched_at,
+                        lease_owner = CASE WHEN %s THEN NULL ELSE market_cache.lease_owner END,
+                        lease_expires_at = CASE WHEN %s THEN NULL ELSE market_cache.lease_expires_at END
+                    """,
+                    (key, Jsonb(payload), release, release),
+                )
+            await conn.commit()
+
+    async def release(self, key: str) -> None:
+        """Rilascia il lease sulla chiave se appartiene a questo processo."""
+        async with self._pool.connection() as conn:
+            async with conn.cursor() as cur:
+                await cur.execute(
+                    """
+                    UPDATE market_cache
+                    SET lease_owner = NULL, lease_expires_at = NULL
+                    WHERE cache_key = %s AND lease_owner = %s
+                    """,
+                    (key, self.owner),
+                )
+            await conn.commit()
+
+    async def get_or_refresh(self, key: str, ttl_seconds: float, loader: Callable[[], Awaitable[Any]]) -> Any:
+        """
+        Restituisce il valore condiviso se più recente di `ttl_seconds`, altrimenti lo aggiorna sotto lease.
+
+        Se un altro processo detiene il lease si attende che salvi il nuovo valore, ma al più `max_wait_seconds`:
+        un leader bloccato non deve trattenere le richieste per tutta la durata del lease. Scaduta l'attesa si
+        restituisce il valore scaduto, se esiste, altrimenti si fallisce come a circuito aperto. Alla scadenza
+        del lease (es. processo terminato) il primo processo che lo acquisisce effettua l'aggiornamento.
+
+        Argomenti:
+            key: Chiave della cache.
+            ttl_seconds: Età massima accettata per il valore condiviso.
+            loader: Coroutine factory che interroga l'upstream.
+
+        Restituisce:
+            Any: Valore (serializzabile in JSON) letto o appena caricato.
+
+        Solleva:
+            CircuitOpenError: Se l'attesa del leader scade e non esiste alcun valore salvato.
+        """
+        entry = await self.read(key)
+        stale = entry
+        deadline = asyncio.get_running_loop().time() + self._max_wait
+        while entry is None or entry.age_seconds >= ttl_seconds:
+            if await self.try_acquire(key):
+                # Tra la lettura e l'acquisizione un altro processo può aver già salvato il valore.
+                entry = await self.read(key)
+                if entry is not None and entry.age_seconds < ttl_seconds:
+                    await self.release(key)
+                    break
+                try:
+                    payload = await loader()
+                except BaseException:
+                    await self.release(key)
+                    raise
+                await self.store(key, payload)
+                self._refreshes += 1
+                return payload
+            if asyncio.get_running_loop().time() >= deadline:
+                self._wait_timeouts += 1
+                if stale is not None:
+                    return stale.payload
+                raise CircuitOpenError(f"market_cache:{key}", retry_after=self._max_wait)
+            self._lease_waits += 1
+            await asyncio.sleep(self._poll_interval)
+            entry = await self.read(key)
+            stale = entry or stale
+        self._shared_hits += 1
+        return entry.payload
+
+    def stats(self) -> Dict[str, object]:
+        """Metriche della cache condivisa per il monitoraggio."""
+        return {
+            "owner": self.owner,
+            "shared_hits": self._shared_hits,
+            "refreshes": self._refreshes,
+            "lease_waits": self._lease_waits,
+            "wait_timeouts": self._wait_timeouts,
+        }
+
+
+@asynccontextmanager
+async def lifespan_shared_cache(
+    settings: Settings,
+    pool: AsyncConnectionPool,
+) -> AsyncIterator[SharedMarketCache | None]:
+    """
+    Attiva la cache condivisa per il modulo CoinCap durante il `lifespan` di FastAPI.
+
+    Argomenti:
+        settings: Impostazioni applicative con abilitazione e durata del lease.
+        pool: Pool di connessioni su cui leggere e scrivere `market_cache`.
+
+    Restituisce:
+        SharedMarketCache | None: Cache attiva, oppure None se disabilitata da configurazione.
+    """
+    if not settings.market_shared_cache_enabled:
+        yield None
+        return
+    cache = SharedMarketCache(
+        pool,
+        lease_seconds=settings.market_shared_cache_lease_seconds,
+        max_wait_seconds=settings.market_shared_cache_max_wait_seconds,
+    )
+    coincap.configure_shared_cache(cache)
+    try:
+        yield cache
+    finally:
+        coincap.configure_shared_cache(None)
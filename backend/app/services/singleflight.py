@@ -0,0 +1,63 @@
+"""Coalescenza delle richieste concorrenti: per ogni chiave resta in volo una sola chiamata upstream."""
+
+from __future__ import annotations
+
+import asyncio
+from typing import Awaitable, Callable, Dict, Hashable, TypeVar
+
+T = TypeVar("T")
+
+
+class SingleFlight:
+    """
+    Garantisce che per una stessa chiave esegua un solo caricamento alla volta.
+
+    I chiamanti che arrivano mentre il caricamento è in corso attendono lo stesso risultato
+    (o la stessa eccezione) invece di avviare una nuova richiesta.
+    """
+
+    def __init__(self) -> None:
+        self._inflight: Dict[Hashable, asyncio.Task] = {}
+        self.originating = 0
+        self.coalesced = 0
+
+    async def do(self, key: Hashable, loader: Callable[[], Awaitable[T]]) -> T:
+        """
+        Esegue `loader` oppure si aggancia al caricamento già in volo per `key`.
+
+        Argomenti:
+            key: Chiave che identifica la risorsa richiesta.
+            loader: Coroutine factory invocata solo dal chiamante che origina il caricamento.
+
+        Restituisce:
+            T: Risultato condiviso tra tutti i chiamanti concorrenti.
+        """
+        task = self._inflight.get(key)
+        if task is None:
+            self.originating += 1
+            task = asyncio.ensure_future(loader())
+            self._inflight[key] = task
+            task.add_done_callback(lambda done, key=key: self._forget(key, done))
+        else:
+            self.coalesced += 1
+        # shield: la cancellazione di un singolo chiamante non interrompe il caricamento condiviso.
+        return await asyncio.shield(task)
+
+    def in_flight(self, key: Hashable) -> bool:
+        """Indica se per la chiave è in corso un caricamento."""
+        return key in self._inflight
+
+    def stats(self) -> dict[str, int]:
+        """Restituisce i contatori di chiamate originate e coalescenti."""
+        return {
+            "originating": self.originating,
+            "coalesced": self.coalesced,
+            "in_flight": len(self._inflight),
+        }
+
+    def _forget(self, key: Hashable, task: asyncio.Task) -> None:
+        if self._inflight.get(key) is task:
+            del self._inflight[key]
+        if not task.cancelled():
+            # Marca l'eccezione come letta anche se tutti i chiamanti sono stati cancellati.
+            task.exception()
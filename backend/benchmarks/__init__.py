@@ -0,0 +1 @@
+"""Benchmark riproducibili dei percorsi critici del backend."""
@@ -0,0 +1,367 @@
+"""
+Benchmark della contesa sui lock del percorso ordini (`POST /market/orders`).
+
+Guida richieste concorrenti di acquisto/vendita sullo stesso conto contro l'app ASGI in-process e un
+Postgres locale, campionando `pg_stat_activity`/`pg_locks` per stimare l'attesa sui lock e
+`pg_stat_database` per i deadlock. Saldo, posizione e movimenti del conto usato vengono ripristinati a fine
+esecuzione, ma il benchmark va comunque eseguito solo su un database di sviluppo.
+
+Esempio:
+    python -m backend.benchmarks.order_contention --orders 2000 --concurrency 32 --sell-ratio 0.4
+"""
+
+from __future__ import annotations
+
+import argparse
+import asyncio
+import json
+import os
+import sys
+import tempfile
+import time
+from collections import Counter
+from dataclasses import dataclass, field
+from datetime import datetime
+from decimal import Decimal
+from typing import Any, Dict, List, Sequence
+from uuid import uuid4
+
+import numpy as np
+import psycopg
+from httpx import ASGITransport, AsyncClient
+from psycopg.rows import dict_row
+
+from backend.app.config import get_settings
+from backend.app.dependencies import DEFAULT_USER_ID
+
+ORDERS_PATH = "/market/orders"
+
+
+@dataclass(frozen=True)
+class BenchmarkConfig:
+    """Parametri del carico: numero di ordini, richieste in volo, mix acquisti/vendite e ordine tipo."""
+
+    orders: int = 500
+    concurrency: int = 16
+    sell_ratio: float = 0.5
+    asset_symbol: str = "BTC"
+    asset_name: str = "Bitcoin"
+    price_eur: Decimal = Decimal("100.00")
+    quantity: Decimal = Decimal("0.01")
+    idempotent: bool = False
+    sample_interval_seconds: float = 0.01
+    user_id: str = DEFAULT_USER_ID
+
+
+@dataclass
+class LockSamples:
+    """Campioni periodici delle sessioni in attesa di un lock sul database del benchmark."""
+
+    samples: int = 0
+    waiting_total: int = 0
+    waiting_max: int = 0
+    ungranted_max: int = 0
+    longest_wait_seconds: float = 0.0
+    wait_seconds: float = 0.0
+
+    def add(self, waiting: int, ungranted: int, longest_wait: float, interval: float) -> None:
+        """Accumula un campione; il tempo di attesa è stimato come sessioni in attesa × intervallo."""
+        self.samples += 1
+        self.waiting_total += waiting
+        self.waiting_max = max(self.waiting_max, waiting)
+        self.ungranted_max = max(self.ungranted_max, ungranted)
+        self.longest_wait_seconds = max(self.longest_wait_seconds, longest_wait)
+        self.wait_seconds += waiting * interval
+
+
+@dataclass
+class BenchmarkReport:
+    """Risultati aggregati di un'esecuzione del benchmark."""
+
+    config: BenchmarkConfig
+    elapsed_seconds: float
+    latencies_ms: List[float]
+    statuses: Counter
+    locks: LockSamples
+    deadlocks: int
+    pool_max_size: int = field(default_factory=lambda: get_settings().db_pool_max_size)
+
+    @property
+    def throughput(self) -> float:
+        """Ordini completati (qualsiasi esito) al secondo."""
+        return len(self.latencies_ms) / self.elapsed_seconds if self.elapsed_seconds else 0.0
+
+    def percentile(self, q: float) -> float:
+        """Percentile della latenza in millisecondi."""
+        return float(np.percentile(self.latencies_ms, q)) if self.latencies_ms else 0.0
+
+    def as_dict(self) -> Dict[str, Any]:
+        """Rappresentazione serializzabile del report (es. per confrontare esecuzioni in JSON)."""
+        mean_waiting = self.locks.waiting_total / self.locks.samples if self.locks.samples else 0.0
+        return {
+            "orders": self.config.orders,
+            "concurrency": self.config.concurrency,
+            "sell_ratio": self.config.sell_ratio,
+            "idempotent": self.config.idempotent,
+            "pool_max_size": self.pool_max_size,
+            "elapsed_seconds": round(self.elapsed_seconds, 3),
+            "throughput_per_second": round(self.throughput, 1),
+            "latency_p50_ms": round(self.percentile(50), 2),
+            "latency_p99_ms": round(self.percentile(99), 2),
+            "latency_max_ms": round(max(self.latencies_ms, default=0.0), 2),
+            "statuses": {str(code): count for code, count in sorted(self.statuses.items())},
+            "lock_wait_seconds_sampled": round(self.locks.wait_seconds, 3),
+            "lock_waiting_sessions_mean": round(mean_waiting, 2),
+            "lock_waiting_sessions_max": self.locks.waiting_max,
+            "lock_longest_wait_ms": round(self.locks.longest_wait_seconds * 1000, 2),
+            "ungranted_locks_max": self.locks.ungranted_max,
+            "deadlocks": self.deadlocks,
+        }
+
+
+def _connect() -> psycopg.Connection:
+    return psycopg.connect(get_settings().database_conninfo(), autocommit=True, row_factory=dict_row)
+
+
+def _deadlock_count(conn: psycopg.Connection) -> int:
+    row = conn.execute("SELECT deadlocks FROM pg_stat_database WHERE datname = current_database();").fetchone()
+    return int(row["deadlocks"])
+
+
+async def _sample_locks(conninfo: str, interval: float, samples: LockSamples, stop: asyncio.Event) -> None:
+    async with await psycopg.AsyncConnection.connect(conninfo, autocommit=True, row_factory=dict_row) as conn:
+        while not stop.is_set():
+            cur = await conn.execute(
+                """
+                SELECT
+                    (SELECT COUNT(*)
+                     FROM pg_stat_activity
+                     WHERE datname = current_database() AND wait_event_type = 'Lock') AS waiting,
+                    (SELECT COALESCE(MAX(EXTRACT(EPOCH FROM clock_timestamp() - state_change)), 0)
+                     FROM pg_stat_activity
+                     WHERE datname = current_database() AND wait_event_type = 'Lock') AS longest_wait,
+                    (SELECT COUNT(*)
+                     FROM pg_locks
+                     JOIN pg_database ON pg_database.oid = pg_locks.database
+                     WHERE pg_database.datname = current_database() AND NOT pg_locks.granted) AS ungranted
+                """
+            )
+            row = await cur.fetchone()
+            samples.add(int(row["waiting"]), int(row["ungranted"]), float(row["longest_wait"]), interval)
+            try:
+                await asyncio.wait_for(stop.wait(), timeout=interval)
+            except asyncio.TimeoutError:
+                pass
+
+
+def _snapshot_account(conn: psycopg.Connection, config: BenchmarkConfig) -> Dict[str, Any]:
+    # Sola lettura: lo stato salvato è quello che `_restore_account` ripristina a fine esecuzione.
+    account = conn.execute(
+        "SELECT id, balance FROM accounts WHERE user_id = %s AND currency = 'EUR';",
+        (config.user_id,),
+    ).fetchone()
+    if account is None:
+        raise RuntimeError(f"Nessun conto EUR per l'utente {config.user_id}: eseguire prima i seed.")
+    position = conn.execute(
+        "SELECT * FROM user_crypto_positions WHERE user_id = %s AND asset_symbol = %s;",
+        (config.user_id, config.asset_symbol),
+    ).fetchone()
+    return {"account_id": str(account["id"]), "balance": account["balance"], "position": position}
+
+
+def _fund_account(conn: psycopg.Connection, config: BenchmarkConfig, state: Dict[str, Any]) -> None:
+    # Saldo e posizione bastano per tutti gli ordini, così gli esiti misurano la contesa e non i rifiuti.
+    exposure = config.price_eur * config.quantity * config.orders
+    with conn.transaction():
+        conn.execute("UPDATE accounts SET balance = balance + %s WHERE id = %s;", (exposure, state["account_id"]))
+        conn.execute(
+            """
+            INSERT INTO user_crypto_positions (user_id, account_id, asset_symbol, asset_name, amount, price_source)
+            VALUES (%s, %s, %s, %s, %s, 'benchmark')
+            ON CONFLICT (user_id, asset_symbol) DO UPDATE
+            SET amount = user_crypto_positions.amount + EXCLUDED.amount
+            """,
+            (
+                config.user_id,
+                state["account_id"],
+                config.asset_symbol,
+                config.asset_name,
+                config.quantity * config.orders,
+            ),
+        )
+
+
+def _restore_account(
+    conn: psycopg.Connection,
+    config: BenchmarkConfig,
+    state: Dict[str, Any],
+    started_at: datetime,
+) -> None:
+    with conn.transaction():
+        conn.execute("UPDATE accounts SET balance = %s WHERE id = %s;", (state["balance"], state["account_id"]))
+        conn.execute(
+            "DELETE FROM user_crypto_positions WHERE user_id = %s AND asset_symbol = %s;",
+            (config.user_id, config.asset_symbol),
+        )
+        position = state["position"]
+        if position is not None:
+            columns = list(position.keys())
+            placeholders = ", ".join(["%s"] * len(columns))
+            conn.execute(
+                f"INSERT INTO user_crypto_positions ({', '.join(columns)}) VALUES ({placeholders});",
+                [position[column] for column in columns],
+            )
+        conn.execute(
+            "DELETE FROM transactions WHERE user_id = %s AND category = %s AND created_at >= %s;",
+            (config.user_id, config.asset_symbol, started_at),
+        )
+        conn.execute(
+            "DELETE FROM crypto_order_results WHERE user_id = %s AND created_at >= %s;",
+            (config.user_id, started_at),
+        )
+
+
+def _order_payloads(config: BenchmarkConfig, account_id: str) -> List[Dict[str, Any]]:
+    rng = np.random.default_rng(seed=42)
+    sells = rng.random(config.orders) < config.sell_ratio
+    return [
+        {
+            "account_id": account_id,
+            "asset_symbol": config.asset_symbol,
+            "asset_name": config.asset_name,
+            "price_eur": str(config.price_eur),
+            "quantity": str(config.quantity),
+            "side": "sell" if sell else "buy",
+            **({"idem_key": f"bench-{uuid4()}"} if config.idempotent else {}),
+        }
+        for sell in sells.tolist()
+    ]
+
+
+async def _drive(
+    client: AsyncClient,
+    payloads: Sequence[Dict[str, Any]],
+    config: BenchmarkConfig,
+    headers: Dict[str, str],
+) -> tuple[List[float], Counter]:
+    latencies: List[float] = []
+    statuses: Counter = Counter()
+    queue = iter(payloads)
+
+    async def worker() -> None:
+        for payload in queue:
+            started = time.perf_counter()
+            response = await client.post(ORDERS_PATH, json=payload, headers=headers)
+            latencies.append((time.perf_counter() - started) * 1000)
+            statuses[response.status_code] += 1
+
+    await asyncio.gather(*(worker() for _ in range(config.concurrency)))
+    return latencies, statuses
+
+
+async def run_benchmark(config: BenchmarkConfig, headers: Dict[str, str] | None = None) -> BenchmarkReport:
+    """
+    Esegue il benchmark contro l'app creata con le impostazioni correnti.
+
+    Argomenti:
+        config: Parametri del carico.
+        headers: Header da inviare con ogni ordine (es. `Authorization` se l'OIDC è attivo).
+
+    Restituisce:
+        BenchmarkReport: Throughput, latenze, esiti HTTP, attese sui lock e deadlock osservati.
+    """
+    from backend.app.main import create_app
+
+    conninfo = get_settings().database_conninfo()
+    with _connect() as admin:
+        state = _snapshot_account(admin, config)
+        deadlocks_before = _deadlock_count(admin)
+        started_at = admin.execute("SELECT NOW() AS now;").fetchone()["now"]
+        try:
+            # Dentro il try: anche un errore a metà preparazione lascia il conto com'era.
+            _fund_account(admin, config, state)
+            payloads = _order_payloads(config, state["account_id"])
+            app = create_app()
+            samples = LockSamples()
+            stop = asyncio.Event()
+            async with app.router.lifespan_context(app):
+                transport = ASGITransport(app=app)
+                async with AsyncClient(transport=transport, base_url="http://benchmark") as client:
+                    sampler = asyncio.create_task(
+                        _sample_locks(conninfo, config.sample_interval_seconds, samples, stop)
+                    )
+                    began = time.perf_counter()
+                    try:
+                        latencies, statuses = await _drive(client, payloads, config, headers or {})
+                    finally:
+                        elapsed = time.perf_counter() - began
+                        stop.set()
+                        await sampler
+            deadlocks = _deadlock_count(admin) - deadlocks_before
+        finally:
+            _restore_account(admin, config, state, started_at)
+    return BenchmarkReport(
+        config=config,
+        elapsed_seconds=elapsed,
+        latencies_ms=latencies,
+        statuses=statuses,
+        locks=samples,
+        deadlocks=deadlocks,
+    )
+
+
+def _configure_environment(pool_size: int | None) -> str:
+    # Utente di sviluppo senza OIDC, nessun worker di ingestion, prezzo fisso senza quotazione e tassi FX locali:
+    # si misura solo il percorso ordini.
+    os.environ["OIDC_ENABLED"] = "false"
+    os.environ["MARKET_INGESTION_ENABLED"] = "false"
+    os.environ["QUOTE_REQUIRED"] = "false"
+    rates = tempfile.NamedTemporaryFile("w", suffix=".json", delete=False)
+    with rates:
+        json.dump({"base": "USD", "rates": {"EUR": "1"}}, rates)
+    os.environ["FX_PROVIDER"] = "file"
+    os.environ["FX_RATES_FILE"] = rates.name
+    if pool_size is not None:
+        os.environ["DB_POOL_MAX_SIZE"] = str(pool_size)
+    get_settings.cache_clear()
+    return rates.name
+
+
+def parse_args(argv: list[str] | None = None) -> argparse.Namespace:
+    """Parsa gli argomenti della riga di comando."""
+    parser = argparse.ArgumentParser(description="Benchmark della contesa sui lock di POST /market/orders.")
+    parser.add_argument("--orders", type=int, default=BenchmarkConfig.orders, help="Numero totale di ordini.")
+    parser.add_argument("--concurrency", type=int, default=BenchmarkConfig.concurrency, help="Richieste in volo.")
+    parser.add_argument("--sell-ratio", type=float, default=BenchmarkConfig.sell_ratio, help="Quota di vendite (0-1).")
+    parser.add_argument("--symbol", default=BenchmarkConfig.asset_symbol, help="Ticker dell'asset scambiato.")
+    parser.add_argument("--pool-size", type=int, default=None, help="Dimensione massima del pool (DB_POOL_MAX_SIZE).")
+    parser.add_argument("--idempotent", action="store_true", help="Invia ogni ordine con una chiave di idempotenza.")
+    parser.add_argument("--json", action="store_true", help="Stampa il report in JSON.")
+    return parser.parse_args(argv)
+
+
+def main(argv: list[str] | None = None) -> int:
+    """Entry point del comando `python -m backend.benchmarks.order_contention`."""
+    args = parse_args(argv)
+    rates_file = _configure_environment(args.pool_size)
+    config = BenchmarkConfig(
+        orders=args.orders,
+        concurrency=args.concurrency,
+        sell_ratio=args.sell_ratio,
+        asset_symbol=args.symbol.upper(),
+        idempotent=args.idempotent,
+    )
+    try:
+        report = asyncio.run(run_benchmark(config)).as_dict()
+    finally:
+        os.unlink(rates_file)
+    if args.json:
+        print(json.dumps(report, indent=2))
+    else:
+        for key, value in report.items():
+            print(f"{key:28} {value}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
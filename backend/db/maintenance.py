@@ -0,0 +1,35 @@
+"""Manutenzione periodica del database (partizioni di `crypto_variation`)."""
+
+from __future__ import annotations
+
+import os
+import sys
+
+from backend.db.migrations.run_all import get_connection, load_environment
+
+
+def main() -> int:
+    """
+    Pre-crea le partizioni future di `crypto_variation` ed elimina quelle oltre l'orizzonte di retention.
+
+    Restituisce:
+        int: Codice 0 se la manutenzione termina correttamente.
+    """
+    load_environment()
+    months_ahead = int(os.getenv("MARKET_PARTITION_MONTHS_AHEAD", "3"))
+    retention_months = int(os.getenv("MARKET_HISTORY_RETENTION_MONTHS", "12"))
+    with get_connection() as conn:
+        with conn.cursor() as cur:
+            cur.execute(
+                "SELECT action, partition_name FROM maintain_crypto_variation_partitions(%s, %s);",
+                (months_ahead, retention_months),
+            )
+            rows = cur.fetchall()
+        conn.commit()
+    for action, partition_name in rows:
+        print(f"[{action.upper():7}] {partition_name}", flush=True)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -5,6 +5,7 @@ from __future__ import annotations
 import argparse
 import sys
 
+from backend.db.maintenance import main as run_maintenance
 from backend.db.migrations.run_all import main as run_migrations
 from backend.db.seeds.run_all import main as run_seeds
 
@@ -14,7 +15,7 @@ def parse_args(argv: list[str] | None = None) -> argparse.Namespace:
     parser = argparse.ArgumentParser(description="Gestione database (migrazioni e seed).")
     parser.add_argument(
         "command",
-        choices=["migrate", "seed", "bootstrap"],
+        choices=["migrate", "seed", "bootstrap", "maintain"],
         help="Operazione da eseguire.",
     )
     return parser.parse_args(argv)
@@ -28,6 +29,8 @@ def main(argv: list[str] | None = None) -> int:
         return run_migrations()
     if args.command == "seed":
         return run_seeds()
+    if args.command == "maintain":
+        return run_maintenance()
     if args.command == "bootstrap":
         result = run_migrations()
         if result != 0:
@@ -27,6 +27,19 @@ MIGRATION_FILES: List[Path] = [
     MIGRATIONS_DIR / "security_logs_migration_21102025.sql",
     MIGRATIONS_DIR / "security_logs_rls_migration_25102025.sql",
     MIGRATIONS_DIR / "crypto_market_migration_11112025.sql",
+    MIGRATIONS_DIR / "crypto_change_notify_migration_17102026.sql",
+    MIGRATIONS_DIR / "crypto_variation_rollups_migration_17102026.sql",
+    MIGRATIONS_DIR / "crypto_variation_partitioning_migration_17102026.sql",
+    MIGRATIONS_DIR / "crypto_variation_eur_migration_17102026.sql",
+    MIGRATIONS_DIR / "market_shared_cache_migration_17102026.sql",
+    MIGRATIONS_DIR / "crypto_positions_revaluation_migration_17102026.sql",
+    MIGRATIONS_DIR / "transactions_quantity_migration_17102026.sql",
+    MIGRATIONS_DIR / "crypto_orders_function_migration_17102026.sql",
+    MIGRATIONS_DIR / "crypto_order_results_migration_17102026.sql",
+    MIGRATIONS_DIR / "crypto_order_results_rls_migration_17102026.sql",
+    MIGRATIONS_DIR / "crypto_order_batch_migration_17102026.sql",
+    MIGRATIONS_DIR / "crypto_order_queue_migration_17102026.sql",
+    MIGRATIONS_DIR / "crypto_order_queue_rls_migration_17102026.sql",
     MIGRATIONS_DIR / "withdrawal_methods_migration_15112025.sql",
     MIGRATIONS_DIR / "withdrawals_migration_15112025.sql",
     MIGRATIONS_DIR / "user_mfa_sessions_migration_18112025.sql",
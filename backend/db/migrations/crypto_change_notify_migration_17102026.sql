@@ -0,0 +1,21 @@
+-- Notifica le modifiche al catalogo `crypto` ai processi applicativi, che ricaricano il registro in memoria.
+CREATE OR REPLACE FUNCTION notify_crypto_changed()
+RETURNS TRIGGER AS $$
+BEGIN
+    PERFORM pg_notify('crypto_changed', TG_OP);
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DO $$
+BEGIN
+    IF NOT EXISTS (
+        SELECT 1 FROM pg_trigger WHERE tgname = 'trg_crypto_notify_changed'
+    ) THEN
+        CREATE TRIGGER trg_crypto_notify_changed
+        AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON crypto
+        FOR EACH STATEMENT
+        EXECUTE FUNCTION notify_crypto_changed();
+    END IF;
+END;
+$$;
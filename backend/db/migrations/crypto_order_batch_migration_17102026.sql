@@ -0,0 +1,159 @@
+-- Gambe di un ordine multiplo aggregate per asset: variazione netta di quantità, controvalori e ultimo prezzo.
+CREATE OR REPLACE FUNCTION crypto_order_batch_assets(p_orders JSONB)
+RETURNS TABLE (
+    asset_symbol TEXT,
+    asset_name TEXT,
+    delta NUMERIC,
+    bought NUMERIC,
+    sold NUMERIC,
+    last_price NUMERIC
+) AS $$
+    SELECT
+        leg.asset_symbol,
+        (array_agg(leg.asset_name ORDER BY leg.n DESC))[1],
+        SUM(CASE WHEN leg.side = 'buy' THEN leg.quantity ELSE -leg.quantity END),
+        COALESCE(SUM(ROUND(leg.quantity * leg.price_eur, 2)) FILTER (WHERE leg.side = 'buy'), 0),
+        COALESCE(SUM(ROUND(leg.quantity * leg.price_eur, 2)) FILTER (WHERE leg.side = 'sell'), 0),
+        (array_agg(leg.price_eur ORDER BY leg.n DESC))[1]
+    FROM ROWS FROM (
+        jsonb_to_recordset(p_orders) AS (asset_symbol TEXT, asset_name TEXT, side TEXT, quantity NUMERIC, price_eur NUMERIC)
+    ) WITH ORDINALITY AS leg (asset_symbol, asset_name, side, quantity, price_eur, n)
+    GROUP BY leg.asset_symbol;
+$$ LANGUAGE sql IMMUTABLE;
+
+-- Esegue più ordini sullo stesso conto in un'unica transazione: un solo lock del conto, una verifica
+-- dell'esposizione netta in EUR e statement set-based su posizioni, saldo e movimenti.
+-- Le vendite finanziano gli acquisti dello stesso batch; gli esiti sono quelli di `execute_crypto_order`.
+-- Acquisti e vendite dello stesso asset nello stesso batch sono rifiutati (`conflicting_legs`): compensandosi
+-- nella variazione netta eluderebbero la verifica della posizione detenuta.
+CREATE OR REPLACE FUNCTION execute_crypto_order_batch(
+    p_user_id UUID,
+    p_account_id UUID,
+    p_orders JSONB
+)
+RETURNS TABLE (outcome TEXT, account_row JSONB, position_rows JSONB) AS $$
+DECLARE
+    v_account accounts%ROWTYPE;
+    v_net_cash NUMERIC(18, 2);
+    v_symbols TEXT[];
+BEGIN
+    SELECT * INTO v_account
+    FROM accounts
+    WHERE id = p_account_id AND user_id = p_user_id
+    FOR UPDATE;
+    IF NOT FOUND THEN
+        RETURN QUERY SELECT 'account_not_found', NULL::JSONB, NULL::JSONB;
+        RETURN;
+    END IF;
+    IF v_account.currency <> 'EUR' THEN
+        RETURN QUERY SELECT 'unsupported_currency', NULL::JSONB, NULL::JSONB;
+        RETURN;
+    END IF;
+    IF EXISTS (
+        SELECT 1
+        FROM jsonb_to_recordset(p_orders) AS leg (asset_symbol TEXT, side TEXT)
+        GROUP BY leg.asset_symbol
+        HAVING COUNT(DISTINCT leg.side) > 1
+    ) THEN
+        RETURN QUERY SELECT 'conflicting_legs', NULL::JSONB, NULL::JSONB;
+        RETURN;
+    END IF;
+
+    SELECT SUM(a.sold - a.bought), array_agg(a.asset_symbol ORDER BY a.asset_symbol)
+    INTO v_net_cash, v_symbols
+    FROM crypto_order_batch_assets(p_orders) AS a;
+    IF v_account.balance + v_net_cash < 0 THEN
+        RETURN QUERY SELECT 'insufficient_balance', NULL::JSONB, NULL::JSONB;
+        RETURN;
+    END IF;
+
+    -- Lock delle posizioni coinvolte in ordine di ticker, dopo quello del conto come negli ordini singoli.
+    PERFORM 1
+    FROM user_crypto_positions p
+    WHERE p.user_id = p_user_id AND p.asset_symbol = ANY (v_symbols)
+    ORDER BY p.asset_symbol
+    FOR UPDATE;
+
+    IF EXISTS (
+        SELECT 1
+        FROM crypto_order_batch_assets(p_orders) AS a
+        LEFT JOIN user_crypto_positions p
+            ON p.user_id = p_user_id AND p.asset_symbol = a.asset_symbol
+        WHERE a.delta < 0 AND COALESCE(p.amount, 0) < -a.delta
+    ) THEN
+        RETURN QUERY SELECT 'insufficient_position', NULL::JSONB, NULL::JSONB;
+        RETURN;
+    END IF;
+
+    UPDATE user_crypto_positions p
+    SET amount = p.amount + a.delta,
+        last_valuation_eur = (p.amount + a.delta) * a.last_price,
+        book_cost_eur = GREATEST(COALESCE(p.book_cost_eur, 0) + a.bought - a.sold, 0),
+        asset_name = a.asset_name,
+        updated_at = NOW()
+    FROM crypto_order_batch_assets(p_orders) AS a
+    WHERE p.user_id = p_user_id AND p.asset_symbol = a.asset_symbol;
+
+    INSERT INTO user_crypto_positions (
+        user_id,
+        account_id,
+        asset_symbol,
+        asset_name,
+        amount,
+        book_cost_eur,
+        last_valuation_eur,
+        price_source
+    )
+    SELECT
+        p_user_id,
+        p_account_id,
+        a.asset_symbol,
+        a.asset_name,
+        a.delta,
+        GREATEST(a.bought - a.sold, 0),
+        a.delta * a.last_price,
+        'frontend-simulated'
+    FROM crypto_order_batch_assets(p_orders) AS a
+    WHERE a.delta > 0
+      AND NOT EXISTS (
+          SELECT 1
+          FROM user_crypto_positions p
+          WHERE p.user_id = p_user_id AND p.asset_symbol = a.asset_symbol
+      );
+
+    DELETE FROM user_crypto_positions p
+    WHERE p.user_id = p_user_id AND p.asset_symbol = ANY (v_symbols) AND p.amount <= 0;
+
+    UPDATE accounts
+    SET balance = balance + v_net_cash
+    WHERE id = v_account.id
+    RETURNING * INTO v_account;
+
+    INSERT INTO transactions (
+        id, user_id, account_id, amount, currency, category, idem_key, direction, quantity
+    )
+    SELECT
+        gen_random_uuid(),
+        p_user_id,
+        p_account_id,
+        ROUND(leg.quantity * leg.price_eur, 2),
+        'EUR',
+        leg.asset_symbol,
+        'market:' || gen_random_uuid(),
+        leg.side,
+        leg.quantity
+    FROM jsonb_to_recordset(p_orders) AS leg (asset_symbol TEXT, side TEXT, quantity NUMERIC, price_eur NUMERIC);
+
+    RETURN QUERY SELECT
+        'ok',
+        to_jsonb(v_account),
+        COALESCE(
+            (
+                SELECT jsonb_agg(to_jsonb(p) ORDER BY p.asset_symbol)
+                FROM user_crypto_positions p
+                WHERE p.user_id = p_user_id AND p.asset_symbol = ANY (v_symbols)
+            ),
+            '[]'::JSONB
+        );
+END;
+$$ LANGUAGE plpgsql;
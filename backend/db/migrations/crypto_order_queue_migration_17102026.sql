@@ -0,0 +1,62 @@
+-- Coda durevole degli ordini di mercato accettati in modalità asincrona (`Prefer: respond-async`).
+-- L'endpoint inserisce e risponde 202; i worker reclamano gli ordini `pending` con `FOR UPDATE SKIP LOCKED`
+-- e li eseguono con `execute_crypto_order`, registrando esito, conto e posizione risultanti.
+CREATE TABLE IF NOT EXISTS crypto_order_queue (
+    id UUID PRIMARY KEY DEFAULT gen_random_uuid(),
+    user_id UUID NOT NULL,
+    account_id UUID NOT NULL,
+    asset_symbol VARCHAR(12) NOT NULL,
+    asset_name VARCHAR(80) NOT NULL,
+    side VARCHAR(4) NOT NULL CHECK (side IN ('buy', 'sell')),
+    quantity NUMERIC NOT NULL CHECK (quantity > 0),
+    price_eur NUMERIC NOT NULL CHECK (price_eur > 0),
+    client_key TEXT,
+    status VARCHAR(8) NOT NULL DEFAULT 'pending' CHECK (status IN ('pending', 'filled', 'rejected', 'failed')),
+    outcome TEXT,
+    account_row JSONB,
+    position_row JSONB,
+    created_at TIMESTAMPTZ NOT NULL DEFAULT NOW(),
+    processed_at TIMESTAMPTZ,
+    CONSTRAINT fk_crypto_order_queue_user
+        FOREIGN KEY (user_id)
+        REFERENCES users (id)
+        ON UPDATE CASCADE
+        ON DELETE CASCADE
+);
+
+-- Indice parziale per il claim: resta piccolo perché contiene solo gli ordini ancora da eseguire.
+CREATE INDEX IF NOT EXISTS idx_crypto_order_queue_pending
+    ON crypto_order_queue (created_at, id)
+    WHERE status = 'pending';
+
+-- Una chiave di idempotenza accoda al più un ordine per utente.
+CREATE UNIQUE INDEX IF NOT EXISTS uq_crypto_order_queue_client_key
+    ON crypto_order_queue (user_id, client_key)
+    WHERE client_key IS NOT NULL;
+
+-- Notifiche ai processi applicativi: `crypto_order_queued` sveglia i worker, `crypto_order_completed`
+-- sblocca le richieste di stato in attesa dell'esito. Sono consegnate al commit della transazione.
+CREATE OR REPLACE FUNCTION notify_crypto_order_queue()
+RETURNS TRIGGER AS $$
+BEGIN
+    IF TG_OP = 'INSERT' THEN
+        PERFORM pg_notify('crypto_order_queued', NEW.id::TEXT);
+    ELSIF NEW.status <> 'pending' AND OLD.status = 'pending' THEN
+        PERFORM pg_notify('crypto_order_completed', NEW.id::TEXT);
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DO $$
+BEGIN
+    IF NOT EXISTS (
+        SELECT 1 FROM pg_trigger WHERE tgname = 'trg_crypto_order_queue_notify'
+    ) THEN
+        CREATE TRIGGER trg_crypto_order_queue_notify
+        AFTER INSERT OR UPDATE OF status ON crypto_order_queue
+        FOR EACH ROW
+        EXECUTE FUNCTION notify_crypto_order_queue();
+    END IF;
+END;
+$$;
@@ -0,0 +1,90 @@
+-- Esiti degli ordini di mercato inviati con chiave di idempotenza: un retry del client riceve la risposta
+-- originale invece di eseguire di nuovo l'ordine.
+CREATE TABLE IF NOT EXISTS crypto_order_results (
+    user_id UUID NOT NULL,
+    idem_key TEXT NOT NULL,
+    account_id UUID NOT NULL,
+    side VARCHAR(4) NOT NULL,
+    asset_symbol VARCHAR(12) NOT NULL,
+    quantity NUMERIC NOT NULL,
+    price_eur NUMERIC NOT NULL,
+    account_row JSONB NOT NULL,
+    position_row JSONB,
+    created_at TIMESTAMPTZ NOT NULL DEFAULT NOW(),
+    PRIMARY KEY (user_id, idem_key),
+    CONSTRAINT fk_crypto_order_results_user
+        FOREIGN KEY (user_id)
+        REFERENCES users (id)
+        ON UPDATE CASCADE
+        ON DELETE CASCADE
+);
+
+-- Il conto fa parte dei parametri dell'ordine: una chiave riusata su un altro conto è un conflitto, non un replay.
+ALTER TABLE crypto_order_results ADD COLUMN IF NOT EXISTS account_id UUID;
+UPDATE crypto_order_results SET account_id = (account_row ->> 'id')::uuid WHERE account_id IS NULL;
+ALTER TABLE crypto_order_results ALTER COLUMN account_id SET NOT NULL;
+
+-- Variante idempotente di `execute_crypto_order`: il controllo della chiave avviene dopo il lock del conto,
+-- così un retry concorrente attende l'ordine originale e ne legge l'esito già registrato.
+CREATE OR REPLACE FUNCTION execute_idempotent_crypto_order(
+    p_user_id UUID,
+    p_account_id UUID,
+    p_symbol TEXT,
+    p_asset_name TEXT,
+    p_side TEXT,
+    p_quantity NUMERIC,
+    p_price NUMERIC,
+    p_client_key TEXT
+)
+RETURNS TABLE (outcome TEXT, account_row JSONB, position_row JSONB) AS $$
+DECLARE
+    v_stored crypto_order_results%ROWTYPE;
+    v_result RECORD;
+BEGIN
+    PERFORM 1
+    FROM accounts
+    WHERE id = p_account_id AND user_id = p_user_id
+    FOR UPDATE;
+
+    SELECT * INTO v_stored
+    FROM crypto_order_results
+    WHERE user_id = p_user_id AND idem_key = p_client_key;
+    IF FOUND THEN
+        IF (v_stored.account_id, v_stored.side, v_stored.asset_symbol, v_stored.quantity, v_stored.price_eur)
+            IS DISTINCT FROM (p_account_id, p_side, p_symbol, p_quantity, p_price) THEN
+            RETURN QUERY SELECT 'idempotency_conflict', NULL::JSONB, NULL::JSONB;
+        ELSE
+            RETURN QUERY SELECT 'replayed', v_stored.account_row, v_stored.position_row;
+        END IF;
+        RETURN;
+    END IF;
+
+    SELECT * INTO v_result
+    FROM execute_crypto_order(
+        p_user_id,
+        p_account_id,
+        p_symbol,
+        p_asset_name,
+        p_side,
+        p_quantity,
+        p_price,
+        'market:' || p_user_id || ':' || p_client_key
+    ) AS executed;
+    IF v_result.outcome = 'ok' THEN
+        INSERT INTO crypto_order_results (
+            user_id, idem_key, account_id, side, asset_symbol, quantity, price_eur, account_row, position_row
+        ) VALUES (
+            p_user_id,
+            p_client_key,
+            p_account_id,
+            p_side,
+            p_symbol,
+            p_quantity,
+            p_price,
+            v_result.account_row,
+            v_result.position_row
+        );
+    END IF;
+    RETURN QUERY SELECT v_result.outcome, v_result.account_row, v_result.position_row;
+END;
+$$ LANGUAGE plpgsql;
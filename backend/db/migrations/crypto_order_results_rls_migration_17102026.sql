@@ -0,0 +1,11 @@
+ALTER TABLE crypto_order_results
+    ENABLE ROW LEVEL SECURITY;
+
+CREATE POLICY crypto_order_results_isolation_policy
+    ON crypto_order_results
+    USING (
+        user_id = NULLIF(current_setting('app.current_user_id', true), '')::uuid
+    )
+    WITH CHECK (
+        user_id = NULLIF(current_setting('app.current_user_id', true), '')::uuid
+    );
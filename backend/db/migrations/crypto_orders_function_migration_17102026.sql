@@ -0,0 +1,106 @@
+-- Esegue un ordine di mercato in un'unica chiamata: controlli, saldo, posizione e movimento.
+-- I lock sono presi sempre nello stesso ordine (conto, poi posizione) e restano aperti solo per la durata
+-- della funzione e del commit, invece che per i round trip dell'applicazione.
+-- L'esito è restituito come codice, così il chiamante lo traduce nell'errore HTTP senza transazioni abortite.
+CREATE OR REPLACE FUNCTION execute_crypto_order(
+    p_user_id UUID,
+    p_account_id UUID,
+    p_symbol TEXT,
+    p_asset_name TEXT,
+    p_side TEXT,
+    p_quantity NUMERIC,
+    p_price NUMERIC,
+    p_idem_key TEXT
+)
+RETURNS TABLE (outcome TEXT, account_row JSONB, position_row JSONB) AS $$
+DECLARE
+    v_account accounts%ROWTYPE;
+    v_position user_crypto_positions%ROWTYPE;
+    v_total NUMERIC(18, 2) := ROUND(p_quantity * p_price, 2);
+BEGIN
+    SELECT * INTO v_account
+    FROM accounts
+    WHERE id = p_account_id AND user_id = p_user_id
+    FOR UPDATE;
+    IF NOT FOUND THEN
+        RETURN QUERY SELECT 'account_not_found', NULL::JSONB, NULL::JSONB;
+        RETURN;
+    END IF;
+    IF v_account.currency <> 'EUR' THEN
+        RETURN QUERY SELECT 'unsupported_currency', NULL::JSONB, NULL::JSONB;
+        RETURN;
+    END IF;
+
+    IF p_side = 'buy' THEN
+        IF v_account.balance < v_total THEN
+            RETURN QUERY SELECT 'insufficient_balance', NULL::JSONB, NULL::JSONB;
+            RETURN;
+        END IF;
+        UPDATE accounts
+        SET balance = balance - v_total
+        WHERE id = v_account.id
+        RETURNING * INTO v_account;
+
+        INSERT INTO user_crypto_positions AS existing (
+            user_id,
+            account_id,
+            asset_symbol,
+            asset_name,
+            amount,
+            book_cost_eur,
+            last_valuation_eur,
+            price_source
+        ) VALUES (
+            p_user_id,
+            p_account_id,
+            p_symbol,
+            p_asset_name,
+            p_quantity,
+            v_total,
+            p_quantity * p_price,
+            'frontend-simulated'
+        )
+        ON CONFLICT (user_id, asset_symbol) DO UPDATE
+        SET amount = existing.amount + EXCLUDED.amount,
+            last_valuation_eur = (existing.amount + EXCLUDED.amount) * p_price,
+            book_cost_eur = COALESCE(existing.book_cost_eur, 0) + EXCLUDED.book_cost_eur,
+            asset_name = EXCLUDED.asset_name,
+            updated_at = NOW()
+        RETURNING * INTO v_position;
+    ELSE
+        UPDATE user_crypto_positions
+        SET amount = amount - p_quantity,
+            last_valuation_eur = (amount - p_quantity) * p_price,
+            book_cost_eur = GREATEST(COALESCE(book_cost_eur, 0) - v_total, 0),
+            updated_at = NOW()
+        WHERE user_id = p_user_id
+          AND asset_symbol = p_symbol
+          AND amount >= p_quantity
+        RETURNING * INTO v_position;
+        IF NOT FOUND THEN
+            RETURN QUERY SELECT 'insufficient_position', NULL::JSONB, NULL::JSONB;
+            RETURN;
+        END IF;
+        IF v_position.amount <= 0 THEN
+            DELETE FROM user_crypto_positions WHERE id = v_position.id;
+            v_position := NULL;
+        END IF;
+
+        UPDATE accounts
+        SET balance = balance + v_total
+        WHERE id = v_account.id
+        RETURNING * INTO v_account;
+    END IF;
+
+    INSERT INTO transactions (
+        id, user_id, account_id, amount, currency, category, idem_key, direction, quantity
+    ) VALUES (
+        gen_random_uuid(), p_user_id, p_account_id, v_total, 'EUR', p_symbol, p_idem_key, p_side, p_quantity
+    );
+
+    RETURN QUERY SELECT
+        'ok',
+        to_jsonb(v_account),
+        CASE WHEN v_position.id IS NULL THEN NULL ELSE to_jsonb(v_position) END;
+END;
+$$ LANGUAGE plpgsql;
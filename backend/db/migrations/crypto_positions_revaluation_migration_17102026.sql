@@ -0,0 +1,3 @@
+-- La rivalutazione a ogni tick di prezzo seleziona le posizioni per ticker, non per utente.
+CREATE INDEX IF NOT EXISTS idx_user_crypto_positions_asset_symbol
+    ON user_crypto_positions (asset_symbol);
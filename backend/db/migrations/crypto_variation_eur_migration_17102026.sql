@@ -0,0 +1,25 @@
+-- Conversione una tantum in EUR dei prezzi registrati prima che l'ingestion convertisse le quotazioni CoinCap.
+-- La colonna `currency` distingue le righe già convertite: la sua assenza indica dati interamente in USD.
+-- Lo storico dei tassi non è disponibile, quindi si usa il tasso di riserva predefinito (FX_FALLBACK_USD_EUR_RATE).
+DO $$
+BEGIN
+    IF EXISTS (
+        SELECT 1
+        FROM information_schema.columns
+        WHERE table_name = 'crypto_variation' AND column_name = 'currency'
+    ) THEN
+        RETURN;
+    END IF;
+
+    ALTER TABLE crypto_variation ADD COLUMN currency CHAR(3) NOT NULL DEFAULT 'USD';
+    UPDATE crypto_variation
+    SET price = ROUND(price * 0.92, 8),
+        currency = 'EUR';
+    ALTER TABLE crypto_variation ALTER COLUMN currency SET DEFAULT 'EUR';
+    ALTER TABLE crypto_variation
+        ADD CONSTRAINT crypto_variation_currency_chk CHECK (currency = 'EUR');
+
+    -- Le rollup sono derivate dai prezzi grezzi: si ricalcolano sui valori convertiti.
+    PERFORM rebuild_crypto_variation_rollups();
+END;
+$$;
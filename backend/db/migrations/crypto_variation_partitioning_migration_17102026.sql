@@ -0,0 +1,182 @@
+-- Crea la partizione mensile che contiene p_month. Le righe del mese finite nel frattempo nella partizione
+-- DEFAULT vi vengono spostate, altrimenti PostgreSQL rifiuterebbe la nuova partizione.
+CREATE OR REPLACE FUNCTION create_crypto_variation_partition(p_month DATE)
+RETURNS TEXT AS $$
+DECLARE
+    month_start DATE := date_trunc('month', p_month)::date;
+    partition_name TEXT := format('crypto_variation_p%s', to_char(month_start, 'YYYYMM'));
+    range_start TIMESTAMPTZ := month_start::timestamp AT TIME ZONE 'UTC';
+    range_end TIMESTAMPTZ := (month_start + INTERVAL '1 month')::timestamp AT TIME ZONE 'UTC';
+    has_default BOOLEAN := to_regclass('crypto_variation_default') IS NOT NULL;
+BEGIN
+    IF to_regclass(partition_name) IS NOT NULL THEN
+        RETURN partition_name;
+    END IF;
+
+    IF has_default THEN
+        CREATE TEMP TABLE crypto_variation_moving ON COMMIT DROP AS
+        SELECT id, crypto_id, price, created_at
+        FROM crypto_variation_default
+        WHERE created_at >= range_start AND created_at < range_end;
+        DELETE FROM crypto_variation_default
+        WHERE created_at >= range_start AND created_at < range_end;
+    END IF;
+
+    EXECUTE format(
+        'CREATE TABLE IF NOT EXISTS %I PARTITION OF crypto_variation FOR VALUES FROM (%L) TO (%L)',
+        partition_name,
+        range_start,
+        range_end
+    );
+
+    IF has_default THEN
+        INSERT INTO crypto_variation (id, crypto_id, price, created_at)
+        SELECT id, crypto_id, price, created_at
+        FROM crypto_variation_moving;
+        DROP TABLE crypto_variation_moving;
+    END IF;
+    RETURN partition_name;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Crea le partizioni mensili dal mese corrente fino a p_months_ahead mesi in avanti (più quelle dei mesi
+-- finiti nella partizione DEFAULT, es. dopo un fermo dell'ingestion) e stacca/elimina quelle interamente più
+-- vecchie di p_retention_months mesi.
+-- Applica anche la retention delle rollup: le risoluzioni fini servono solo alle finestre brevi (storico del
+-- market e griglie del portafoglio, al più 30 giorni), i bucket giornalieri seguono la retention dei dati grezzi.
+CREATE OR REPLACE FUNCTION maintain_crypto_variation_partitions(
+    p_months_ahead INTEGER DEFAULT 3,
+    p_retention_months INTEGER DEFAULT 12
+)
+RETURNS TABLE (action TEXT, partition_name TEXT) AS $$
+DECLARE
+    current_month DATE := date_trunc('month', NOW() AT TIME ZONE 'UTC')::date;
+    horizon DATE := (date_trunc('month', NOW() AT TIME ZONE 'UTC') - make_interval(months => p_retention_months))::date;
+    month_offset INTEGER;
+    expired RECORD;
+    pruned RECORD;
+    stray RECORD;
+BEGIN
+    FOR month_offset IN 0..p_months_ahead LOOP
+        action := 'ensured';
+        partition_name := create_crypto_variation_partition(
+            (current_month + make_interval(months => month_offset))::date
+        );
+        RETURN NEXT;
+    END LOOP;
+
+    IF to_regclass('crypto_variation_default') IS NOT NULL THEN
+        DELETE FROM crypto_variation_default
+        WHERE created_at < horizon::timestamp AT TIME ZONE 'UTC';
+        FOR stray IN
+            SELECT DISTINCT date_trunc('month', created_at AT TIME ZONE 'UTC')::date AS month_start
+            FROM crypto_variation_default
+            ORDER BY 1
+        LOOP
+            action := 'ensured';
+            partition_name := create_crypto_variation_partition(stray.month_start);
+            RETURN NEXT;
+        END LOOP;
+    END IF;
+
+    FOR expired IN
+        SELECT child.relname
+        FROM pg_inherits inh
+        JOIN pg_class child ON child.oid = inh.inhrelid
+        JOIN pg_class parent ON parent.oid = inh.inhparent
+        WHERE parent.relname = 'crypto_variation'
+          AND child.relname ~ '^crypto_variation_p[0-9]{6}$'
+          AND to_date(substring(child.relname FROM '[0-9]{6}$'), 'YYYYMM') < horizon
+        ORDER BY child.relname
+    LOOP
+        EXECUTE format('ALTER TABLE crypto_variation DETACH PARTITION %I', expired.relname);
+        EXECUTE format('DROP TABLE %I', expired.relname);
+        action := 'dropped';
+        partition_name := expired.relname;
+        RETURN NEXT;
+    END LOOP;
+
+    FOR pruned IN
+        WITH deleted AS (
+            DELETE FROM crypto_variation_rollup r
+            USING (
+                VALUES
+                    ('1m', NOW() - INTERVAL '7 days'),
+                    ('15m', NOW() - INTERVAL '60 days'),
+                    ('1h', NOW() - INTERVAL '180 days'),
+                    ('1d', horizon::timestamp AT TIME ZONE 'UTC')
+            ) AS retention (resolution, cutoff)
+            WHERE r.resolution = retention.resolution
+              AND r.bucket_start < retention.cutoff
+            RETURNING r.resolution
+        )
+        SELECT deleted.resolution
+        FROM deleted
+        GROUP BY deleted.resolution
+        ORDER BY deleted.resolution
+    LOOP
+        action := 'pruned';
+        partition_name := format('crypto_variation_rollup:%s', pruned.resolution);
+        RETURN NEXT;
+    END LOOP;
+END;
+$$ LANGUAGE plpgsql;
+
+DO $$
+DECLARE
+    month_cursor DATE;
+    last_month DATE := (date_trunc('month', NOW() AT TIME ZONE 'UTC') + INTERVAL '3 months')::date;
+BEGIN
+    IF EXISTS (
+        SELECT 1
+        FROM pg_partitioned_table pt
+        JOIN pg_class c ON c.oid = pt.partrelid
+        WHERE c.relname = 'crypto_variation'
+    ) THEN
+        RETURN;
+    END IF;
+
+    ALTER TABLE crypto_variation RENAME TO crypto_variation_legacy;
+    ALTER TABLE crypto_variation_legacy RENAME CONSTRAINT crypto_variation_pkey TO crypto_variation_legacy_pkey;
+    ALTER INDEX IF EXISTS idx_crypto_variation_crypto_fetched RENAME TO idx_crypto_variation_legacy_crypto_fetched;
+
+    CREATE TABLE crypto_variation (
+        id UUID NOT NULL DEFAULT gen_random_uuid(),
+        crypto_id TEXT NOT NULL REFERENCES crypto(id) ON DELETE CASCADE,
+        price NUMERIC(24, 8) NOT NULL,
+        created_at TIMESTAMPTZ NOT NULL DEFAULT NOW(),
+        PRIMARY KEY (id, created_at)
+    ) PARTITION BY RANGE (created_at);
+
+    CREATE INDEX idx_crypto_variation_crypto_fetched
+        ON crypto_variation (crypto_id, created_at DESC);
+
+    -- Partizioni dal mese più vecchio presente (almeno il mese precedente) fino a tre mesi in avanti.
+    SELECT LEAST(
+        date_trunc('month', MIN(created_at) AT TIME ZONE 'UTC')::date,
+        (date_trunc('month', NOW() AT TIME ZONE 'UTC') - INTERVAL '1 month')::date
+    )
+    INTO month_cursor
+    FROM crypto_variation_legacy;
+
+    WHILE month_cursor <= last_month LOOP
+        PERFORM create_crypto_variation_partition(month_cursor);
+        month_cursor := (month_cursor + INTERVAL '1 month')::date;
+    END LOOP;
+
+    INSERT INTO crypto_variation (id, crypto_id, price, created_at)
+    SELECT id, crypto_id, price, created_at
+    FROM crypto_variation_legacy;
+
+    DROP TABLE crypto_variation_legacy;
+END;
+$$;
+
+-- Raccoglie le righe dei mesi senza partizione (es. ingestion ferma oltre MARKET_PARTITION_MONTHS_AHEAD), così
+-- l'INSERT non fallisce; la manutenzione successiva le sposta nella partizione mensile.
+CREATE TABLE IF NOT EXISTS crypto_variation_default
+    PARTITION OF crypto_variation DEFAULT;
+
+-- Le rollup incrementali leggono le righe successive al watermark in tutte le crypto.
+CREATE INDEX IF NOT EXISTS idx_crypto_variation_created
+    ON crypto_variation (created_at);
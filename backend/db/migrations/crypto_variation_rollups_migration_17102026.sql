@@ -0,0 +1,173 @@
+CREATE TABLE IF NOT EXISTS crypto_variation_rollup (
+    crypto_id TEXT NOT NULL REFERENCES crypto(id) ON DELETE CASCADE,
+    resolution VARCHAR(8) NOT NULL,
+    bucket_start TIMESTAMPTZ NOT NULL,
+    open NUMERIC(24, 8) NOT NULL,
+    high NUMERIC(24, 8) NOT NULL,
+    low NUMERIC(24, 8) NOT NULL,
+    close NUMERIC(24, 8) NOT NULL,
+    samples INTEGER NOT NULL,
+    updated_at TIMESTAMPTZ NOT NULL DEFAULT NOW(),
+    PRIMARY KEY (crypto_id, resolution, bucket_start),
+    CONSTRAINT crypto_variation_rollup_resolution_chk
+        CHECK (resolution IN ('1m', '15m', '1h', '1d'))
+);
+
+-- Istante fino al quale le righe di crypto_variation sono già confluite nelle rollup (riga unica).
+CREATE TABLE IF NOT EXISTS crypto_variation_rollup_watermark (
+    singleton BOOLEAN PRIMARY KEY DEFAULT TRUE CHECK (singleton),
+    refreshed_to TIMESTAMPTZ NOT NULL
+);
+
+-- Ricostruisce tutte le rollup a partire dai dati grezzi e sposta il watermark a NOW().
+CREATE OR REPLACE FUNCTION rebuild_crypto_variation_rollups()
+RETURNS INTEGER AS $$
+DECLARE
+    affected INTEGER;
+BEGIN
+    INSERT INTO crypto_variation_rollup (
+        crypto_id, resolution, bucket_start, open, high, low, close, samples, updated_at
+    )
+    SELECT
+        v.crypto_id,
+        r.resolution,
+        date_bin(r.width, v.created_at, TIMESTAMPTZ '2000-01-01 00:00:00+00') AS bucket_start,
+        (array_agg(v.price ORDER BY v.created_at ASC))[1],
+        MAX(v.price),
+        MIN(v.price),
+        (array_agg(v.price ORDER BY v.created_at DESC))[1],
+        COUNT(*),
+        NOW()
+    FROM (
+        VALUES
+            ('1m', INTERVAL '1 minute'),
+            ('15m', INTERVAL '15 minutes'),
+            ('1h', INTERVAL '1 hour'),
+            ('1d', INTERVAL '1 day')
+    ) AS r (resolution, width)
+    CROSS JOIN crypto_variation v
+    WHERE v.created_at <= NOW()
+    GROUP BY v.crypto_id, r.resolution, 3
+    ON CONFLICT (crypto_id, resolution, bucket_start) DO UPDATE
+    SET
+        open = EXCLUDED.open,
+        high = EXCLUDED.high,
+        low = EXCLUDED.low,
+        close = EXCLUDED.close,
+        samples = EXCLUDED.samples,
+        updated_at = EXCLUDED.updated_at;
+    GET DIAGNOSTICS affected = ROW_COUNT;
+
+    INSERT INTO crypto_variation_rollup_watermark (singleton, refreshed_to)
+    VALUES (TRUE, NOW())
+    ON CONFLICT (singleton) DO UPDATE SET refreshed_to = EXCLUDED.refreshed_to;
+    RETURN affected;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Aggiornamento incrementale e idempotente. I bucket da 1 minuto toccati dalle righe successive al watermark
+-- vengono ricalcolati interamente dai dati grezzi; ogni risoluzione più grossolana è poi ricalcolata dai bucket
+-- della risoluzione precedente (15 bucket da 1m, 4 da 15m, 24 da 1h), senza rileggere il giorno corrente.
+-- `created_at` è l'inizio della transazione che inserisce: una riga può diventare visibile dopo che il
+-- watermark l'ha superata. Per questo si riparte sempre da `refreshed_to - rollup_lag`; ricalcolando i bucket
+-- per intero, la sovrapposizione non conta due volte le righe già aggregate.
+CREATE OR REPLACE FUNCTION refresh_crypto_variation_rollups()
+RETURNS INTEGER AS $$
+DECLARE
+    rollup_lag CONSTANT INTERVAL := INTERVAL '5 minutes';
+    origin CONSTANT TIMESTAMPTZ := TIMESTAMPTZ '2000-01-01 00:00:00+00';
+    v_from TIMESTAMPTZ;
+    v_to TIMESTAMPTZ := NOW();
+    step RECORD;
+    step_rows INTEGER;
+    affected INTEGER := 0;
+BEGIN
+    SELECT refreshed_to - rollup_lag INTO v_from
+    FROM crypto_variation_rollup_watermark
+    FOR UPDATE;
+    IF NOT FOUND THEN
+        RETURN rebuild_crypto_variation_rollups();
+    END IF;
+
+    INSERT INTO crypto_variation_rollup (
+        crypto_id, resolution, bucket_start, open, high, low, close, samples, updated_at
+    )
+    SELECT
+        v.crypto_id,
+        '1m',
+        date_bin(INTERVAL '1 minute', v.created_at, origin),
+        (array_agg(v.price ORDER BY v.created_at ASC))[1],
+        MAX(v.price),
+        MIN(v.price),
+        (array_agg(v.price ORDER BY v.created_at DESC))[1],
+        COUNT(*),
+        NOW()
+    FROM crypto_variation v
+    WHERE v.created_at >= date_bin(INTERVAL '1 minute', v_from, origin)
+      AND v.created_at <= v_to
+    GROUP BY v.crypto_id, 3
+    ON CONFLICT (crypto_id, resolution, bucket_start) DO UPDATE
+    SET
+        open = EXCLUDED.open,
+        high = EXCLUDED.high,
+        low = EXCLUDED.low,
+        close = EXCLUDED.close,
+        samples = EXCLUDED.samples,
+        updated_at = EXCLUDED.updated_at;
+    GET DIAGNOSTICS step_rows = ROW_COUNT;
+    affected := affected + step_rows;
+
+    FOR step IN
+        SELECT *
+        FROM (
+            VALUES
+                ('1m', '15m', INTERVAL '15 minutes', 1),
+                ('15m', '1h', INTERVAL '1 hour', 2),
+                ('1h', '1d', INTERVAL '1 day', 3)
+        ) AS steps (source, target, width, n)
+        ORDER BY n
+    LOOP
+        INSERT INTO crypto_variation_rollup (
+            crypto_id, resolution, bucket_start, open, high, low, close, samples, updated_at
+        )
+        SELECT
+            r.crypto_id,
+            step.target,
+            date_bin(step.width, r.bucket_start, origin),
+            (array_agg(r.open ORDER BY r.bucket_start ASC))[1],
+            MAX(r.high),
+            MIN(r.low),
+            (array_agg(r.close ORDER BY r.bucket_start DESC))[1],
+            SUM(r.samples),
+            NOW()
+        FROM crypto_variation_rollup r
+        WHERE r.resolution = step.source
+          AND r.bucket_start >= date_bin(step.width, v_from, origin)
+          AND r.bucket_start <= v_to
+        GROUP BY r.crypto_id, 3
+        ON CONFLICT (crypto_id, resolution, bucket_start) DO UPDATE
+        SET
+            open = EXCLUDED.open,
+            high = EXCLUDED.high,
+            low = EXCLUDED.low,
+            close = EXCLUDED.close,
+            samples = EXCLUDED.samples,
+            updated_at = EXCLUDED.updated_at;
+        GET DIAGNOSTICS step_rows = ROW_COUNT;
+        affected := affected + step_rows;
+    END LOOP;
+
+    UPDATE crypto_variation_rollup_watermark
+    SET refreshed_to = GREATEST(refreshed_to, v_to);
+    RETURN affected;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Ricostruzione completa solo alla prima applicazione: le esecuzioni successive trovano il watermark.
+DO $$
+BEGIN
+    IF NOT EXISTS (SELECT 1 FROM crypto_variation_rollup_watermark) THEN
+        PERFORM rebuild_crypto_variation_rollups();
+    END IF;
+END;
+$$;
@@ -0,0 +1,9 @@
+-- Cache di mercato condivisa tra i worker uvicorn: un solo worker per chiave aggiorna il valore
+-- (detenendo il lease) mentre gli altri leggono il payload salvato.
+CREATE TABLE IF NOT EXISTS market_cache (
+    cache_key TEXT PRIMARY KEY,
+    payload JSONB,
+    fetched_at TIMESTAMPTZ,
+    lease_owner TEXT,
+    lease_expires_at TIMESTAMPTZ
+);
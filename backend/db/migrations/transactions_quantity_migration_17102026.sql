@@ -0,0 +1,7 @@
+-- Quantità di crypto scambiata dagli ordini di mercato: permette di ricostruire le posizioni nel tempo.
+-- Le righe precedenti restano NULL e vengono stimate dal prezzo registrato all'istante dell'ordine.
+ALTER TABLE transactions
+    ADD COLUMN IF NOT EXISTS quantity NUMERIC(28, 10);
+
+CREATE INDEX IF NOT EXISTS idx_transactions_user_created
+    ON transactions (user_id, created_at DESC);
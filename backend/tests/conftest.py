@@ -84,6 +84,51 @@ def configure_oidc_env(oidc_test_keys: dict[str, Any]) -> Iterator[None]:
     get_settings.cache_clear()
 
 
+@pytest.fixture(scope="session", autouse=True)
+def disable_market_ingestion_loop() -> Iterator[None]:
+    """
+    Disattiva il loop di acquisizione prezzi: i test invocano esplicitamente `run_once`.
+    """
+    os.environ["MARKET_INGESTION_ENABLED"] = "false"
+    get_settings.cache_clear()
+    yield
+    os.environ.pop("MARKET_INGESTION_ENABLED", None)
+    get_settings.cache_clear()
+
+
+@pytest.fixture(scope="session", autouse=True)
+def allow_unquoted_orders() -> Iterator[None]:
+    """
+    Ammette ordini con `price_eur` senza quotazione: i test degli ordini fissano il prezzo direttamente.
+
+    L'obbligo di quotazione (predefinito) è verificato esplicitamente nei test delle quotazioni.
+    """
+    os.environ["QUOTE_REQUIRED"] = "false"
+    get_settings.cache_clear()
+    yield
+    os.environ.pop("QUOTE_REQUIRED", None)
+    get_settings.cache_clear()
+
+
+@pytest.fixture(scope="session", autouse=True)
+def configure_fx_rates_file(tmp_path_factory: pytest.TempPathFactory) -> Iterator[None]:
+    """
+    Sostituisce il provider FX remoto con un file locale a cambio unitario, così i prezzi dei test restano invariati.
+
+    Anche il tasso di riserva è unitario, perché il primo aggiornamento dei tassi avviene in background.
+    """
+    rates_path = tmp_path_factory.mktemp("fx") / "rates.json"
+    rates_path.write_text(json.dumps({"base": "USD", "rates": {"EUR": "1"}}), encoding="utf-8")
+    os.environ["FX_PROVIDER"] = "file"
+    os.environ["FX_RATES_FILE"] = str(rates_path)
+    os.environ["FX_FALLBACK_USD_EUR_RATE"] = "1"
+    get_settings.cache_clear()
+    yield
+    for var in ("FX_PROVIDER", "FX_RATES_FILE", "FX_FALLBACK_USD_EUR_RATE"):
+        os.environ.pop(var, None)
+    get_settings.cache_clear()
+
+
 @pytest.fixture()
 def auth_headers_factory(oidc_test_keys: dict[str, Any]) -> Callable[..., dict[str, str]]:
     """
@@ -0,0 +1,101 @@
+"""Test del sequenziatore in-process delle scritture per conto."""
+
+from __future__ import annotations
+
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+from fastapi import HTTPException
+
+from backend.app.dependencies import AuthenticatedUser, account_write_slot
+from backend.app.services.account_sequencer import AccountQueueFullError, AccountWriteSequencer
+
+
+@pytest.mark.asyncio
+async def test_sequencer_serves_same_account_in_arrival_order():
+    """Le scritture di un conto sono eseguite una alla volta e nell'ordine di arrivo; altri conti non attendono."""
+    sequencer = AccountWriteSequencer(max_pending=8)
+    order: list[int] = []
+    running = 0
+
+    async def write(index: int) -> None:
+        nonlocal running
+        async with sequencer.slot("acc-1"):
+            running += 1
+            assert running == 1
+            await asyncio.sleep(0)
+            order.append(index)
+            running -= 1
+
+    async with sequencer.slot("acc-1"):
+        tasks = [asyncio.create_task(write(index)) for index in range(5)]
+        await asyncio.sleep(0)
+        async with sequencer.slot("acc-2"):
+            assert sequencer.stats()["pending"] == 5
+    await asyncio.gather(*tasks)
+
+    assert order == [0, 1, 2, 3, 4]
+    stats = sequencer.stats()
+    assert stats["active_accounts"] == 0
+    assert stats["acquired"] == 7
+    assert stats["queued"] == 5
+
+
+@pytest.mark.asyncio
+async def test_sequencer_rejects_when_account_queue_is_full():
+    """Oltre `max_pending` richieste in attesa il conto rifiuta subito invece di accodare."""
+    sequencer = AccountWriteSequencer(max_pending=1)
+
+    async with sequencer.slot("acc-1"):
+        waiter = asyncio.create_task(sequencer.acquire("acc-1"))
+        await asyncio.sleep(0)
+        with pytest.raises(AccountQueueFullError):
+            await sequencer.acquire("acc-1")
+    await waiter
+    sequencer.release("acc-1")
+
+    assert sequencer.stats()["rejected"] == 1
+    assert sequencer.stats()["active_accounts"] == 0
+
+
+@pytest.mark.asyncio
+async def test_sequencer_passes_turn_on_when_waiter_is_cancelled():
+    """Una richiesta annullata in attesa, anche dopo aver ricevuto il turno, non blocca le successive."""
+    sequencer = AccountWriteSequencer(max_pending=8)
+
+    await sequencer.acquire("acc-1")
+    queued = asyncio.create_task(sequencer.acquire("acc-1"))
+    handed_over = asyncio.create_task(sequencer.acquire("acc-1"))
+    last = asyncio.create_task(sequencer.acquire("acc-1"))
+    await asyncio.sleep(0)
+
+    queued.cancel()
+    await asyncio.sleep(0)
+    sequencer.release("acc-1")
+    # Il turno è già stato ceduto a `handed_over` ma la richiesta viene annullata prima di riprendere.
+    handed_over.cancel()
+    await asyncio.wait_for(last, timeout=1)
+    sequencer.release("acc-1")
+
+    assert queued.cancelled() and handed_over.cancelled()
+    assert sequencer.stats()["active_accounts"] == 0
+
+
+@pytest.mark.asyncio
+async def test_account_write_slot_is_keyed_by_user_and_account():
+    """Chi invia il conto di un altro utente riempie solo la propria coda, non quella del titolare."""
+    sequencer = AccountWriteSequencer(max_pending=0)
+    request = SimpleNamespace(app=SimpleNamespace(state=SimpleNamespace(account_sequencer=sequencer)))
+    owner = AuthenticatedUser(user_id="owner", subject="owner", scopes=set(), claims={})
+    intruder = AuthenticatedUser(user_id="intruder", subject="intruder", scopes=set(), claims={})
+
+    async with account_write_slot(request, intruder, "acc-1"):
+        with pytest.raises(HTTPException) as exc_info:
+            async with account_write_slot(request, intruder, "acc-1"):
+                pass
+        async with account_write_slot(request, owner, "acc-1"):
+            assert sequencer.stats()["active_accounts"] == 2
+
+    assert exc_info.value.status_code == 429
+    assert sequencer.stats()["active_accounts"] == 0
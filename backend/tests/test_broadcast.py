@@ -0,0 +1,80 @@
+"""Test unitari per il fan-out degli snapshot di prezzo in streaming."""
+
+from __future__ import annotations
+
+import asyncio
+import json
+
+import pytest
+
+from backend.app.routes.market import _price_events
+from backend.app.services.broadcast import PriceBroadcaster
+
+
+class FakeRequest:
+    """Richiesta che risulta disconnessa dopo un numero prefissato di controlli."""
+
+    def __init__(self, checks_before_disconnect: int) -> None:
+        self.remaining = checks_before_disconnect
+
+    async def is_disconnected(self) -> bool:
+        self.remaining -= 1
+        return self.remaining < 0
+
+
+@pytest.mark.asyncio
+async def test_slow_subscriber_receives_only_latest_tick():
+    broadcaster = PriceBroadcaster()
+    subscription = broadcaster.subscribe()
+
+    for price in (1.0, 2.0, 3.0):
+        broadcaster.publish([{"id": "bitcoin", "price": price}])
+
+    tick = await subscription.next(timeout=0.1)
+    assert json.loads(tick.payload) == {"data": [{"id": "bitcoin", "price": 3.0}]}
+    assert tick.sequence == 3
+    assert subscription.coalesced == 2
+    assert await subscription.next(timeout=0.01) is None
+    assert broadcaster.stats()["coalesced"] == 2
+
+
+@pytest.mark.asyncio
+async def test_publish_fans_out_to_every_subscriber_and_primes_new_ones():
+    broadcaster = PriceBroadcaster()
+    first, second = broadcaster.subscribe(), broadcaster.subscribe()
+
+    broadcaster.publish([{"id": "bitcoin", "price": 1.0}])
+    late = broadcaster.subscribe()
+
+    ticks = await asyncio.gather(*(sub.next(timeout=0.1) for sub in (first, second, late)))
+    assert {tick.sequence for tick in ticks} == {1}
+    assert ticks[0].payload is ticks[1].payload
+
+
+def test_subscriber_limit_is_enforced():
+    broadcaster = PriceBroadcaster(max_subscribers=1)
+    subscription = broadcaster.subscribe()
+
+    with pytest.raises(OverflowError):
+        broadcaster.subscribe()
+
+    broadcaster.unsubscribe(subscription)
+    broadcaster.subscribe()
+
+
+@pytest.mark.asyncio
+async def test_price_events_emit_sse_frames_and_release_subscription():
+    broadcaster = PriceBroadcaster()
+    broadcaster.publish([{"id": "bitcoin", "price": 1.5}])
+    subscription = broadcaster.subscribe()
+
+    frames = [
+        frame
+        async for frame in _price_events(FakeRequest(2), broadcaster, subscription, heartbeat_seconds=0.01)
+    ]
+
+    assert frames == [
+        b'event: prices\nid: 1\ndata: {"data":[{"id":"bitcoin","price":1.5}]}\n\n',
+        b": keep-alive\n\n",
+    ]
+    assert broadcaster.stats()["subscribers"] == 0
@@ -0,0 +1,266 @@
+"""Test unitari per il client CoinCap e i suoi meccanismi di cache."""
+
+from __future__ import annotations
+
+import asyncio
+from decimal import Decimal
+
+import httpx
+import pytest
+
+from backend.app.services import coincap, crypto_registry
+from backend.app.services.cache import StaleWhileRevalidateCache
+from backend.app.services.circuit_breaker import CircuitBreaker, CircuitOpenError
+from backend.app.services.crypto_registry import CryptoAsset, CryptoRegistry
+from backend.app.services.singleflight import SingleFlight
+
+
+@pytest.fixture()
+def fresh_coincap_state(monkeypatch):
+    """Azzera cache, coalescenza, circuit breaker e registro crypto del modulo CoinCap per isolare il test."""
+    flights = SingleFlight()
+    monkeypatch.setattr(coincap, "_flights", flights)
+    monkeypatch.setattr(
+        coincap,
+        "_snapshot_cache",
+        StaleWhileRevalidateCache(max_entries=1, ttl_seconds=60, stale_seconds=60, flights=flights),
+    )
+    monkeypatch.setattr(
+        coincap,
+        "_history_cache",
+        StaleWhileRevalidateCache(max_entries=4, ttl_seconds=60, stale_seconds=60, flights=flights),
+    )
+    monkeypatch.setattr(coincap, "_breaker", CircuitBreaker("coincap", is_failure=coincap._is_upstream_failure))
+    monkeypatch.setattr(coincap, "_shared", None)
+    monkeypatch.setattr(
+        crypto_registry,
+        "_registry",
+        CryptoRegistry([CryptoAsset(id="bitcoin", symbol="BTC", name="Bitcoin", rank=1, explorer_url=None)]),
+    )
+
+
+class FakeClock:
+    """Orologio manuale per controllare l'età delle entry in cache."""
+
+    def __init__(self) -> None:
+        self.now = 0.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+@pytest.mark.asyncio
+async def test_concurrent_snapshot_misses_share_one_upstream_call(fresh_coincap_state, monkeypatch):
+    """Con la cache scaduta, N richieste concorrenti devono generare una sola chiamata upstream."""
+    calls: list[str] = []
+
+    async def fake_request(path: str, params: dict | None = None):
+        calls.append(path)
+        await asyncio.sleep(0.01)
+        return {"data": [{"id": "bitcoin", "priceUsd": "30000"}]}
+
+    monkeypatch.setattr(coincap, "_request", fake_request)
+
+    results = await asyncio.gather(*(coincap.fetch_market_snapshot() for _ in range(10)))
+
+    assert calls == ["/assets"]
+    assert all(result is results[0] for result in results)
+    stats = coincap.singleflight_stats()
+    assert stats["originating"] == 1
+    assert stats["coalesced"] == 9
+
+
+@pytest.mark.asyncio
+async def test_singleflight_propagates_errors_to_all_waiters(fresh_coincap_state, monkeypatch):
+    """Un errore upstream deve raggiungere tutti i chiamanti e non restare memorizzato."""
+    calls = 0
+
+    async def failing_request(path: str, params: dict | None = None):
+        nonlocal calls
+        calls += 1
+        await asyncio.sleep(0.01)
+        raise RuntimeError("upstream down")
+
+    monkeypatch.setattr(coincap, "_request", failing_request)
+
+    results = await asyncio.gather(
+        *(coincap.fetch_history("bitcoin", days=7) for _ in range(5)),
+        return_exceptions=True,
+    )
+
+    assert calls == 1
+    assert all(isinstance(result, RuntimeError) for result in results)
+    assert not coincap._flights.in_flight(("history", "bitcoin", 7))
+
+
+@pytest.mark.asyncio
+async def test_stale_entry_is_served_while_refreshing_in_background():
+    """Un valore scaduto ma entro la finestra stale va restituito subito e aggiornato in background."""
+    clock = FakeClock()
+    cache: StaleWhileRevalidateCache[str] = StaleWhileRevalidateCache(
+        max_entries=2, ttl_seconds=10, stale_seconds=100, clock=clock
+    )
+    cache.put("key", "old")
+    clock.now = 50
+    refreshed = asyncio.Event()
+
+    async def loader() -> str:
+        refreshed.set()
+        return "new"
+
+    assert await cache.get_or_load("key", loader) == "old"
+    await asyncio.wait_for(refreshed.wait(), timeout=1)
+    await asyncio.sleep(0)
+    assert await cache.get_or_load("key", loader) == "new"
+    assert cache.stats()["stale_hits"] == 1
+
+
+@pytest.mark.asyncio
+async def test_expired_entry_is_served_when_source_fails():
+    """Oltre la finestra stale il caricamento è bloccante, ma un errore restituisce l'ultimo valore noto."""
+    clock = FakeClock()
+    cache: StaleWhileRevalidateCache[str] = StaleWhileRevalidateCache(
+        max_entries=2, ttl_seconds=10, stale_seconds=10, clock=clock
+    )
+    cache.put("key", "last-known")
+    clock.now = 1000
+
+    async def failing_loader() -> str:
+        raise RuntimeError("upstream down")
+
+    assert await cache.get_or_load("key", failing_loader) == "last-known"
+    assert cache.stats()["stale_on_error"] == 1
+    with pytest.raises(RuntimeError):
+        await cache.get_or_load("missing", failing_loader)
+
+
+def test_cache_evicts_least_recently_used_entry():
+    """Superato il limite, la cache deve espellere l'elemento usato meno di recente."""
+    cache: StaleWhileRevalidateCache[int] = StaleWhileRevalidateCache(max_entries=2, ttl_seconds=10, stale_seconds=10)
+    cache.put("a", 1)
+    cache.put("b", 2)
+    cache.put("a", 1)
+    cache.put("c", 3)
+
+    assert cache.peek("b") is None
+    assert cache.peek("a") == 1
+    assert cache.peek("c") == 3
+    assert cache.stats()["evictions"] == 1
+
+
+@pytest.mark.asyncio
+async def test_breaker_opens_on_failure_rate_and_fails_fast(fresh_coincap_state, monkeypatch):
+    """Superata la soglia di errori, le chiamate devono fallire subito senza contattare CoinCap."""
+    calls = 0
+
+    async def failing_send(path: str, params: dict | None):
+        nonlocal calls
+        calls += 1
+        raise httpx.ConnectTimeout("timeout")
+
+    monkeypatch.setattr(coincap, "_send", failing_send)
+
+    for _ in range(coincap.BREAKER_MINIMUM_CALLS):
+        with pytest.raises(httpx.ConnectTimeout):
+            await coincap.fetch_prices(["bitcoin"])
+
+    with pytest.raises(CircuitOpenError):
+        await coincap.fetch_prices(["bitcoin"])
+    assert calls == coincap.BREAKER_MINIMUM_CALLS
+    assert coincap.breaker_stats()["state"] == "open"
+
+
+@pytest.mark.asyncio
+async def test_breaker_half_open_probe_closes_circuit():
+    """Scaduta l'apertura, una sola chiamata di prova riuscita deve richiudere il circuito."""
+    clock = FakeClock()
+    breaker = CircuitBreaker("test", minimum_calls=2, open_seconds=30, clock=clock)
+
+    async def fail():
+        raise RuntimeError("down")
+
+    async def succeed():
+        return "ok"
+
+    for _ in range(2):
+        with pytest.raises(RuntimeError):
+            await breaker.call(fail)
+    assert breaker.state == "open"
+
+    clock.now = 31
+    assert breaker.state == "half_open"
+    probe_started = asyncio.Event()
+    release_probe = asyncio.Event()
+
+    async def slow_probe():
+        probe_started.set()
+        await release_probe.wait()
+        return "ok"
+
+    probe = asyncio.create_task(breaker.call(slow_probe))
+    await probe_started.wait()
+    with pytest.raises(CircuitOpenError):
+        await breaker.call(succeed)
+    release_probe.set()
+
+    assert await probe == "ok"
+    assert breaker.state == "closed"
+
+
+@pytest.mark.asyncio
+async def test_breaker_ignores_client_errors(fresh_coincap_state, monkeypatch):
+    """I 4xx diversi da 429 non indicano un upstream degradato e non devono aprire il circuito."""
+    request = httpx.Request("GET", "https://coincap.test/assets/unknown")
+
+    async def not_found(path: str, params: dict | None):
+        raise httpx.HTTPStatusError("404", request=request, response=httpx.Response(404, request=request))
+
+    monkeypatch.setattr(coincap, "_send", not_found)
+
+    for _ in range(coincap.BREAKER_MINIMUM_CALLS * 2):
+        with pytest.raises(httpx.HTTPStatusError):
+            await coincap.fetch_prices(["unknown"])
+    assert coincap.breaker_stats()["state"] == "closed"
+
+
+@pytest.mark.asyncio
+async def test_assets_without_usable_price_are_omitted(fresh_coincap_state, monkeypatch):
+    """Un asset senza `priceUsd` (o con prezzo nullo) non deve diventare un prezzo a 0."""
+
+    async def fake_request(path: str, params: dict | None = None):
+        return {
+            "data": [
+                {"id": "bitcoin", "priceUsd": "30000"},
+                {"id": "ethereum"},
+                {"id": "xrp", "priceUsd": None},
+                {"id": "solana", "priceUsd": "0"},
+            ]
+        }
+
+    monkeypatch.setattr(coincap, "_request", fake_request)
+
+    prices = await coincap.fetch_prices(["bitcoin", "ethereum", "xrp", "solana"])
+    snapshot = await coincap.fetch_market_snapshot()
+
+    assert list(prices) == ["bitcoin"]
+    assert snapshot[0]["price"] == 30000.0
+
+
+@pytest.mark.asyncio
+async def test_live_market_uses_one_uncached_call(fresh_coincap_state, monkeypatch):
+    """Snapshot e prezzi del worker di ingestion arrivano dalla stessa risposta, a ogni chiamata."""
+    responses = iter(["30000", "31000"])
+    calls: list[str] = []
+
+    async def fake_request(path: str, params: dict | None = None):
+        calls.append(path)
+        return {"data": [{"id": "bitcoin", "priceUsd": next(responses), "changePercent24Hr": "1.5"}]}
+
+    monkeypatch.setattr(coincap, "_request", fake_request)
+
+    await coincap.fetch_live_market()
+    snapshot, prices = await coincap.fetch_live_market()
+
+    assert calls == ["/assets", "/assets"]
+    assert prices == {"bitcoin": Decimal("31000")}
+    assert (snapshot[0]["price"], snapshot[0]["change24h"]) == (31000.0, 1.5)
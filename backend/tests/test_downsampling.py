@@ -0,0 +1,70 @@
+"""Test unitari per il downsampling LTTB dello storico prezzi."""
+
+from __future__ import annotations
+
+import math
+
+import numpy as np
+import pytest
+
+from backend.app.services import downsampling
+from backend.app.services.price_history import PriceSeries
+
+
+def reference_lttb(points: list[tuple[float, float]], threshold: int) -> list[int]:
+    """Implementazione scalare di riferimento di LTTB."""
+    size = len(points)
+    every = (size - 2) / (threshold - 2)
+    selected = [0]
+    anchor = 0
+    for bucket in range(threshold - 2):
+        avg_start = math.floor((bucket + 1) * every) + 1
+        avg_end = min(math.floor((bucket + 2) * every) + 1, size)
+        next_points = points[avg_start:avg_end]
+        avg_x = sum(p[0] for p in next_points) / len(next_points)
+        avg_y = sum(p[1] for p in next_points) / len(next_points)
+        start = math.floor(bucket * every) + 1
+        end = math.floor((bucket + 1) * every) + 1
+        ax, ay = points[anchor]
+        best, best_area = start, -1.0
+        for index in range(start, end):
+            area = abs((ax - avg_x) * (points[index][1] - ay) - (ax - points[index][0]) * (avg_y - ay))
+            if area > best_area:
+                best, best_area = index, area
+        selected.append(best)
+        anchor = best
+    selected.append(size - 1)
+    return selected
+
+
+def test_lttb_matches_reference_implementation():
+    rng = np.random.default_rng(42)
+    timestamps = np.arange(1_000, dtype=np.int64) * 60_000
+    prices = np.cumsum(rng.normal(size=1_000)) + 100
+    expected = reference_lttb(list(zip(timestamps.tolist(), prices.tolist())), 50)
+
+    assert downsampling.lttb(timestamps, prices, 50).tolist() == expected
+
+
+def test_series_downsample_keeps_endpoints_and_spikes():
+    prices = np.ones(500)
+    prices[250] = 99.0
+    series = PriceSeries(timestamps=np.arange(500, dtype=np.int64) * 1000, prices=prices)
+
+    result = series.downsample(20)
+
+    assert len(result) == 20
+    assert result.timestamps[0] == 0
+    assert result.timestamps[-1] == 499_000
+    assert 250_000 in result.timestamps.tolist()
+
+
+def test_series_downsample_returns_short_series_unchanged():
+    series = PriceSeries.from_points([{"timestamp": index, "price": float(index)} for index in range(5)])
+
+    assert series.downsample(10) is series
+
+
+def test_lttb_rejects_too_few_points():
+    with pytest.raises(ValueError):
+        downsampling.lttb(np.arange(10), np.arange(10), 2)
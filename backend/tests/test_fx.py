@@ -0,0 +1,88 @@
+"""Test per la tabella dei tassi di cambio e i provider FX."""
+
+from __future__ import annotations
+
+import asyncio
+import json
+from decimal import Decimal
+
+import numpy as np
+import pytest
+
+from backend.app.config import get_settings
+from backend.app.services import fx
+from backend.app.services.price_history import PriceSeries
+
+
+@pytest.mark.asyncio
+async def test_file_provider_reads_requested_rates(tmp_path):
+    path = tmp_path / "rates.json"
+    path.write_text(json.dumps({"base": "USD", "rates": {"EUR": "0.9", "GBP": "0.8"}}), encoding="utf-8")
+
+    assert await fx.FileRateProvider(path).fetch_rates("USD", ("EUR",)) == {"EUR": Decimal("0.9")}
+    with pytest.raises(fx.FxRateError):
+        await fx.FileRateProvider(path).fetch_rates("EUR", ("USD",))
+    with pytest.raises(fx.FxRateError):
+        await fx.FileRateProvider(tmp_path / "missing.json").fetch_rates("USD", ("EUR",))
+
+
+def test_rate_table_converts_snapshot_prices_and_series():
+    """Snapshot, prezzi e storico sono convertiti con il tasso in memoria, senza alterare gli originali."""
+    table = fx.RateTable("USD", fallback={"EUR": Decimal("0.5")})
+    snapshot = [{"id": "bitcoin", "price": 100.0, "market_cap": None}]
+    series = PriceSeries.from_columns([1, 2], [10.0, 20.0])
+
+    assert table.convert_snapshot(snapshot) == [{"id": "bitcoin", "price": 50.0, "market_cap": None}]
+    assert snapshot[0]["price"] == 100.0
+    assert table.convert_prices({"bitcoin": Decimal("1.2345678")}) == {"bitcoin": Decimal("0.61728390")}
+    converted = table.convert_series(series)
+    assert converted.prices.tolist() == [5.0, 10.0]
+    assert np.array_equal(converted.timestamps, series.timestamps)
+
+
+@pytest.mark.asyncio
+async def test_refresher_keeps_last_rates_when_provider_fails(tmp_path):
+    path = tmp_path / "rates.json"
+    path.write_text(json.dumps({"base": "USD", "rates": {"EUR": 0.8}}), encoding="utf-8")
+    table = fx.RateTable("USD", fallback={"EUR": Decimal("0.92")})
+    refresher = fx.FxRefresher(table, fx.FileRateProvider(path), interval_seconds=60)
+
+    assert await refresher.refresh()
+    assert (table.rate("EUR"), table.version) == (Decimal("0.8"), 1)
+
+    path.write_text("not json", encoding="utf-8")
+    assert not await refresher.refresh()
+    assert (table.rate("EUR"), table.version) == (Decimal("0.8"), 1)
+    assert table.stats()["failures"] == 1
+
+
+@pytest.mark.asyncio
+async def test_lifespan_starts_on_fallback_without_waiting_for_provider(monkeypatch):
+    """Un provider che non risponde non blocca l'avvio: si parte dal tasso di riserva."""
+    release = asyncio.Event()
+
+    class HangingProvider:
+        name = "hanging"
+
+        async def fetch_rates(self, base, symbols):
+            await release.wait()
+            return {"EUR": Decimal("0.8")}
+
+    monkeypatch.setattr(fx, "build_provider", lambda settings: HangingProvider())
+    monkeypatch.setenv("FX_FALLBACK_USD_EUR_RATE", "0.9")
+    get_settings.cache_clear()
+    try:
+        lifespan = fx.lifespan_fx_rates(get_settings())
+        table = await asyncio.wait_for(lifespan.__aenter__(), timeout=1)
+        try:
+            assert table.rate("EUR") == Decimal("0.9")
+            release.set()
+            for _ in range(100):
+                if table.version:
+                    break
+                await asyncio.sleep(0.01)
+            assert table.rate("EUR") == Decimal("0.8")
+        finally:
+            await lifespan.__aexit__(None, None, None)
+    finally:
+        get_settings.cache_clear()
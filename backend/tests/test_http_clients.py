@@ -0,0 +1,59 @@
+"""Test del registro dei client HTTP condivisi e dell'endpoint operativo che ne espone le statistiche."""
+
+from __future__ import annotations
+
+import httpx
+import pytest
+
+from backend.app.config import get_settings
+from backend.app.dependencies import ADMIN_SCOPE, DEFAULT_USER_ID
+from backend.app.services import http_clients
+
+
+@pytest.mark.asyncio
+async def test_lifespan_reuses_one_client_per_host_and_closes_it(monkeypatch):
+    """Le richieste verso lo stesso host riusano client e transport; allo shutdown il client viene chiuso."""
+    transports: list[httpx.MockTransport] = []
+
+    def fake_transport(**_: object) -> httpx.MockTransport:
+        transport = httpx.MockTransport(lambda request: httpx.Response(200, json={"path": request.url.path}))
+        transports.append(transport)
+        return transport
+
+    monkeypatch.setattr(http_clients.httpx, "AsyncHTTPTransport", fake_transport)
+
+    async with http_clients.lifespan_http_clients(get_settings()) as registry:
+        client = http_clients.get_client(http_clients.COINCAP_CLIENT)
+        assert client is registry.get(http_clients.COINCAP_CLIENT)
+        for path in ("/v2/assets", "/v2/rates"):
+            response = await http_clients.get_client(http_clients.COINCAP_CLIENT).get(f"https://coincap.test{path}")
+            assert response.json() == {"path": path}
+        stats = registry.stats()[http_clients.COINCAP_CLIENT]
+
+    assert len(transports) == 1
+    assert (stats["requests_sent"], stats["responses_received"], stats["in_flight"]) == (2, 2, 0)
+    assert client.is_closed
+    assert http_clients.get_client(http_clients.COINCAP_CLIENT) is None
+
+
+@pytest.mark.asyncio
+async def test_upstream_health_requires_admin_scope(async_client, auth_headers_factory, monkeypatch):
+    """Le statistiche interne dei servizi esterni sono riservate allo scope amministrativo."""
+    monkeypatch.setenv("OIDC_CLIENT_ID", "fintech-backend")
+    get_settings.cache_clear()
+    try:
+        forbidden = await async_client.get(
+            "/health/upstream",
+            headers=auth_headers_factory(user_id=DEFAULT_USER_ID, scopes={"accounts:read", "transactions:write"}),
+        )
+        allowed = await async_client.get(
+            "/health/upstream", headers=auth_headers_factory(user_id=DEFAULT_USER_ID, scopes={ADMIN_SCOPE})
+        )
+    finally:
+        monkeypatch.delenv("OIDC_CLIENT_ID")
+        get_settings.cache_clear()
+
+    assert forbidden.status_code == 403
+    assert allowed.status_code == 200, allowed.text
+    assert http_clients.COINCAP_CLIENT in allowed.json()["http_clients"]
+    assert (await async_client.get("/health")).status_code == 200
@@ -2,11 +2,19 @@
 
 from __future__ import annotations
 
+import asyncio
+import struct
 from datetime import datetime, timedelta, timezone
 from decimal import Decimal
 from uuid import uuid4
 
 import pytest
+from psycopg.types.json import Jsonb
+
+from backend.app.config import Settings, get_settings
+from backend.app.services import coincap, order_idempotency, order_queue, revaluation, rollups
+from backend.app.services.circuit_breaker import CircuitOpenError
+from backend.app.services.price_history import HISTORY_BINARY, HISTORY_COLUMNAR
 
 DEFAULT_USER_ID = "aaaaaaaa-1111-2222-3333-444444444444"
 DEFAULT_ACCOUNT_ID = "bbbbbbbb-1111-2222-3333-555555555555"
@@ -72,19 +80,21 @@ def cleanup_crypto_positions(sync_connection):
 
 @pytest.fixture()
 def cleanup_crypto_variation(sync_connection):
-    """Pulisce la tabella crypto_variation prima e dopo il test."""
+    """Pulisce la tabella crypto_variation (e le relative rollup) prima e dopo il test."""
     with sync_connection.cursor() as cur:
         cur.execute("DELETE FROM crypto_variation;")
+        cur.execute("DELETE FROM crypto_variation_rollup;")
         sync_connection.commit()
     yield
     with sync_connection.cursor() as cur:
         cur.execute("DELETE FROM crypto_variation;")
+        cur.execute("DELETE FROM crypto_variation_rollup;")
         sync_connection.commit()
 
 
 @pytest.mark.asyncio
 async def test_market_prices_returns_snapshot(async_client, sync_connection, cleanup_crypto_variation, monkeypatch):
-    """Verifica che /market/prices restituisca i dati provenienti dal client CoinCap."""
+    """Verifica che /market/prices esponga lo snapshot acquisito dal worker senza chiamate upstream."""
 
     sample_snapshot = [
         {
@@ -98,14 +108,17 @@ async def test_market_prices_returns_snapshot(async_client, sync_connection, cle
         }
     ]
 
-    async def fake_snapshot():
-        return sample_snapshot
-    async def fake_price(symbol: str):
-        assert symbol == "BTC"
-        return Decimal("999.1234")
+    calls = 0
 
-    monkeypatch.setattr("backend.app.routes.market.coincap.fetch_market_snapshot", fake_snapshot)
-    monkeypatch.setattr("backend.app.routes.market.coincap.fetch_price_by_symbol", fake_price)
+    async def fake_live_market():
+        nonlocal calls
+        calls += 1
+        return sample_snapshot, {"bitcoin": Decimal("999.1234")}
+
+    monkeypatch.setattr("backend.app.routes.market.coincap.fetch_live_market", fake_live_market)
+
+    await async_client.app.state.price_ingestor.run_once()
+    assert calls == 1
 
     response = await async_client.get("/market/prices")
 
@@ -113,6 +126,8 @@ async def test_market_prices_returns_snapshot(async_client, sync_connection, cle
     payload = response.json()["data"]
     assert payload[0]["symbol"] == "BTC"
     assert payload[0]["price"] == float(Decimal("999.1234"))
+    assert payload[0]["change24h"] == 1.25
+    assert calls == 1
 
     with sync_connection.cursor() as cur:
         cur.execute("SELECT COUNT(*) FROM crypto_variation WHERE price = %s;", (Decimal("999.1234"),))
@@ -120,7 +135,220 @@ async def test_market_prices_returns_snapshot(async_client, sync_connection, cle
 
 
 @pytest.mark.asyncio
-async def test_market_asset_includes_position_and_transactions(
+async def test_ingestion_converts_coincap_prices_to_eur(async_client, sync_connection, cleanup_crypto_variation, monkeypatch):
+    """I prezzi CoinCap in USD sono registrati e pubblicati in EUR con il tasso corrente."""
+
+    async def fake_live_market():
+        snapshot = [{"id": "bitcoin", "symbol": "BTC", "name": "Bitcoin", "price": 30000.0, "market_cap": 1000.0}]
+        return snapshot, {"bitcoin": Decimal("30000")}
+
+    monkeypatch.setattr("backend.app.routes.market.coincap.fetch_live_market", fake_live_market)
+    async_client.app.state.fx_rates.replace({"EUR": Decimal("0.9")}, source="test-suite")
+
+    await async_client.app.state.price_ingestor.run_once()
+
+    payload = (await async_client.get("/market/prices")).json()["data"]
+    assert (payload[0]["price"], payload[0]["market_cap"]) == (27000.0, 900.0)
+    with sync_connection.cursor() as cur:
+        cur.execute("SELECT price FROM crypto_variation WHERE crypto_id = 'bitcoin';")
+        assert cur.fetchall() == [(Decimal("27000.00000000"),)]
+
+
+@pytest.mark.asyncio
+async def test_market_prices_honours_if_none_match(async_client, cleanup_crypto_variation, monkeypatch):
+    """Finché lo snapshot non cambia, /market/prices risponde 304 all'ETag già noto al client."""
+    price = {"bitcoin": Decimal("100")}
+
+    async def fake_live_market():
+        return [{"id": "bitcoin", "symbol": "BTC", "name": "Bitcoin", "price": float(price["bitcoin"])}], dict(price)
+
+    monkeypatch.setattr("backend.app.routes.market.coincap.fetch_live_market", fake_live_market)
+    ingestor = async_client.app.state.price_ingestor
+    await ingestor.run_once()
+
+    first = await async_client.get("/market/prices")
+    etag = first.headers["etag"]
+    assert first.status_code == 200
+    assert first.json()["data"][0]["price"] == 100.0
+
+    cached = await async_client.get("/market/prices", headers={"If-None-Match": etag})
+    assert cached.status_code == 304
+    assert cached.headers["etag"] == etag
+    assert cached.content == b""
+
+    # Stesso contenuto ripubblicato: l'ETag deriva dai byte e non cambia.
+    await ingestor.run_once()
+    assert (await async_client.get("/market/prices", headers={"If-None-Match": etag})).status_code == 304
+
+    price["bitcoin"] = Decimal("101")
+    await ingestor.run_once()
+    refreshed = await async_client.get("/market/prices", headers={"If-None-Match": etag})
+    assert refreshed.status_code == 200
+    assert refreshed.headers["etag"] != etag
+
+
+@pytest.mark.asyncio
+async def test_ingestion_tick_revalues_positions_of_changed_assets(
+    async_client,
+    sync_connection,
+    cleanup_crypto_positions,
+    cleanup_crypto_variation,
+    monkeypatch,
+):
+    """Ogni tick rivaluta in blocco le posizioni degli asset il cui prezzo è cambiato."""
+    current_price = {"bitcoin": Decimal("40000")}
+
+    async def fake_live_market():
+        return [{"id": "bitcoin", "symbol": "BTC", "name": "Bitcoin", "price": 1.0}], dict(current_price)
+
+    monkeypatch.setattr("backend.app.routes.market.coincap.fetch_live_market", fake_live_market)
+
+    position_id = str(uuid4())
+    with sync_connection.cursor() as cur:
+        insert_user_crypto_position(
+            cur,
+            position_id=position_id,
+            user_id=DEFAULT_USER_ID,
+            account_id=DEFAULT_ACCOUNT_ID,
+            symbol="BTC",
+            asset_name="Bitcoin",
+            amount=Decimal("0.5000000000"),
+            book_cost=Decimal("15000.00"),
+            last_valuation=Decimal("15000.00"),
+            price_source="test-suite",
+        )
+        sync_connection.commit()
+
+    def read_position():
+        with sync_connection.cursor() as cur:
+            cur.execute(
+                "SELECT last_valuation_eur, price_source, synced_at FROM user_crypto_positions WHERE id = %s;",
+                (position_id,),
+            )
+            row = cur.fetchone()
+        sync_connection.commit()
+        return row
+
+    ingestor = async_client.app.state.price_ingestor
+    await ingestor.run_once()
+    valuation, source, synced_at = read_position()
+    assert valuation == Decimal("20000.00")
+    assert source == "coincap-ingestion"
+    assert synced_at is not None
+
+    await ingestor.run_once()
+    assert read_position()[2] == synced_at
+
+    current_price["bitcoin"] = Decimal("41000.50")
+    await ingestor.run_once()
+    valuation, _, resynced_at = read_position()
+    assert valuation == Decimal("20500.25")
+    assert resynced_at > synced_at
+
+
+@pytest.mark.asyncio
+async def test_revaluation_skips_locked_positions_and_catches_up(
+    async_client,
+    sync_connection,
+    cleanup_crypto_positions,
+    cleanup_crypto_variation,
+    monkeypatch,
+):
+    """La rivalutazione procede a blocchi, salta le posizioni bloccate da un ordine e le recupera al tick dopo."""
+
+    async def fake_live_market():
+        prices = {"bitcoin": Decimal("40000"), "ethereum": Decimal("40000"), "solana": Decimal("40000")}
+        return [{"id": "bitcoin", "symbol": "BTC", "name": "Bitcoin", "price": 1.0}], prices
+
+    monkeypatch.setattr("backend.app.routes.market.coincap.fetch_live_market", fake_live_market)
+    monkeypatch.setattr(revaluation, "CHUNK_SIZE", 1)
+
+    position_ids = [str(uuid4()) for _ in range(3)]
+    with sync_connection.cursor() as cur:
+        for position_id, symbol in zip(position_ids, ("BTC", "ETH", "SOL")):
+            insert_user_crypto_position(
+                cur,
+                position_id=position_id,
+                user_id=DEFAULT_USER_ID,
+                account_id=DEFAULT_ACCOUNT_ID,
+                symbol=symbol,
+                asset_name=symbol,
+                amount=Decimal("0.5000000000"),
+                book_cost=Decimal("15000.00"),
+                last_valuation=Decimal("15000.00"),
+                price_source="test-suite",
+            )
+        sync_connection.commit()
+        # Un ordine in corso tiene il lock su una delle posizioni.
+        cur.execute("SELECT id FROM user_crypto_positions WHERE id = %s FOR UPDATE;", (position_ids[1],))
+
+    def read_valuations():
+        with sync_connection.cursor() as cur:
+            cur.execute(
+                "SELECT id::text, last_valuation_eur FROM user_crypto_positions WHERE id = ANY(%s::uuid[]);",
+                (position_ids,),
+            )
+            rows = dict(cur.fetchall())
+        sync_connection.commit()
+        return [rows[position_id] for position_id in position_ids]
+
+    ingestor = async_client.app.state.price_ingestor
+    try:
+        await asyncio.wait_for(ingestor.run_once(), timeout=5)
+    finally:
+        sync_connection.rollback()
+    assert read_valuations() == [Decimal("20000.00"), Decimal("15000.00"), Decimal("20000.00")]
+
+    await ingestor.run_once()
+    assert read_valuations() == [Decimal("20000.00")] * 3
+
+
+@pytest.mark.asyncio
+async def test_ingestion_skips_assets_without_upstream_price(
+    async_client,
+    sync_connection,
+    cleanup_crypto_positions,
+    cleanup_crypto_variation,
+    monkeypatch,
+):
+    """Un asset senza `priceUsd` non viene registrato, pubblicato né usato per rivalutare le posizioni."""
+
+    async def fake_request(path: str, params: dict | None = None):
+        return {"data": [{"id": "bitcoin", "priceUsd": "40000"}, {"id": "ethereum"}]}
+
+    monkeypatch.setattr("backend.app.services.coincap._request", fake_request)
+    ingestor = async_client.app.state.price_ingestor
+    monkeypatch.setattr(ingestor, "_snapshot", [])
+
+    position_id = str(uuid4())
+    with sync_connection.cursor() as cur:
+        insert_user_crypto_position(
+            cur,
+            position_id=position_id,
+            user_id=DEFAULT_USER_ID,
+            account_id=DEFAULT_ACCOUNT_ID,
+            symbol="ETH",
+            asset_name="Ethereum",
+            amount=Decimal("2.0000000000"),
+            book_cost=Decimal("5000.00"),
+            last_valuation=Decimal("5000.00"),
+            price_source="test-suite",
+        )
+        sync_connection.commit()
+
+    snapshot = await ingestor.run_once()
+
+    assert [entry["id"] for entry in snapshot] == ["bitcoin"]
+    with sync_connection.cursor() as cur:
+        cur.execute("SELECT crypto_id FROM crypto_variation;")
+        assert cur.fetchall() == [("bitcoin",)]
+        cur.execute("SELECT last_valuation_eur FROM user_crypto_positions WHERE id = %s;", (position_id,))
+        assert cur.fetchone()[0] == Decimal("5000.00")
+        sync_connection.commit()
+
+
+@pytest.mark.asyncio
+async def test_market_asset_detail_is_market_only_with_separate_holdings(
     async_client,
     sync_connection,
     auth_headers_factory,
@@ -129,7 +357,7 @@ async def test_market_asset_includes_position_and_transactions(
     cleanup_crypto_variation,
     monkeypatch,
 ):
-    """L'endpoint di dettaglio deve combinare prezzi, storico, posizione e transazioni utente."""
+    """Il dettaglio di mercato combina prezzo e storico; posizione e transazioni arrivano da `/holdings`."""
 
     sample_snapshot = [
         {
@@ -143,11 +371,15 @@ async def test_market_asset_includes_position_and_transactions(
         }
     ]
     async def fake_snapshot():
+        # Come il caricamento reale, aggiorna la versione dello snapshot in cache.
+        coincap._snapshot_etag = '"snapshot-1"'
         return sample_snapshot
 
     async def fake_history(asset_id: str, days: int = 7):
         raise AssertionError("CoinCap history should not be called when DB data is available.")
 
+    monkeypatch.setattr(coincap, "_snapshot_etag", None)
+
     monkeypatch.setattr("backend.app.routes.market.coincap.fetch_market_snapshot", fake_snapshot)
     monkeypatch.setattr("backend.app.routes.market.coincap.fetch_history", fake_history)
 
@@ -211,6 +443,8 @@ async def test_market_asset_includes_position_and_transactions(
             ),
         )
         sync_connection.commit()
+    # Il listener NOTIFY ricaricherebbe il registro in modo asincrono: qui lo si allinea esplicitamente.
+    await async_client.app.state.crypto_registry.reload(async_client.app.state.db_pool)
 
     with sync_connection.cursor() as cur:
         cur.execute(
@@ -240,9 +474,352 @@ async def test_market_asset_includes_position_and_transactions(
     assert payload["asset"]["id"] == "bitcoin"
     assert payload["asset"]["explorer_url"] == "https://explorer.test/btc"
     assert payload["history"] == expected_history
-    assert payload["position"]["ticker"] == "BTC"
-    assert payload["position"]["id"] == position_id
-    assert any(tx["id"] == transaction_id for tx in payload["transactions"])
+    assert set(payload) == {"asset", "history"}
+    # Processo appena avviato: l'ETag è calcolato dopo il caricamento e descrive lo snapshot servito.
+    etag = response.headers["etag"]
+
+    holdings = await async_client.get("/market/assets/bitcoin/holdings", headers=headers)
+    assert holdings.status_code == 200, holdings.text
+    assert holdings.json()["position"]["ticker"] == "BTC"
+    assert holdings.json()["position"]["id"] == position_id
+    assert any(tx["id"] == transaction_id for tx in holdings.json()["transactions"])
+
+    class NoConnectionPool:
+        def connection(self):
+            raise AssertionError("A 304 must not take a pooled connection.")
+
+    with monkeypatch.context() as patched:
+        patched.setattr(async_client.app.state, "db_pool", NoConnectionPool())
+        cached = await async_client.get("/market/assets/bitcoin", headers={**headers, "If-None-Match": etag})
+    assert cached.status_code == 304
+
+    # Un nuovo snapshot cambia l'ETag del dettaglio; i movimenti dell'utente compaiono nelle holdings.
+    monkeypatch.setattr(coincap, "_snapshot_etag", '"snapshot-0"')
+    with sync_connection.cursor() as cur:
+        cur.execute(
+            """
+            INSERT INTO transactions (id, user_id, account_id, amount, currency, category, idem_key, direction)
+            VALUES (%s, %s, %s, %s, 'EUR', 'BTC', %s, 'sell')
+            """,
+            (str(uuid4()), DEFAULT_USER_ID, DEFAULT_ACCOUNT_ID, Decimal("10.00"), str(uuid4())),
+        )
+        sync_connection.commit()
+    stale = await async_client.get("/market/assets/bitcoin", headers={**headers, "If-None-Match": '"outdated"'})
+    assert stale.status_code == 200
+    assert stale.headers["etag"] == etag
+    refreshed = await async_client.get("/market/assets/bitcoin/holdings", headers=headers)
+    assert refreshed.status_code == 200
+    assert len(refreshed.json()["transactions"]) == 2
+
+
+@pytest.mark.asyncio
+async def test_market_asset_holdings_do_not_wait_for_locked_position(
+    async_client,
+    sync_connection,
+    auth_headers_factory,
+    cleanup_crypto_positions,
+):
+    """Le holdings leggono la posizione senza lock mentre un ordine la tiene bloccata."""
+    position_id = str(uuid4())
+    with sync_connection.cursor() as cur:
+        insert_user_crypto_position(
+            cur,
+            position_id=position_id,
+            user_id=DEFAULT_USER_ID,
+            account_id=DEFAULT_ACCOUNT_ID,
+            symbol="BTC",
+            asset_name="Bitcoin",
+            amount=Decimal("1.0000000000"),
+            book_cost=Decimal("20000.00"),
+            last_valuation=Decimal("30000.00"),
+            price_source="test-suite",
+        )
+        sync_connection.commit()
+        # Un ordine in corso tiene il lock sulla riga della posizione.
+        cur.execute("SELECT id FROM user_crypto_positions WHERE id = %s FOR UPDATE;", (position_id,))
+
+    try:
+        headers = auth_headers_factory(user_id=DEFAULT_USER_ID, scopes={"accounts:read"})
+        response = await asyncio.wait_for(async_client.get("/market/assets/btc/holdings", headers=headers), timeout=5)
+    finally:
+        sync_connection.rollback()
+
+    assert response.status_code == 200, response.text
+    assert response.json()["position"]["id"] == position_id
+
+
+def test_history_resolution_picks_coarsest_bucket_with_enough_points():
+    """La risoluzione scelta deve essere la più grossolana che garantisce punti sufficienti."""
+    assert rollups.select_resolution(timedelta(days=30)) == "1h"
+    assert rollups.select_resolution(timedelta(days=7)) == "1h"
+    assert rollups.select_resolution(timedelta(days=1)) == "15m"
+    assert rollups.select_resolution(timedelta(minutes=30)) == "1m"
+    assert rollups.select_resolution(timedelta(days=365)) == "1d"
+
+
+@pytest.mark.asyncio
+async def test_market_asset_history_reads_hourly_rollups(
+    async_client,
+    sync_connection,
+    auth_headers_factory,
+    cleanup_crypto_variation,
+    monkeypatch,
+):
+    """Con le rollup disponibili, lo storico a 7 giorni deve leggere i bucket orari invece dei dati grezzi."""
+
+    async def fake_snapshot():
+        return [{"id": "bitcoin", "symbol": "BTC", "name": "Bitcoin", "price": 1.0}]
+
+    monkeypatch.setattr("backend.app.routes.market.coincap.fetch_market_snapshot", fake_snapshot)
+
+    now = datetime.now(timezone.utc).replace(minute=30, second=0, microsecond=0)
+    with sync_connection.cursor() as cur:
+        for price, created_at in (
+            (Decimal("100"), now - timedelta(hours=3, minutes=20)),
+            (Decimal("120"), now - timedelta(hours=3, minutes=10)),
+            (Decimal("130"), now - timedelta(hours=1)),
+        ):
+            cur.execute(
+                "INSERT INTO crypto_variation (crypto_id, price, created_at) VALUES (%s, %s, %s);",
+                ("bitcoin", price, created_at),
+            )
+        cur.execute("SELECT rebuild_crypto_variation_rollups();")
+        cur.execute(
+            """
+            SELECT (EXTRACT(EPOCH FROM bucket_start) * 1000)::BIGINT, close
+            FROM crypto_variation_rollup
+            WHERE crypto_id = %s AND resolution = '1h'
+            ORDER BY bucket_start ASC
+            """,
+            ("bitcoin",),
+        )
+        expected_history = [{"timestamp": int(ts), "price": float(close)} for ts, close in cur.fetchall()]
+        sync_connection.commit()
+
+    headers = auth_headers_factory(user_id=DEFAULT_USER_ID, scopes={"accounts:read"})
+    response = await async_client.get("/market/assets/bitcoin?days=7", headers=headers)
+
+    assert response.status_code == 200, response.text
+    history = response.json()["history"]
+    assert history == expected_history
+    assert [point["price"] for point in history] == [120.0, 130.0]
+
+    columnar = await async_client.get(
+        "/market/assets/bitcoin?days=7",
+        headers={**headers, "Accept": HISTORY_COLUMNAR},
+    )
+    assert columnar.status_code == 200, columnar.text
+    assert columnar.headers["content-type"].startswith(HISTORY_COLUMNAR)
+    assert columnar.json()["history"] == {
+        "timestamps": [point["timestamp"] for point in expected_history],
+        "prices": [120.0, 130.0],
+    }
+
+
+@pytest.mark.asyncio
+async def test_market_asset_history_binary_encoding(
+    async_client,
+    sync_connection,
+    auth_headers_factory,
+    cleanup_crypto_variation,
+):
+    """L'endpoint dedicato allo storico deve restituire il buffer binario int64/float64 negoziato via Accept."""
+    now = datetime.now(timezone.utc).replace(second=0, microsecond=0)
+    with sync_connection.cursor() as cur:
+        for minutes_ago, price in ((30, Decimal("10.5")), (20, Decimal("11.25")), (10, Decimal("12"))):
+            cur.execute(
+                "INSERT INTO crypto_variation (crypto_id, price, created_at) VALUES (%s, %s, %s);",
+                ("bitcoin", price, now - timedelta(minutes=minutes_ago)),
+            )
+        sync_connection.commit()
+
+    headers = auth_headers_factory(user_id=DEFAULT_USER_ID, scopes={"accounts:read"})
+    response = await async_client.get(
+        "/market/assets/bitcoin/history?days=1",
+        headers={**headers, "Accept": HISTORY_BINARY},
+    )
+
+    assert response.status_code == 200, response.text
+    assert response.headers["content-type"] == HISTORY_BINARY
+    (count,) = struct.unpack_from("<Q", response.content)
+    assert count == 3
+    assert len(response.content) == 8 + count * 16
+    prices = struct.unpack_from(f"<{count}d", response.content, 8 + count * 8)
+    assert prices == (10.5, 11.25, 12.0)
+
+    not_acceptable = await async_client.get(
+        "/market/assets/bitcoin/history?days=1",
+        headers={**headers, "Accept": "text/csv"},
+    )
+    assert not_acceptable.status_code == 406
+
+
+@pytest.mark.asyncio
+async def test_market_asset_falls_back_to_last_known_price_when_circuit_open(
+    async_client,
+    sync_connection,
+    auth_headers_factory,
+    cleanup_crypto_variation,
+    monkeypatch,
+):
+    """Con CoinCap irraggiungibile l'asset deve essere servito dall'ultimo prezzo registrato."""
+
+    async def open_circuit(*args, **kwargs):
+        raise CircuitOpenError("coincap", retry_after=30)
+
+    monkeypatch.setattr("backend.app.routes.market.coincap.fetch_market_snapshot", open_circuit)
+    monkeypatch.setattr("backend.app.routes.market.coincap.fetch_history", open_circuit)
+    monkeypatch.setattr(async_client.app.state.price_ingestor, "_snapshot", [])
+
+    with sync_connection.cursor() as cur:
+        cur.execute(
+            "INSERT INTO crypto_variation (crypto_id, price, created_at) VALUES (%s, %s, NOW());",
+            ("bitcoin", Decimal("27123.45")),
+        )
+        sync_connection.commit()
+
+    headers = auth_headers_factory(user_id=DEFAULT_USER_ID, scopes={"accounts:read"})
+    response = await async_client.get("/market/assets/BTC?days=1", headers=headers)
+
+    assert response.status_code == 200, response.text
+    payload = response.json()
+    assert payload["asset"]["id"] == "bitcoin"
+    assert payload["asset"]["price"] == 27123.45
+    assert [point["price"] for point in payload["history"]] == [27123.45]
+
+
+@pytest.mark.asyncio
+async def test_crypto_registry_reloads_on_catalog_change(async_client, sync_connection):
+    """Una modifica alla tabella crypto deve raggiungere il registro in memoria tramite NOTIFY."""
+    registry = async_client.app.state.crypto_registry
+    assert registry.resolve("btc").id == "bitcoin"
+    assert registry.resolve("unknown-coin") is None
+    original_url = registry.get("bitcoin").explorer_url
+
+    try:
+        with sync_connection.cursor() as cur:
+            cur.execute("UPDATE crypto SET explorer_url = %s WHERE id = %s;", ("https://notify.test/btc", "bitcoin"))
+            sync_connection.commit()
+        for _ in range(50):
+            if registry.get("bitcoin").explorer_url == "https://notify.test/btc":
+                break
+            await asyncio.sleep(0.05)
+        assert registry.get("bitcoin").explorer_url == "https://notify.test/btc"
+    finally:
+        with sync_connection.cursor() as cur:
+            cur.execute("UPDATE crypto SET explorer_url = %s WHERE id = %s;", (original_url, "bitcoin"))
+            sync_connection.commit()
+
+
+def test_partition_maintenance_drops_expired_months(sync_connection):
+    """La manutenzione deve pre-creare i mesi futuri ed eliminare le partizioni oltre la retention."""
+    next_month = (datetime.now(timezone.utc).replace(day=1) + timedelta(days=32)).strftime("%Y%m")
+    with sync_connection.cursor() as cur:
+        cur.execute("SELECT create_crypto_variation_partition('2000-01-01');")
+        cur.execute(
+            "INSERT INTO crypto_variation (crypto_id, price, created_at) VALUES (%s, %s, %s);",
+            ("bitcoin", Decimal("1"), datetime(2000, 1, 15, tzinfo=timezone.utc)),
+        )
+        cur.execute("SELECT action, partition_name FROM maintain_crypto_variation_partitions(3, 12);")
+        actions = cur.fetchall()
+        cur.execute("SELECT to_regclass('crypto_variation_p200001') IS NULL;")
+        dropped = cur.fetchone()[0]
+        cur.execute("SELECT COUNT(*) FROM crypto_variation WHERE created_at < '2001-01-01';")
+        remaining = cur.fetchone()[0]
+        sync_connection.commit()
+
+    assert ("dropped", "crypto_variation_p200001") in actions
+    assert ("ensured", f"crypto_variation_p{next_month}") in actions
+    assert dropped is True
+    assert remaining == 0
+
+
+def test_rows_without_partition_land_in_default_and_move_on_maintenance(sync_connection, cleanup_crypto_variation):
+    """Un mese senza partizione non fa fallire l'INSERT; la manutenzione crea la partizione e vi sposta le righe."""
+    try:
+        with sync_connection.cursor() as cur:
+            cur.execute(
+                "INSERT INTO crypto_variation (crypto_id, price, created_at) VALUES (%s, %s, %s);",
+                ("bitcoin", Decimal("1"), datetime(2100, 1, 15, tzinfo=timezone.utc)),
+            )
+            cur.execute("SELECT COUNT(*) FROM crypto_variation_default;")
+            assert cur.fetchone()[0] == 1
+            cur.execute("SELECT action, partition_name FROM maintain_crypto_variation_partitions(3, 12);")
+            actions = cur.fetchall()
+            cur.execute("SELECT COUNT(*) FROM crypto_variation_default;")
+            in_default = cur.fetchone()[0]
+            cur.execute("SELECT COUNT(*) FROM crypto_variation_p210001;")
+            moved = cur.fetchone()[0]
+            sync_connection.commit()
+    finally:
+        with sync_connection.cursor() as cur:
+            cur.execute("DROP TABLE IF EXISTS crypto_variation_p210001;")
+            sync_connection.commit()
+
+    assert ("ensured", "crypto_variation_p210001") in actions
+    assert (in_default, moved) == (0, 1)
+
+
+def test_rollup_refresh_recovers_late_commits_without_double_counting(sync_connection, cleanup_crypto_variation):
+    """Righe confermate dopo il watermark vengono recuperate e ripetere l'aggiornamento non le conta due volte."""
+    rollup_query = """
+        SELECT resolution, bucket_start, open, high, low, close, samples
+        FROM crypto_variation_rollup
+        WHERE crypto_id = %s
+        ORDER BY resolution, bucket_start
+    """
+    with sync_connection.cursor() as cur:
+        cur.execute(
+            "INSERT INTO crypto_variation (crypto_id, price, created_at) VALUES (%s, %s, NOW() - INTERVAL '1 second');",
+            ("bitcoin", Decimal("100")),
+        )
+        cur.execute("SELECT rebuild_crypto_variation_rollups();")
+        sync_connection.commit()
+        for price in (Decimal("150"), Decimal("90")):
+            cur.execute("INSERT INTO crypto_variation (crypto_id, price) VALUES (%s, %s);", ("bitcoin", price))
+            cur.execute("SELECT refresh_crypto_variation_rollups();")
+            sync_connection.commit()
+        # Transazione iniziata prima dell'ultimo aggiornamento e confermata dopo: `created_at` precede il watermark.
+        cur.execute(
+            "INSERT INTO crypto_variation (crypto_id, price, created_at) VALUES (%s, %s, NOW() - INTERVAL '3 seconds');",
+            ("bitcoin", Decimal("80")),
+        )
+        sync_connection.commit()
+        for _ in range(2):
+            cur.execute("SELECT refresh_crypto_variation_rollups();")
+            sync_connection.commit()
+        cur.execute(rollup_query, ("bitcoin",))
+        refreshed = cur.fetchall()
+        cur.execute("SELECT rebuild_crypto_variation_rollups();")
+        cur.execute(rollup_query, ("bitcoin",))
+        rebuilt = cur.fetchall()
+        sync_connection.commit()
+
+    daily = [row[2:] for row in refreshed if row[0] == "1d"]
+    assert daily[-1] == (Decimal("80"), Decimal("150"), Decimal("80"), Decimal("90"), 4)
+    assert refreshed == rebuilt
+
+
+def test_partition_maintenance_prunes_expired_rollups(sync_connection, cleanup_crypto_variation):
+    """Le risoluzioni fini sono conservate solo per le finestre brevi che le usano."""
+    now = datetime.now(timezone.utc)
+    with sync_connection.cursor() as cur:
+        for resolution, bucket_start in (("1m", now - timedelta(days=8)), ("1m", now), ("1d", now - timedelta(days=8))):
+            cur.execute(
+                """
+                INSERT INTO crypto_variation_rollup (crypto_id, resolution, bucket_start, open, high, low, close, samples)
+                VALUES (%s, %s, %s, 1, 1, 1, 1, 1);
+                """,
+                ("bitcoin", resolution, bucket_start),
+            )
+        cur.execute("SELECT action, partition_name FROM maintain_crypto_variation_partitions(3, 12);")
+        actions = cur.fetchall()
+        cur.execute("SELECT resolution, COUNT(*) FROM crypto_variation_rollup GROUP BY resolution ORDER BY resolution;")
+        remaining = cur.fetchall()
+        sync_connection.commit()
+
+    assert ("pruned", "crypto_variation_rollup:1m") in actions
+    assert remaining == [("1d", 1), ("1m", 1)]
 
 
 @pytest.mark.asyncio
@@ -341,3 +918,370 @@ async def test_market_order_sell_reduces_position_and_credits_account(
     expected_credit = Decimal(payload["quantity"]) * Decimal(payload["price_eur"])
     assert updated_balance == Decimal("1000.00") + expected_credit
     assert remaining_positions == 0
+
+
+@pytest.mark.asyncio
+async def test_market_order_accumulates_position_and_rejects_without_changes(
+    async_client,
+    sync_connection,
+    auth_headers_factory,
+    cleanup_transactions,
+    cleanup_crypto_positions,
+):
+    """Un secondo acquisto somma la posizione; un ordine rifiutato non lascia saldo né movimenti modificati."""
+
+    with sync_connection.cursor() as cur:
+        cur.execute("UPDATE accounts SET balance = %s WHERE id = %s;", (Decimal("1500.00"), DEFAULT_ACCOUNT_ID))
+        sync_connection.commit()
+
+    headers = auth_headers_factory(user_id=DEFAULT_USER_ID, scopes={"transactions:write"})
+    payload = {
+        "account_id": DEFAULT_ACCOUNT_ID,
+        "asset_symbol": "btc",
+        "asset_name": "Bitcoin",
+        "price_eur": "10000.00",
+        "quantity": "0.0500",
+        "side": "buy",
+    }
+    for _ in range(2):
+        response = await async_client.post("/market/orders", headers=headers, json=payload)
+        assert response.status_code == 200, response.text
+
+    body = response.json()
+    assert Decimal(body["account"]["balance"]) == Decimal("500.00")
+    assert Decimal(body["position"]["amount"]) == Decimal("0.1")
+    assert Decimal(body["position"]["eur_value"]) == Decimal("1000.00")
+
+    rejected = await async_client.post("/market/orders", headers=headers, json={**payload, "quantity": "1"})
+    oversold = await async_client.post(
+        "/market/orders", headers=headers, json={**payload, "side": "sell", "quantity": "0.2"}
+    )
+
+    assert rejected.status_code == 400
+    assert rejected.json()["detail"] == "Saldo insufficiente per completare l'acquisto."
+    assert oversold.status_code == 400
+    with sync_connection.cursor() as cur:
+        cur.execute("SELECT balance FROM accounts WHERE id = %s;", (DEFAULT_ACCOUNT_ID,))
+        assert cur.fetchone()[0] == Decimal("500.00")
+        cur.execute("SELECT COUNT(*), SUM(quantity) FROM transactions WHERE user_id = %s;", (DEFAULT_USER_ID,))
+        assert cur.fetchone() == (2, Decimal("0.1"))
+
+
+@pytest.mark.asyncio
+async def test_market_order_retry_with_idempotency_key_replays_original(
+    async_client,
+    sync_connection,
+    auth_headers_factory,
+    cleanup_transactions,
+    cleanup_crypto_positions,
+):
+    """Un retry con la stessa chiave restituisce l'esito originale senza eseguire di nuovo l'ordine."""
+
+    with sync_connection.cursor() as cur:
+        cur.execute("DELETE FROM crypto_order_results;")
+        cur.execute("UPDATE accounts SET balance = %s WHERE id = %s;", (Decimal("1000.00"), DEFAULT_ACCOUNT_ID))
+        sync_connection.commit()
+
+    headers = auth_headers_factory(user_id=DEFAULT_USER_ID, scopes={"transactions:write"})
+    payload = {
+        "account_id": DEFAULT_ACCOUNT_ID,
+        "asset_symbol": "BTC",
+        "asset_name": "Bitcoin",
+        "price_eur": "10000.00",
+        "quantity": "0.01",
+        "side": "buy",
+        "idem_key": str(uuid4()),
+    }
+    first = await async_client.post("/market/orders", headers=headers, json=payload)
+    retried = await async_client.post("/market/orders", headers=headers, json=payload)
+    reused = await async_client.post("/market/orders", headers=headers, json={**payload, "quantity": "0.02"})
+    other_account = {**payload, "account_id": str(uuid4())}
+    reused_on_other_account = await async_client.post("/market/orders", headers=headers, json=other_account)
+
+    # La cache in memoria è un'ottimizzazione: senza di essa la chiave si risolve con la lookup indicizzata.
+    order_idempotency._recent_orders.clear()
+    from_database = await async_client.post("/market/orders", headers=headers, json=payload)
+    order_idempotency._recent_orders.clear()
+    other_account_from_database = await async_client.post("/market/orders", headers=headers, json=other_account)
+
+    assert first.status_code == 200, first.text
+    assert "Idempotent-Replayed" not in first.headers
+    for replay in (retried, from_database):
+        assert replay.status_code == 200, replay.text
+        assert replay.headers["Idempotent-Replayed"] == "true"
+        assert replay.json() == first.json()
+    assert reused.status_code == 409
+    assert reused_on_other_account.status_code == 409
+    assert other_account_from_database.status_code == 409
+    with sync_connection.cursor() as cur:
+        cur.execute("SELECT balance FROM accounts WHERE id = %s;", (DEFAULT_ACCOUNT_ID,))
+        assert cur.fetchone()[0] == Decimal("900.00")
+        cur.execute("SELECT COUNT(*) FROM transactions WHERE user_id = %s;", (DEFAULT_USER_ID,))
+        assert cur.fetchone()[0] == 1
+        cur.execute("DELETE FROM crypto_order_results;")
+        sync_connection.commit()
+
+
+@pytest.mark.asyncio
+async def test_market_order_batch_applies_all_legs_in_one_transaction(
+    async_client,
+    sync_connection,
+    auth_headers_factory,
+    cleanup_transactions,
+    cleanup_crypto_positions,
+):
+    """Un ribilanciamento vende e compra in un unico batch; se una gamba non è eseguibile non cambia nulla."""
+
+    with sync_connection.cursor() as cur:
+        cur.execute("UPDATE accounts SET balance = %s WHERE id = %s;", (Decimal("100.00"), DEFAULT_ACCOUNT_ID))
+        insert_user_crypto_position(
+            cur,
+            position_id=str(uuid4()),
+            user_id=DEFAULT_USER_ID,
+            account_id=DEFAULT_ACCOUNT_ID,
+            symbol="BTC",
+            asset_name="Bitcoin",
+            amount=Decimal("0.1"),
+            book_cost=Decimal("1000.00"),
+            last_valuation=Decimal("1000.00"),
+            price_source="test-suite",
+        )
+        sync_connection.commit()
+
+    def leg(symbol: str, name: str, side: str, quantity: str, price: str) -> dict:
+        return {
+            "account_id": DEFAULT_ACCOUNT_ID,
+            "asset_symbol": symbol,
+            "asset_name": name,
+            "price_eur": price,
+            "quantity": quantity,
+            "side": side,
+        }
+
+    headers = auth_headers_factory(user_id=DEFAULT_USER_ID, scopes={"transactions:write"})
+    # L'acquisto di ETH (600) supera il saldo, ma è finanziato dalla vendita di BTC (1000) nello stesso batch.
+    rebalance = [
+        leg("BTC", "Bitcoin", "sell", "0.1", "10000.00"),
+        leg("ETH", "Ethereum", "buy", "0.3", "2000.00"),
+        leg("ETH", "Ethereum", "buy", "0.1", "2100.00"),
+    ]
+    response = await async_client.post("/market/orders/batch", headers=headers, json={"orders": rebalance})
+    overdrawn = await async_client.post(
+        "/market/orders/batch",
+        headers=headers,
+        json={
+            "orders": [
+                leg("ETH", "Ethereum", "sell", "0.1", "2100.00"),
+                leg("BTC", "Bitcoin", "buy", "1", "10000.00"),
+            ]
+        },
+    )
+
+    assert response.status_code == 200, response.text
+    body = response.json()
+    assert Decimal(body["account"]["balance"]) == Decimal("290.00")
+    assert [(p["ticker"], Decimal(p["amount"]), Decimal(p["eur_value"])) for p in body["positions"]] == [
+        ("ETH", Decimal("0.4"), Decimal("840.00"))
+    ]
+    assert overdrawn.status_code == 400
+    with sync_connection.cursor() as cur:
+        cur.execute("SELECT balance FROM accounts WHERE id = %s;", (DEFAULT_ACCOUNT_ID,))
+        assert cur.fetchone()[0] == Decimal("290.00")
+        cur.execute("SELECT direction, category, quantity FROM transactions ORDER BY amount;")
+        assert cur.fetchall() == [
+            ("buy", "ETH", Decimal("0.1000000000")),
+            ("buy", "ETH", Decimal("0.3000000000")),
+            ("sell", "BTC", Decimal("0.1000000000")),
+        ]
+
+
+@pytest.mark.asyncio
+async def test_market_order_batch_rejects_opposite_legs_on_same_asset(
+    async_client,
+    sync_connection,
+    auth_headers_factory,
+    cleanup_transactions,
+    cleanup_crypto_positions,
+):
+    """Acquisto e vendita dello stesso asset non detenuto non devono compensarsi e generare EUR dal nulla."""
+
+    with sync_connection.cursor() as cur:
+        cur.execute("UPDATE accounts SET balance = %s WHERE id = %s;", (Decimal("100.00"), DEFAULT_ACCOUNT_ID))
+        sync_connection.commit()
+
+    legs = [
+        {"asset_symbol": "SOL", "asset_name": "Solana", "side": "buy", "quantity": "10", "price_eur": "1.00"},
+        {"asset_symbol": "SOL", "asset_name": "Solana", "side": "sell", "quantity": "10", "price_eur": "100.00"},
+    ]
+    headers = auth_headers_factory(user_id=DEFAULT_USER_ID, scopes={"transactions:write"})
+    response = await async_client.post(
+        "/market/orders/batch",
+        headers=headers,
+        json={"orders": [{"account_id": DEFAULT_ACCOUNT_ID, **leg} for leg in legs]},
+    )
+
+    assert response.status_code == 400
+    with sync_connection.cursor() as cur:
+        cur.execute(
+            "SELECT outcome FROM execute_crypto_order_batch(%s, %s, %s);",
+            (DEFAULT_USER_ID, DEFAULT_ACCOUNT_ID, Jsonb(legs)),
+        )
+        assert cur.fetchone()[0] == "conflicting_legs"
+        sync_connection.rollback()
+        cur.execute("SELECT balance FROM accounts WHERE id = %s;", (DEFAULT_ACCOUNT_ID,))
+        assert cur.fetchone()[0] == Decimal("100.00")
+        cur.execute("SELECT COUNT(*) FROM transactions;")
+        assert cur.fetchone()[0] == 0
+
+
+@pytest.mark.asyncio
+async def test_market_order_with_quote_executes_at_signed_price(
+    async_client,
+    sync_connection,
+    auth_headers_factory,
+    cleanup_transactions,
+    cleanup_crypto_positions,
+    monkeypatch,
+):
+    """L'ordine con quotazione usa il prezzo firmato dal server; token alterati, prezzi diversi o assenti sono rifiutati."""
+
+    monkeypatch.setattr(
+        async_client.app.state.price_ingestor,
+        "_snapshot",
+        [{"id": "bitcoin", "symbol": "BTC", "name": "Bitcoin", "price": 20000.0}],
+    )
+    with sync_connection.cursor() as cur:
+        cur.execute("UPDATE accounts SET balance = %s WHERE id = %s;", (Decimal("1500.00"), DEFAULT_ACCOUNT_ID))
+        sync_connection.commit()
+
+    headers = auth_headers_factory(user_id=DEFAULT_USER_ID, scopes={"transactions:write"})
+    quote = await async_client.get("/market/quotes/btc", headers=headers)
+    assert quote.status_code == 200, quote.text
+    assert Decimal(quote.json()["price_eur"]) == Decimal("20000")
+    assert (await async_client.get("/market/quotes/xyz", headers=headers)).status_code == 404
+
+    payload = {
+        "account_id": DEFAULT_ACCOUNT_ID,
+        "asset_symbol": "BTC",
+        "asset_name": "Bitcoin",
+        "quantity": "0.0100",
+        "side": "buy",
+    }
+    token = quote.json()["quote_token"]
+    mismatch = await async_client.post(
+        "/market/orders", headers=headers, json={**payload, "quote_token": token, "price_eur": "1.00"}
+    )
+    tampered = await async_client.post("/market/orders", headers=headers, json={**payload, "quote_token": token[:-2]})
+    # Impostazione predefinita: il prezzo indicato dal client non basta senza quotazione.
+    assert Settings.model_fields["quote_required"].default is True
+    monkeypatch.setattr(async_client.app.state.settings, "quote_required", True)
+    unquoted = await async_client.post("/market/orders", headers=headers, json={**payload, "price_eur": "20000"})
+    # Con OIDC configurato i token identificano utenti diversi: la quotazione vale solo per chi l'ha richiesta.
+    monkeypatch.setenv("OIDC_CLIENT_ID", "fintech-backend")
+    get_settings.cache_clear()
+    try:
+        other_headers = auth_headers_factory(user_id=str(uuid4()), scopes={"transactions:write"})
+        foreign = await async_client.post(
+            "/market/orders", headers=other_headers, json={**payload, "quote_token": token}
+        )
+    finally:
+        monkeypatch.delenv("OIDC_CLIENT_ID")
+        get_settings.cache_clear()
+    response = await async_client.post("/market/orders", headers=headers, json={**payload, "quote_token": token})
+
+    assert mismatch.status_code == 400
+    assert tampered.status_code == 400
+    assert unquoted.status_code == 400
+    assert foreign.status_code == 400
+    assert foreign.json()["detail"] == "La quotazione è stata emessa per un altro utente."
+    assert response.status_code == 200, response.text
+    assert Decimal(response.json()["account"]["balance"]) == Decimal("1300.00")
+
+
+@pytest.mark.asyncio
+async def test_async_market_orders_are_queued_and_executed_by_workers(
+    async_client,
+    sync_connection,
+    auth_headers_factory,
+    cleanup_transactions,
+    cleanup_crypto_positions,
+    monkeypatch,
+):
+    """Con `Prefer: respond-async` l'ordine è accodato con 202 e lo stato riporta l'esito dei worker."""
+
+    app = async_client.app
+    queue = order_queue.OrderQueue(
+        app.state.db_pool,
+        conninfo=app.state.settings.database_conninfo(),
+        workers=2,
+        batch_size=5,
+        poll_interval_seconds=0.2,
+    )
+    monkeypatch.setattr(app.state, "order_queue", queue)
+    with sync_connection.cursor() as cur:
+        cur.execute("DELETE FROM crypto_order_queue;")
+        cur.execute("UPDATE accounts SET balance = %s WHERE id = %s;", (Decimal("1000.00"), DEFAULT_ACCOUNT_ID))
+        sync_connection.commit()
+
+    headers = {
+        **auth_headers_factory(user_id=DEFAULT_USER_ID, scopes={"transactions:write", "transactions:read"}),
+        "Prefer": "respond-async",
+    }
+    payload = {
+        "account_id": DEFAULT_ACCOUNT_ID,
+        "asset_symbol": "BTC",
+        "asset_name": "Bitcoin",
+        "price_eur": "10000.00",
+        "quantity": "0.0500",
+        "side": "buy",
+    }
+    accepted = [
+        await async_client.post("/market/orders", headers=headers, json=payload),
+        await async_client.post("/market/orders", headers=headers, json={**payload, "quantity": "1"}),
+    ]
+    assert [response.status_code for response in accepted] == [202, 202]
+    assert accepted[0].json()["status"] == "pending"
+    assert accepted[0].headers["preference-applied"] == "respond-async"
+
+    queue.start()
+    try:
+        filled, rejected = [
+            await async_client.get(f"{response.headers['location']}?wait=5", headers=headers)
+            for response in accepted
+        ]
+    finally:
+        await queue.stop()
+
+    assert filled.status_code == 200, filled.text
+    assert filled.json()["status"] == "filled"
+    # Con OIDC configurato i token identificano utenti diversi: l'ordine di un altro utente non è visibile.
+    monkeypatch.setenv("OIDC_CLIENT_ID", "fintech-backend")
+    get_settings.cache_clear()
+    try:
+        other_headers = auth_headers_factory(user_id=str(uuid4()), scopes={"transactions:read"})
+        foreign = await async_client.get(accepted[0].headers["location"], headers=other_headers)
+        owner = await async_client.get(accepted[0].headers["location"], headers=headers)
+    finally:
+        monkeypatch.delenv("OIDC_CLIENT_ID")
+        get_settings.cache_clear()
+    assert foreign.status_code == 404
+    assert owner.status_code == 200
+    assert Decimal(filled.json()["result"]["account"]["balance"]) == Decimal("500.00")
+    assert rejected.json()["status"] == "rejected"
+    assert rejected.json()["detail"] == "Saldo insufficiente per completare l'acquisto."
+    assert queue.stats()["filled"] == 1 and queue.stats()["rejected"] == 1
+
+    # Con i worker fermi l'ordine resta in coda: la stessa chiave è un replay solo sullo stesso conto.
+    keyed = {**payload, "idem_key": str(uuid4())}
+    queued = await async_client.post("/market/orders", headers=headers, json=keyed)
+    replayed = await async_client.post("/market/orders", headers=headers, json=keyed)
+    other_account = await async_client.post(
+        "/market/orders", headers=headers, json={**keyed, "account_id": str(uuid4())}
+    )
+    assert (queued.status_code, replayed.status_code, other_account.status_code) == (202, 202, 409)
+    assert replayed.headers["idempotent-replayed"] == "true"
+    with sync_connection.cursor() as cur:
+        cur.execute("SELECT balance FROM accounts WHERE id = %s;", (DEFAULT_ACCOUNT_ID,))
+        assert cur.fetchone()[0] == Decimal("500.00")
+        cur.execute("DELETE FROM crypto_order_queue;")
+        sync_connection.commit()
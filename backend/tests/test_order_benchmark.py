@@ -0,0 +1,38 @@
+"""Smoke test del benchmark di contesa sul percorso ordini."""
+
+from __future__ import annotations
+
+import pytest
+
+from backend.app.dependencies import DEFAULT_USER_ID
+from backend.benchmarks.order_contention import BenchmarkConfig, run_benchmark
+
+
+@pytest.mark.asyncio
+async def test_order_benchmark_reports_latency_and_restores_account(
+    sync_connection,
+    auth_headers_factory,
+    cleanup_transactions,
+):
+    """Il benchmark esegue tutti gli ordini, riporta le metriche e lascia conto e posizioni come li ha trovati."""
+    with sync_connection.cursor() as cur:
+        cur.execute("SELECT balance FROM accounts WHERE user_id = %s;", (DEFAULT_USER_ID,))
+        balance_before = cur.fetchone()[0]
+        sync_connection.commit()
+
+    headers = auth_headers_factory(user_id=DEFAULT_USER_ID, scopes={"transactions:write"})
+    report = await run_benchmark(BenchmarkConfig(orders=40, concurrency=8, sell_ratio=0.5), headers=headers)
+
+    summary = report.as_dict()
+    assert summary["statuses"] == {"200": 40}
+    assert summary["throughput_per_second"] > 0
+    assert 0 < summary["latency_p50_ms"] <= summary["latency_p99_ms"]
+    assert summary["deadlocks"] == 0
+    with sync_connection.cursor() as cur:
+        cur.execute("SELECT balance FROM accounts WHERE user_id = %s;", (DEFAULT_USER_ID,))
+        assert cur.fetchone()[0] == balance_before
+        cur.execute("SELECT COUNT(*) FROM user_crypto_positions WHERE user_id = %s;", (DEFAULT_USER_ID,))
+        assert cur.fetchone()[0] == 0
+        cur.execute("SELECT COUNT(*) FROM transactions WHERE user_id = %s;", (DEFAULT_USER_ID,))
+        assert cur.fetchone()[0] == 0
+        sync_connection.commit()
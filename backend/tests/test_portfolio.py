@@ -0,0 +1,144 @@
+"""Test per la serie storica del valore del portafoglio crypto."""
+
+from __future__ import annotations
+
+import asyncio
+from datetime import datetime, timedelta, timezone
+from decimal import Decimal
+from uuid import uuid4
+
+import numpy as np
+import pytest
+
+from backend.app.services import portfolio
+from backend.app.services.cache import StaleWhileRevalidateCache
+
+DEFAULT_USER_ID = "aaaaaaaa-1111-2222-3333-444444444444"
+DEFAULT_ACCOUNT_ID = "bbbbbbbb-1111-2222-3333-555555555555"
+DAY_MS = 24 * 60 * 60 * 1000
+
+
+def test_holdings_are_reconstructed_backwards_from_current_amount():
+    """La quantità a ogni istante è quella attuale meno i movimenti successivi."""
+    ledger = portfolio.AssetLedger.from_columns("bitcoin", [100, 200], [2.0, -0.5], current_amount=2.5)
+    grid = np.array([50, 100, 150, 200, 250], dtype=np.int64)
+
+    assert ledger.holdings(grid).tolist() == [1.0, 3.0, 3.0, 2.5, 2.5]
+
+
+def test_portfolio_values_use_last_known_price_on_grid():
+    """Il valore somma quantità × ultimo prezzo noto di ogni asset, con il primo prezzo prima dei dati."""
+    grid = np.array([0, 10, 20, 30], dtype=np.int64)
+    ledger = portfolio.PortfolioLedger(
+        assets=(
+            portfolio.AssetLedger.from_columns("bitcoin", [15], [1.0], current_amount=1.0),
+            portfolio.AssetLedger.from_columns("ethereum", None, None, current_amount=2.0),
+        )
+    )
+    prices = {
+        "bitcoin": portfolio.prices_on_grid(grid, [5, 25], [100.0, 200.0]),
+        "ethereum": portfolio.prices_on_grid(grid, [0], [10.0]),
+    }
+
+    assert portfolio.portfolio_values(ledger, grid, prices).tolist() == [20.0, 20.0, 120.0, 220.0]
+
+
+def test_grid_rejects_too_many_points():
+    with pytest.raises(ValueError):
+        portfolio.build_grid(timedelta(days=30), timedelta(minutes=1))
+
+
+@pytest.mark.asyncio
+async def test_portfolio_history_endpoint_values_positions_over_time(
+    async_client,
+    sync_connection,
+    auth_headers_factory,
+    cleanup_transactions,
+):
+    """L'endpoint ricostruisce la quantità detenuta dai movimenti e la valorizza sulle chiusure giornaliere."""
+    now = datetime.now(timezone.utc)
+    today = now.replace(hour=0, minute=0, second=0, microsecond=0)
+    with sync_connection.cursor() as cur:
+        cur.execute("DELETE FROM user_crypto_positions;")
+        cur.execute("DELETE FROM crypto_variation;")
+        cur.execute("DELETE FROM crypto_variation_rollup;")
+        cur.execute(
+            "INSERT INTO crypto_variation (crypto_id, price, created_at) VALUES (%s, %s, %s), (%s, %s, %s);",
+            ("bitcoin", Decimal("100"), today - timedelta(days=10), "bitcoin", Decimal("200"), today - timedelta(hours=36)),
+        )
+        cur.execute("SELECT rebuild_crypto_variation_rollups();")
+        cur.execute(
+            """
+            INSERT INTO user_crypto_positions (user_id, account_id, asset_symbol, asset_name, amount)
+            VALUES (%s, %s, 'BTC', 'Bitcoin', %s)
+            """,
+            (DEFAULT_USER_ID, DEFAULT_ACCOUNT_ID, Decimal("1.5")),
+        )
+        cur.execute(
+            """
+            INSERT INTO transactions (
+                id, user_id, account_id, amount, currency, category, idem_key, direction, quantity, created_at
+            ) VALUES (%s, %s, %s, %s, 'EUR', 'BTC', %s, 'buy', %s, %s)
+            """,
+            (
+                str(uuid4()),
+                DEFAULT_USER_ID,
+                DEFAULT_ACCOUNT_ID,
+                Decimal("100.00"),
+                f"market:{uuid4()}",
+                Decimal("0.5"),
+                today - timedelta(hours=12),
+            ),
+        )
+        sync_connection.commit()
+
+    try:
+        headers = auth_headers_factory(user_id=DEFAULT_USER_ID, scopes={"crypto:read"})
+        response = await async_client.get("/crypto-positions/history?days=3&interval=1d", headers=headers)
+    finally:
+        with sync_connection.cursor() as cur:
+            cur.execute("DELETE FROM user_crypto_positions;")
+            cur.execute("DELETE FROM crypto_variation;")
+            cur.execute("DELETE FROM crypto_variation_rollup;")
+            sync_connection.commit()
+
+    assert response.status_code == 200, response.text
+    payload = response.json()
+    assert payload["interval"] == "1d"
+    assert payload["timestamps"][-1] == int(today.timestamp() * 1000)
+    assert np.diff(payload["timestamps"]).tolist() == [DAY_MS] * 3
+    # Ogni giorno vale la quantità a fine giornata per la chiusura: 1 BTC a 100, poi a 200,
+    # quindi 1.5 BTC dopo l'acquisto di ieri.
+    assert payload["values"] == [100.0, 200.0, 300.0, 300.0]
+
+
+@pytest.mark.asyncio
+async def test_ledger_is_loaded_on_each_request_connection(monkeypatch):
+    """Richieste concorrenti con cache vuota caricano il ledger ciascuna sulla propria connessione."""
+    used: list[object] = []
+
+    async def fake_watermark(conn, user_id):
+        return "tx-1"
+
+    async def fake_load_ledger(conn, user_id):
+        used.append(conn)
+        await asyncio.sleep(0.01)
+        return portfolio.PortfolioLedger(assets=())
+
+    monkeypatch.setattr(portfolio, "last_transaction_id", fake_watermark)
+    monkeypatch.setattr(portfolio, "load_ledger", fake_load_ledger)
+    monkeypatch.setattr(
+        portfolio,
+        "_ledger_cache",
+        StaleWhileRevalidateCache(max_entries=4, ttl_seconds=60, stale_seconds=0),
+    )
+    first, second = object(), object()
+
+    await asyncio.gather(
+        portfolio.load_portfolio_history(first, DEFAULT_USER_ID, timedelta(days=1), "1h"),
+        portfolio.load_portfolio_history(second, DEFAULT_USER_ID, timedelta(days=1), "1h"),
+    )
+    await portfolio.load_portfolio_history(first, DEFAULT_USER_ID, timedelta(days=1), "1h")
+
+    assert sorted(map(id, used)) == sorted([id(first), id(second)])
+    assert portfolio.ledger_cache_stats()["hits"] == 1
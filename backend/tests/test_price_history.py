@@ -0,0 +1,40 @@
+"""Test unitari per la codifica colonnare/binaria dello storico prezzi."""
+
+from __future__ import annotations
+
+import struct
+
+from backend.app.services.price_history import (
+    HISTORY_BINARY,
+    HISTORY_COLUMNAR,
+    HISTORY_JSON,
+    PriceSeries,
+    negotiate_history_format,
+)
+
+ALL_FORMATS = (HISTORY_JSON, HISTORY_COLUMNAR, HISTORY_BINARY)
+
+
+def test_series_encodings_share_the_same_points():
+    series = PriceSeries.from_columns([1_000, 2_000], [10.5, 11.25])
+
+    assert series.to_points() == [{"timestamp": 1_000, "price": 10.5}, {"timestamp": 2_000, "price": 11.25}]
+    assert series.to_columns() == {"timestamps": [1_000, 2_000], "prices": [10.5, 11.25]}
+    assert series.to_binary() == struct.pack("<Q2q2d", 2, 1_000, 2_000, 10.5, 11.25)
+
+
+def test_empty_database_aggregate_yields_empty_series():
+    series = PriceSeries.from_columns(None, None)
+
+    assert len(series) == 0
+    assert series.to_binary() == struct.pack("<Q", 0)
+
+
+def test_negotiation_honours_quality_and_specificity():
+    assert negotiate_history_format(None, ALL_FORMATS) == HISTORY_JSON
+    assert negotiate_history_format("*/*", ALL_FORMATS) == HISTORY_JSON
+    assert negotiate_history_format(HISTORY_COLUMNAR, ALL_FORMATS) == HISTORY_COLUMNAR
+    assert negotiate_history_format(f"{HISTORY_BINARY}, application/json;q=0.5", ALL_FORMATS) == HISTORY_BINARY
+    assert negotiate_history_format(f"{HISTORY_JSON};q=0, */*;q=0.1", ALL_FORMATS) == HISTORY_COLUMNAR
+    assert negotiate_history_format("text/html", ALL_FORMATS) is None
+    assert negotiate_history_format(HISTORY_BINARY, (HISTORY_JSON, HISTORY_COLUMNAR)) is None
@@ -0,0 +1,64 @@
+"""Test delle quotazioni firmate."""
+
+from __future__ import annotations
+
+from datetime import datetime, timedelta, timezone
+from decimal import Decimal
+
+import pytest
+
+from backend.app.config import get_settings
+from backend.app.services.quotes import QuoteError, QuoteSigner, lifespan_quote_signer
+
+
+def test_quote_round_trip_and_expiry():
+    """Il token restituisce asset e prezzo firmati e scade dopo la durata configurata."""
+    signer = QuoteSigner(b"secret", ttl_seconds=15)
+    issued_at = datetime(2026, 10, 17, 12, 0, tzinfo=timezone.utc)
+    quote = signer.issue("user-1", "btc", Decimal("27123.456789012"), now=issued_at)
+
+    verified = signer.verify(quote.token, "user-1", "BTC")
+
+    assert verified.user_id == "user-1"
+    assert verified.asset_symbol == "BTC"
+    assert verified.price_eur == Decimal("27123.45678901")
+    assert not verified.is_expired(issued_at + timedelta(seconds=14))
+    assert verified.is_expired(issued_at + timedelta(seconds=15))
+
+
+def test_quote_rejects_tampering_other_assets_users_and_foreign_secrets():
+    """Firma alterata, asset o utente diverso e segreto diverso invalidano il token."""
+    signer = QuoteSigner(b"secret", ttl_seconds=15)
+    token = signer.issue("user-1", "BTC", Decimal("100")).token
+    payload, signature = token.split(".")
+    forged = signer.issue("user-1", "BTC", Decimal("1")).token.split(".")[0]
+
+    for bad in (f"{forged}.{signature}", "not-a-token", f"{payload}.{signature}x"):
+        with pytest.raises(QuoteError):
+            signer.verify(bad, "user-1", "BTC")
+    with pytest.raises(QuoteError):
+        signer.verify(token, "user-1", "ETH")
+    with pytest.raises(QuoteError):
+        signer.verify(token, "user-2", "BTC")
+    with pytest.raises(QuoteError):
+        QuoteSigner(b"other", ttl_seconds=15).verify(token, "user-1", "BTC")
+    assert signer.stats()["rejected"] == 5
+    assert signer.verify(signer.issue("realm:user", "BTC", Decimal("1")).token, "realm:user", "BTC").user_id == "realm:user"
+
+
+@pytest.mark.asyncio
+async def test_signer_requires_shared_secret_with_multiple_workers(monkeypatch):
+    """Senza segreto condiviso più worker rifiuterebbero le quotazioni l'uno dell'altro: l'avvio fallisce."""
+    monkeypatch.delenv("QUOTE_SIGNING_SECRET", raising=False)
+    monkeypatch.setenv("WEB_CONCURRENCY", "4")
+    get_settings.cache_clear()
+    try:
+        with pytest.raises(ValueError):
+            async with lifespan_quote_signer(get_settings()):
+                pass
+        monkeypatch.setenv("WEB_CONCURRENCY", "1")
+        get_settings.cache_clear()
+        async with lifespan_quote_signer(get_settings()) as signer:
+            assert signer.stats()["issued"] == 0
+    finally:
+        get_settings.cache_clear()
@@ -0,0 +1,106 @@
+"""Test di integrazione per la cache di mercato condivisa tra worker."""
+
+from __future__ import annotations
+
+import asyncio
+from decimal import Decimal
+
+import pytest
+
+from backend.app.services.circuit_breaker import CircuitOpenError
+from backend.app.services.price_ingestion import PriceIngestor
+from backend.app.services.shared_cache import SharedMarketCache
+
+
+@pytest.fixture()
+def cleanup_market_cache(sync_connection):
+    """Svuota la cache condivisa e i prezzi registrati prima e dopo il test."""
+    with sync_connection.cursor() as cur:
+        cur.execute("DELETE FROM market_cache;")
+        cur.execute("DELETE FROM crypto_variation;")
+        cur.execute("DELETE FROM crypto_variation_rollup;")
+        sync_connection.commit()
+    yield
+    with sync_connection.cursor() as cur:
+        cur.execute("DELETE FROM market_cache;")
+        cur.execute("DELETE FROM crypto_variation;")
+        cur.execute("DELETE FROM crypto_variation_rollup;")
+        sync_connection.commit()
+
+
+@pytest.mark.asyncio
+async def test_only_one_worker_refreshes_shared_entry(async_client, cleanup_market_cache):
+    """Due worker con lo stesso dato scaduto devono produrre una sola chiamata upstream."""
+    pool = async_client.app.state.db_pool
+    workers = [
+        SharedMarketCache(pool, owner=f"worker-{index}", poll_interval_seconds=0.01) for index in range(2)
+    ]
+    calls = 0
+    release = asyncio.Event()
+
+    async def loader():
+        nonlocal calls
+        calls += 1
+        await release.wait()
+        return [{"id": "bitcoin", "price": 1.5}]
+
+    tasks = [asyncio.create_task(worker.get_or_refresh("test:snapshot", 60, loader)) for worker in workers]
+    await asyncio.sleep(0.1)
+    release.set()
+    results = await asyncio.gather(*tasks)
+
+    assert calls == 1
+    assert results[0] == results[1] == [{"id": "bitcoin", "price": 1.5}]
+    assert sum(worker.stats()["refreshes"] for worker in workers) == 1
+    assert await workers[0].get_or_refresh("test:snapshot", 60, loader) == results[0]
+    assert calls == 1
+
+
+@pytest.mark.asyncio
+async def test_follower_stops_waiting_for_hung_lease_holder(async_client, cleanup_market_cache):
+    """Con il lease tenuto da un altro processo il follower attende poco, poi usa il valore scaduto o fallisce."""
+    pool = async_client.app.state.db_pool
+    holder = SharedMarketCache(pool, owner="hung-leader")
+    follower = SharedMarketCache(pool, owner="follower", poll_interval_seconds=0.01, max_wait_seconds=0.1)
+    calls = 0
+
+    async def loader():
+        nonlocal calls
+        calls += 1
+        return {"fresh": True}
+
+    assert await holder.try_acquire("test:hung")
+    with pytest.raises(CircuitOpenError):
+        await asyncio.wait_for(follower.get_or_refresh("test:hung", 60, loader), timeout=2)
+
+    await holder.store("test:hung", {"fresh": False}, release=False)
+    stale = await asyncio.wait_for(follower.get_or_refresh("test:hung", 0, loader), timeout=2)
+
+    assert stale == {"fresh": False}
+    assert calls == 0
+    assert follower.stats()["wait_timeouts"] == 2
+
+
+@pytest.mark.asyncio
+async def test_follower_ingestor_adopts_leader_snapshot(async_client, cleanup_market_cache, monkeypatch):
+    """Solo il worker che detiene il lease di ingestion deve interrogare CoinCap."""
+    calls = 0
+
+    async def fake_live_market():
+        nonlocal calls
+        calls += 1
+        return [{"id": "bitcoin", "symbol": "BTC", "name": "Bitcoin", "price": 42.5}], {"bitcoin": Decimal("42.5")}
+
+    monkeypatch.setattr("backend.app.services.price_ingestion.coincap.fetch_live_market", fake_live_market)
+
+    pool = async_client.app.state.db_pool
+    leader = PriceIngestor(pool, interval_seconds=60, shared_cache=SharedMarketCache(pool, owner="leader"))
+    follower = PriceIngestor(pool, interval_seconds=60, shared_cache=SharedMarketCache(pool, owner="follower"))
+
+    await leader.tick()
+    await follower.tick()
+
+    assert calls == 1
+    assert follower.latest() == leader.latest()
+    assert follower.latest()[0]["price"] == 42.5
+    assert await follower.follow() is False
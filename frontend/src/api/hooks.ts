@@ -206,6 +206,9 @@ type MarketAssetDetailResponse = {
 type MarketAssetDetailApiResponse = {
   asset: MarketAsset
   history: Array<{ timestamp: number; price: number }>
+}
+
+type MarketAssetHoldingsApiResponse = {
   position: {
     id: string
     ticker: string
@@ -654,17 +657,28 @@ type TradePayload = {
   accountId: string
   assetSymbol: string
   assetName: string
-  priceEur: number
   quantity: number
   side: 'buy' | 'sell'
 }
 
+type CryptoQuoteApiResponse = {
+  asset_symbol: string
+  asset_name: string
+  price_eur: string | number
+  expires_at: string
+  quote_token: string
+}
+
 export function useCryptoTradeMutation() {
   const apiClient = useApiClient()
   const queryClient = useQueryClient()
 
   return useMutation({
     mutationFn: async (payload: TradePayload) => {
+      // Il prezzo dell'ordine è quello firmato dal server nella quotazione, non quello mostrato a schermo.
+      const quote = await apiClient.request<CryptoQuoteApiResponse>({
+        path: `/market/quotes/${encodeURIComponent(payload.assetSymbol)}`,
+      })
       return apiClient.request<CryptoOrderResponse>({
         path: '/market/orders',
         method: 'POST',
@@ -672,7 +686,7 @@ export function useCryptoTradeMutation() {
           account_id: payload.accountId,
           asset_symbol: payload.assetSymbol,
           asset_name: payload.assetName,
-          price_eur: payload.priceEur,
+          quote_token: quote.quote_token,
           quantity: payload.quantity,
           side: payload.side,
         },
@@ -756,30 +770,32 @@ export function useMarketAssetQuery(
       if (!assetId) {
         throw new Error('Asset non specificato')
       }
-      const response = await apiClient.request<MarketAssetDetailApiResponse>({
-        path: `/market/assets/${assetId}`,
-      })
-      const position = response.position
+      // Il dettaglio di mercato è cacheabile (ETag), le holdings dell'utente sono una risorsa separata.
+      const [response, holdings] = await Promise.all([
+        apiClient.request<MarketAssetDetailApiResponse>({ path: `/market/assets/${assetId}` }),
+        apiClient.request<MarketAssetHoldingsApiResponse>({ path: `/market/assets/${assetId}/holdings` }),
+      ])
+      const position = holdings.position
         ? {
-            id: response.position.id,
-            ticker: response.position.ticker,
-            name: response.position.name,
-            amount: parseCurrencyAmount(response.position.amount),
-            eurValue: parseCurrencyAmount(response.position.eur_value),
+            id: holdings.position.id,
+            ticker: holdings.position.ticker,
+            name: holdings.position.name,
+            amount: parseCurrencyAmount(holdings.position.amount),
+            eurValue: parseCurrencyAmount(holdings.position.eur_value),
             change24hPercent:
-              response.position.change_24h_percent != null
-                ? Number(response.position.change_24h_percent)
+              holdings.position.change_24h_percent != null
+                ? Number(holdings.position.change_24h_percent)
                 : null,
-            iconUrl: response.position.icon_url,
-            priceSource: response.position.price_source,
-            network: response.position.network,
-            accountId: response.position.account_id,
-            syncedAt: response.position.synced_at,
-            createdAt: response.position.created_at,
-            updatedAt: response.position.updated_at,
+            iconUrl: holdings.position.icon_url,
+            priceSource: holdings.position.price_source,
+            network: holdings.position.network,
+            accountId: holdings.position.account_id,
+            syncedAt: holdings.position.synced_at,
+            createdAt: holdings.position.created_at,
+            updatedAt: holdings.position.updated_at,
           }
         : null
-      const transactions = response.transactions.map((transaction) => ({
+      const transactions = holdings.transactions.map((transaction) => ({
         id: transaction.id,
         accountId: transaction.account_id,
         amount: parseCurrencyAmount(transaction.amount),
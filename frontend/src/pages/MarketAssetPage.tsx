@@ -174,7 +174,6 @@ export function MarketAssetPage() {
         accountId: selectedAccountId,
         assetSymbol: asset.symbol,
         assetName: asset.name,
-        priceEur: asset.price,
         quantity: parsedQuantity,
         side: tradeSide,
       })
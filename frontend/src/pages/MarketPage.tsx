@@ -86,7 +86,6 @@ export function MarketPage() {
         accountId: selectedAccountId,
         assetSymbol: selectedAsset.symbol,
         assetName: selectedAsset.name,
-        priceEur: selectedAsset.price,
         quantity: parsedQuantity,
         side,
       })